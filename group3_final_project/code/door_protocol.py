@@ -0,0 +1,91 @@
+"""
+Door protocol shared by server_image_email.py and the simulator (sim/simnet.py)
+
+Binary frame format, command opcodes, command coalescing rules and the keyed hashes of
+temporary passwords. Standard library only, so the simulator runs without Flask or OpenCV.
+esp32_keypad_client.py (MicroPython) keeps its own copy of the client side.
+"""
+
+import hashlib
+import hmac
+import struct
+
+# Compact binary wire format for the ESP32 (/get_mobile_command, /trigger); the iOS app keeps JSON
+# Frame: magic "DS" | version (1 byte) | opcode (1 byte) | payload length (2 bytes, big-endian) | payload
+BINARY_MIMETYPE = "application/x-doorsense"
+FRAME_MAGIC = b"DS"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct(">2sBBH")
+TRIGGER_PAYLOAD = struct.Struct(">I")  # Trigger payload: timestamp (uint32), then device name
+OP_NONE = 0x00                # No pending command
+OP_UNLOCK = 0x01
+OP_LOCK = 0x02
+OP_CHANGE_PASSWORD = 0x03     # Payload: new password (ASCII digits)
+OP_TAKE_PHOTO = 0x04
+OP_DISPLAY_TEXT = 0x05        # Payload: text (UTF-8)
+OP_COMMAND = 0x06             # Payload: any other command string (UTF-8)
+OP_TRIGGER = 0x10             # ESP32 -> server: PIR trigger
+OP_TRIGGER_ACCEPTED = 0x11    # Server -> ESP32: face detection started
+OP_TRIGGER_BUSY = 0x12        # Server -> ESP32: face detection already in progress
+OP_ERROR = 0x1F               # Payload: error message (UTF-8)
+COMMAND_OPCODES = {"unlock": OP_UNLOCK, "lock": OP_LOCK, "take_photo": OP_TAKE_PHOTO}
+COMMAND_PREFIX_OPCODES = {"change_password": OP_CHANGE_PASSWORD, "display_text": OP_DISPLAY_TEXT}
+OP_COMMAND_ID = 0x07          # Payload: command ID (uint32), sent after the command frame for /ack_command
+COMMAND_ID = struct.Struct(">I")
+
+COMMAND_COALESCE_GROUPS = {     # Command name (before ":") -> group, only the newest command per group is kept
+    "unlock": "lock_state",
+    "lock": "lock_state",
+    "change_password": "change_password",
+    "display_text": "display_text",
+}
+
+TEMP_HASH_LENGTH = 32          # Hex characters of HMAC-SHA256 sent to the door
+
+def encode_frame(opcode, payload=b""):
+    """Encode binary protocol frame"""
+    payload = payload[:0xFFFF]
+    return FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, opcode, len(payload)) + payload
+
+def decode_frame(data):
+    """Decode binary protocol frame, return (opcode, payload), raise ValueError if malformed"""
+    if len(data) < FRAME_HEADER.size:
+        raise ValueError("Frame too short")
+    magic, version, opcode, length = FRAME_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise ValueError("Bad frame header")
+    if len(data) < FRAME_HEADER.size + length:
+        raise ValueError("Truncated frame payload")
+    return opcode, data[FRAME_HEADER.size:FRAME_HEADER.size + length]
+
+def encode_command_frame(command):
+    """Encode queued command string (e.g. "change_password:1234") as binary frame"""
+    if command is None:
+        return encode_frame(OP_NONE)
+    if command in COMMAND_OPCODES:
+        return encode_frame(COMMAND_OPCODES[command])
+    name, _, argument = command.partition(":")
+    if name in COMMAND_PREFIX_OPCODES:
+        return encode_frame(COMMAND_PREFIX_OPCODES[name], argument.encode("utf-8"))
+    return encode_frame(OP_COMMAND, command.encode("utf-8"))
+
+def superseded_commands(queued_commands, command):
+    """Queued commands (dicts with a "command" key) that command makes obsolete, oldest first
+    
+    Lock state, password and display text only matter in their newest form; other commands
+    (take_photo, unknown) never supersede anything.
+    """
+    group = COMMAND_COALESCE_GROUPS.get(command.partition(":")[0])
+    if group is None:
+        return []
+    return [queued for queued in queued_commands
+            if COMMAND_COALESCE_GROUPS.get(queued["command"].partition(":")[0]) == group]
+
+def temp_password_hash(secret, password, salt):
+    """Keyed hash of a temporary password as synced to the door (HMAC-SHA256 with the device secret)"""
+    return hmac.new(secret.encode("utf-8"), (salt + password).encode("utf-8"),
+                    hashlib.sha256).hexdigest()[:TEMP_HASH_LENGTH]
+
+def device_token(secret):
+    """Token the door sends to /temp_password_sync (derived from the secret, which is never sent)"""
+    return hmac.new(secret.encode("utf-8"), b"device-token", hashlib.sha256).hexdigest()[:TEMP_HASH_LENGTH]
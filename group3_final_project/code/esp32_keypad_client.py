@@ -6,27 +6,52 @@ Includes password unlock functionality
 import machine
 import network
 import urequests
+import socket
 import time
 import json
+import array
+import struct
+import hashlib
+import binascii
+import os
+import gc
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    asyncio = None
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
 
 # OLED configuration
-PIN_SCL = 22
-PIN_SDA = 20
+PIN_SCL = const(22)
+PIN_SDA = const(20)
+OLED_WIDTH = const(128)
+OLED_HEIGHT = const(32)
+
+# OLED display manager: static screens are prerendered once, only changed columns of changed
+# 8-pixel pages are sent over I2C, and nothing is sent if the screen did not change
+DISPLAY_CACHE_MAX = const(8)  # Prerendered screens kept in RAM (512 bytes each)
+DISPLAY_STATS = False  # Print I2C time/bytes after each password keypress
 
 # WiFi configuration
 WIFI_SSID = "Columbia University"
 WIFI_PASSWORD = ""
 
 # Server configuration (will prompt user input at runtime)
-SERVER_PORT = 8080
+SERVER_PORT = const(8080)
 SERVER_IP = None  # Will be input at runtime
 SERVER_URL = None
 
 # PIR sensor pin
-PIR_PIN = 26  # PIR sensor connected to GPIO26
+PIR_PIN = const(26)  # PIR sensor connected to GPIO26
 
 # Buzzer pin
-BUZZER_PIN = 15  # Buzzer connected to GPIO15
+BUZZER_PIN = const(15)  # Buzzer connected to GPIO15
 
 # Keypad pin definitions
 ROW_PINS = [27, 33, 25, 19]  # Row pins (output)
@@ -43,6 +68,138 @@ KEYS = [
 # Password configuration (global variable, can be modified)
 CORRECT_PASSWORD = "123"  # Default master password
 
+# PIR trigger timing
+TRIGGER_COOLDOWN = const(5)  # 5 second cooldown to avoid repeated triggers
+DEBOUNCE_INTERVAL = const(3)  # 3 second stabilization interval (multiple detections treated as one trigger)
+
+# Mobile command polling
+COMMAND_CHECK_INTERVAL = const(1)  # Check mobile commands once per second
+
+# Runtime mode: False = original polling loop, True = cooperative uasyncio tasks
+# (PIR, keypad, command fetch, buzzer and OLED timeouts never block each other)
+USE_ASYNC_RUNTIME = False
+PIR_POLL_MS = const(20)  # PIR sampling period (async runtime)
+KEYPAD_POLL_MS = const(20)  # Keypad scan period (async runtime)
+DISPLAY_HOLD_MS = const(3000)  # Status screens return to default after 3 seconds
+PASSWORD_TIMEOUT_MS = const(10000)  # Password input timeout, reset on each key
+HTTP_TIMEOUT = const(10)  # Seconds
+
+# Input mode (polling loop): False = sample PIR and scan keypad every loop,
+# True = Pin.irq on PIR rising edge and keypad columns, scan only after an interrupt
+USE_IRQ_INPUT = False
+IRQ_IDLE_TIMEOUT_MS = const(100)  # Max idle time between loop iterations (command polling, debounce checks)
+KEY_HELD_POLL_MS = const(20)  # Re-scan period while a key is held (release has no interrupt)
+INPUT_EVENT_BUFFER_SIZE = const(32)  # Interrupt event ring buffer size
+EVENT_PIR = const(1)
+EVENT_KEY = const(2)
+
+# HTTP client: True = one persistent HTTP/1.1 socket to the server (reconnects automatically),
+# False = new urequests connection for every call
+USE_KEEPALIVE_HTTP = True
+HTTP_RECV_BUFFER_SIZE = const(1024)  # Preallocated receive buffer (responses are small JSON objects)
+
+# Persistent connection state
+http_socket = None
+http_address = None  # (host, port) of http_socket
+http_recv_buffer = bytearray(HTTP_RECV_BUFFER_SIZE)
+http_recv_view = memoryview(http_recv_buffer)
+
+# Binary protocol (requires USE_KEEPALIVE_HTTP): compact frames for /get_mobile_command and /trigger
+# Frame: magic "DS" | version (1 byte) | opcode (1 byte) | payload length (2 bytes, big-endian) | payload
+USE_BINARY_PROTOCOL = False
+BINARY_CONTENT_TYPE = "application/x-doorsense"
+FRAME_HEADER_SIZE = const(6)
+FRAME_VERSION = const(1)
+OP_NONE = const(0x00)
+OP_UNLOCK = const(0x01)
+OP_LOCK = const(0x02)
+OP_CHANGE_PASSWORD = const(0x03)
+OP_TAKE_PHOTO = const(0x04)
+OP_DISPLAY_TEXT = const(0x05)
+OP_COMMAND = const(0x06)
+OP_COMMAND_ID = const(0x07)  # Sent after a command frame, payload: command ID (uint32) to ack
+OP_TRIGGER = const(0x10)
+OP_TRIGGER_ACCEPTED = const(0x11)
+OP_TRIGGER_BUSY = const(0x12)
+OP_ERROR = const(0x1F)
+COMMAND_NAMES = {OP_UNLOCK: "unlock", OP_LOCK: "lock", OP_TAKE_PHOTO: "take_photo"}
+COMMAND_PREFIXES = {OP_CHANGE_PASSWORD: "change_password:", OP_DISPLAY_TEXT: "display_text:", OP_COMMAND: ""}
+COMMAND_POLL_BINARY_PATH = "/get_mobile_command?format=bin"
+# Trigger frame is reused for every trigger, only the timestamp (bytes 6..9) is rewritten
+trigger_frame = bytearray(b"DS\x01\x10\x00\x09\x00\x00\x00\x00ESP32")
+
+# Mobile command acks: the server keeps a delivered command and sends it again until its ID is
+# acked, so a command is acked after execution and a redelivered one (lost ack) is not run twice
+command_ack_id = 0  # ID of the command being executed (0 = none, or the server sent no ID)
+last_executed_command_id = 0
+
+# Offline temporary passwords: the server pushes salted hashes of live codes, the door
+# verifies locally and reports each use afterwards so the code is still destroyed after one use
+USE_TEMP_PASSWORD_SYNC = True
+TEMP_SYNC_INTERVAL = const(10)  # Seconds between sync polls (an unchanged set is a tiny response)
+TEMP_HASH_LENGTH = const(32)  # Hex characters of HMAC-SHA256 (must match server)
+DEVICE_SECRET = "change-this-door-secret"  # Same value as DEVICE_SECRET on the server, never sent over the network
+TEMP_EXPIRY_MAX_MS = const(3 * 24 * 3600 * 1000)  # Cap so expiry stays within ticks_diff range
+temp_code_expiry = {}  # Salted hash -> ticks_ms when the code expires
+temp_sync_salt = None  # None until the first successful sync
+temp_sync_version = -1
+device_token = None  # Sent with /temp_password_sync, derived from DEVICE_SECRET on first use
+pending_temp_uses = []  # (code, hash, salt) of codes used offline, not yet reported (RAM only)
+
+# Store-and-forward for PIR triggers the server did not receive: bounded RAM ring, overflow
+# spills to flash, retried with exponential backoff and flushed as one batched /trigger request
+TRIGGER_QUEUE_SIZE = const(16)  # Trigger times kept in RAM
+TRIGGER_SPILL_FILE = "trigger_queue.txt"  # Flash overflow (one time per line), None = drop oldest instead
+TRIGGER_SPILL_MAX = const(64)  # Max triggers kept in the spill file
+TRIGGER_RETRY_MIN = const(2)  # Seconds before the first retry, doubled after each failure
+TRIGGER_RETRY_MAX = const(60)
+trigger_queue_times = array.array('i', [0] * TRIGGER_QUEUE_SIZE)  # time.time() of each queued trigger
+trigger_queue_head = 0  # Oldest queued trigger
+trigger_queue_count = 0
+trigger_queue_removed = 0  # Triggers that ever left the RAM head (position of trigger_queue_head in the stream)
+trigger_batch_end = 0  # trigger_queue_removed after the last RAM trigger of the batch being sent
+trigger_batch_spilled = 0  # Triggers of the batch being sent that spilled to flash during the request
+trigger_spill_count = 0  # Triggers in TRIGGER_SPILL_FILE (counted at startup)
+trigger_spill_stale = 0  # Leading lines of TRIGGER_SPILL_FILE written before this boot (their times are meaningless)
+trigger_retry_delay = TRIGGER_RETRY_MIN
+trigger_retry_at = 0  # ticks_ms of next flush attempt
+
+# Low-allocation mode: cached URLs and request heads, "no command" polls answered without parsing
+# JSON, and gc.collect() run at idle points so collections never land in the middle of key input
+LOW_ALLOC_MODE = True
+GC_COLLECT_INTERVAL_MS = const(2000)  # Scheduled collection period (only while no key is held)
+RUNTIME_STATS_INTERVAL_MS = const(30000)  # Print free memory, GC and loop timing (0 = off)
+REQUEST_HEAD_CACHE_MAX = const(8)
+JSON_HEADERS = {"Content-Type": "application/json"}
+request_head_cache = {}  # URL -> (method, content type, body length, host, port, request head bytes)
+url_cache = {}  # Path -> (server URL, full URL)
+gc_last_collect = 0  # ticks_ms of last scheduled collection
+gc_collect_count = 0
+gc_collect_max_us = 0
+loop_iterations = 0
+loop_total_us = 0
+loop_max_us = 0
+stats_last_report = 0  # ticks_ms
+
+# Interrupt event ring buffer (preallocated, handlers never allocate)
+input_event_times = array.array('i', [0] * INPUT_EVENT_BUFFER_SIZE)  # ticks_ms of each event
+input_event_types = bytearray(INPUT_EVENT_BUFFER_SIZE)
+input_event_head = 0  # Next write position (interrupt handlers)
+input_event_tail = 0  # Next read position (main loop)
+irq_input_enabled = False
+pir_edge_latched = False  # Polling runtime: PIR rose while the loop was blocked (e.g. in a network timeout)
+keypad_scanning = False  # Column interrupts are ignored while rows are being driven
+
+# Display manager state
+screen_cache = {}  # Screen key -> prerendered framebuffer bytes
+display_shown = bytearray(OLED_WIDTH * OLED_HEIGHT // 8)  # Framebuffer contents currently on the OLED
+display_shown_view = memoryview(display_shown)
+display_shown_valid = False  # False until the first full refresh
+display_full_refresh_us = 0  # I2C time of a full show() (measured at init)
+display_last_us = 0  # I2C time of the last update
+display_last_bytes = 0  # Data bytes sent by the last update
+display_skipped = 0  # Updates with nothing changed (no I2C traffic)
+
 def init_oled():
     """Initialize OLED display (128x32)"""
     try:
@@ -52,26 +209,129 @@ def init_oled():
         oled.fill(0)  # Clear screen
         oled.text("System Ready", 0, 0)
         oled.text("Initializing...", 0, 12)
-        oled.show()
-        print("OLED initialized successfully")
+        show_full(oled)
+        print("OLED initialized successfully (full refresh: {} us)".format(display_full_refresh_us))
         return oled
     except Exception as e:
         print("OLED initialization failed: {}".format(e))
         print("Please ensure ssd1306 library is installed: upip.install('micropython-ssd1306')")
         return None
 
+def show_full(oled):
+    """Send the whole framebuffer (timed, used as baseline for partial updates)"""
+    global display_shown_valid, display_full_refresh_us, display_last_us, display_last_bytes
+    start = time.ticks_us()
+    oled.show()
+    display_full_refresh_us = display_last_us = time.ticks_diff(time.ticks_us(), start)
+    display_last_bytes = len(display_shown)
+    display_shown[:] = oled.buffer
+    display_shown_valid = True
+
+def render_screen(oled, key, lines):
+    """Draw [(text, x, y)] into the framebuffer, copying the prerendered screen if key is cached"""
+    cached = screen_cache.get(key) if key is not None else None
+    if cached is not None:
+        oled.buffer[:] = cached
+        return
+    oled.fill(0)
+    for text, x, y in lines:
+        oled.text(text, x, y)
+    if key is not None and len(screen_cache) < DISPLAY_CACHE_MAX:
+        screen_cache[key] = bytes(oled.buffer)
+
+def update_display(oled):
+    """Send only changed column ranges of changed pages, skip I2C entirely if nothing changed"""
+    global display_last_us, display_last_bytes, display_skipped
+    if not display_shown_valid or not hasattr(oled, "write_data"):
+        show_full(oled)
+        return
+    buf = oled.buffer
+    view = memoryview(buf)
+    sent = 0
+    start = time.ticks_us()
+    for page in range(OLED_HEIGHT // 8):
+        first = page * OLED_WIDTH
+        last = first + OLED_WIDTH - 1
+        if buf[first:last + 1] == display_shown[first:last + 1]:
+            continue
+        # Narrow to the changed column span
+        while buf[first] == display_shown[first]:
+            first += 1
+        while buf[last] == display_shown[last]:
+            last -= 1
+        column = first - page * OLED_WIDTH
+        oled.write_cmd(0x21)  # SET_COL_ADDR
+        oled.write_cmd(column)
+        oled.write_cmd(column + last - first)
+        oled.write_cmd(0x22)  # SET_PAGE_ADDR
+        oled.write_cmd(page)
+        oled.write_cmd(page)
+        oled.write_data(view[first:last + 1])
+        display_shown_view[first:last + 1] = view[first:last + 1]
+        sent += last - first + 1
+    if sent:
+        display_last_us = time.ticks_diff(time.ticks_us(), start)
+    else:
+        display_last_us = 0
+        display_skipped += 1
+    display_last_bytes = sent
+
+def print_display_stats():
+    """Print I2C cost of the last OLED update against a full refresh"""
+    print("OLED update: {} bytes, {} us (full refresh: {} bytes, {} us, skipped updates: {})".format(
+        display_last_bytes, display_last_us, len(display_shown), display_full_refresh_us, display_skipped))
+
+def collect_garbage_if_due(idle):
+    """Run gc.collect() at an idle point once per GC_COLLECT_INTERVAL_MS (short, predictable pauses)"""
+    global gc_last_collect, gc_collect_count, gc_collect_max_us
+    now = time.ticks_ms()
+    if not idle or time.ticks_diff(now, gc_last_collect) < GC_COLLECT_INTERVAL_MS:
+        return
+    start = time.ticks_us()
+    gc.collect()
+    elapsed = time.ticks_diff(time.ticks_us(), start)
+    gc_last_collect = now
+    gc_collect_count += 1
+    if elapsed > gc_collect_max_us:
+        gc_collect_max_us = elapsed
+
+def record_loop_time(elapsed_us):
+    """Add one main loop iteration (async runtime: event loop lateness) to the runtime stats"""
+    global loop_iterations, loop_total_us, loop_max_us
+    loop_iterations += 1
+    loop_total_us += elapsed_us
+    if elapsed_us > loop_max_us:
+        loop_max_us = elapsed_us
+
+def report_runtime_stats():
+    """Print free memory, GC and loop timing once per RUNTIME_STATS_INTERVAL_MS, then reset counters"""
+    global stats_last_report, loop_iterations, loop_total_us, loop_max_us, gc_collect_count, gc_collect_max_us
+    if not RUNTIME_STATS_INTERVAL_MS:
+        return
+    now = time.ticks_ms()
+    if time.ticks_diff(now, stats_last_report) < RUNTIME_STATS_INTERVAL_MS:
+        return
+    if loop_iterations:
+        print("Runtime: mem_free {} bytes, loop avg {} us / max {} us ({} iterations), gc {} times (max {} us)".format(
+            gc.mem_free(), loop_total_us // loop_iterations, loop_max_us, loop_iterations,
+            gc_collect_count, gc_collect_max_us))
+    stats_last_report = now
+    loop_iterations = loop_total_us = loop_max_us = 0
+    gc_collect_count = gc_collect_max_us = 0
+
 def display_default_status(oled):
     """Display default status prompt"""
     if oled is None:
         return
     
     try:
-        oled.fill(0)  # Clear screen
-        oled.text("Press A to enter", 0, 0)
-        oled.text("password", 0, 8)
-        oled.text("# to finish", 0, 16)
-        oled.text("B to back", 0, 24)
-        oled.show()
+        render_screen(oled, "default", (
+            ("Press A to enter", 0, 0),
+            ("password", 0, 8),
+            ("# to finish", 0, 16),
+            ("B to back", 0, 24)
+        ))
+        update_display(oled)
     except Exception as e:
         print("OLED display error: {}".format(e))
 
@@ -81,16 +341,14 @@ def display_unlock_status(oled, status, password_type=""):
         return
     
     try:
-        oled.fill(0)  # Clear screen
         if status:
-            oled.text("DOOR UNLOCKED", 0, 0)
+            lines = [("DOOR UNLOCKED", 0, 0), ("Access Granted", 0, 24)]
             if password_type:
-                oled.text("Type: " + password_type, 0, 12)
-            oled.text("Access Granted", 0, 24)
+                lines.append(("Type: " + password_type, 0, 12))
+            render_screen(oled, "unlocked_" + password_type, lines)
         else:
-            oled.text("DOOR LOCKED", 0, 0)
-            oled.text("Access Denied", 0, 12)
-        oled.show()
+            render_screen(oled, "locked", (("DOOR LOCKED", 0, 0), ("Access Denied", 0, 12)))
+        update_display(oled)
     except Exception as e:
         print("OLED display error: {}".format(e))
 
@@ -100,11 +358,13 @@ def display_command_status(oled, command):
         return
     
     try:
-        oled.fill(0)  # Clear screen
-        oled.text(command.upper(), 0, 0)
-        oled.text("From Mobile", 0, 12)
-        oled.text("Processing...", 0, 24)
-        oled.show()
+        # Only unlock/lock screens are prerendered, other commands are drawn each time
+        render_screen(oled, "command_" + command if command in ("unlock", "lock") else None, (
+            (command.upper(), 0, 0),
+            ("From Mobile", 0, 12),
+            ("Processing...", 0, 24)
+        ))
+        update_display(oled)
     except Exception as e:
         print("OLED display error: {}".format(e))
 
@@ -117,30 +377,15 @@ def display_custom_text(oled, text):
         oled.fill(0)  # Clear screen
         
         # Process text display (128x32 OLED, approximately 21 characters per line)
-        # Split text into multiple lines
-        lines = []
-        current_line = ""
-        
-        for char in text:
-            # If current line plus new character exceeds 21 characters, start a new line
-            if len(current_line) >= 21:
-                lines.append(current_line)
-                current_line = char
-            else:
-                current_line += char
-        
-        if current_line:
-            lines.append(current_line)
-        
-        # Display at most 3 lines (32 pixel height, approximately 10 pixels per line)
-        display_lines = lines[:3]
-        y_positions = [0, 11, 22]
-        
-        for i, line in enumerate(display_lines):
-            if i < len(y_positions):
-                oled.text(line[:21], 0, y_positions[i])  # Ensure no more than 21 characters
+        # Display at most 3 lines (32 pixel height, approximately 10 pixels per line), one slice per line
+        y_positions = (0, 11, 22)
+        for i in range(3):
+            line = text[i * 21:(i + 1) * 21]
+            if not line:
+                break
+            oled.text(line, 0, y_positions[i])
         
-        oled.show()
+        update_display(oled)
     except Exception as e:
         print("OLED custom text display error: {}".format(e))
 
@@ -150,15 +395,17 @@ def display_password_input(oled, password_length):
         return
     
     try:
-        oled.fill(0)  # Clear screen
-        oled.text("Enter Password", 0, 0)
+        # Static title comes from the prerendered screen, only the input lines are drawn
+        render_screen(oled, "password", (("Enter Password", 0, 0),))
         # Display asterisks, at most 12 characters (128 pixel width limit)
         display_text = "*" * min(password_length, 12)
         if password_length > 12:
             display_text = "*" * 12  # Only show first 12
         oled.text(display_text, 0, 12)
         oled.text("Len: {}".format(password_length), 0, 24)
-        oled.show()
+        update_display(oled)
+        if DISPLAY_STATS:
+            print_display_stats()
     except Exception as e:
         print("OLED display error: {}".format(e))
 
@@ -205,10 +452,74 @@ def beep_buzzer(buzzer_pin, duration_ms=200, frequency=2000):
         time.sleep_ms(duration_ms)
         buzzer_pin.value(0)
 
+def push_input_event(event_type):
+    """Add event to the interrupt ring buffer (called from IRQ handlers, drops event if full)"""
+    global input_event_head
+    next_head = (input_event_head + 1) % INPUT_EVENT_BUFFER_SIZE
+    if next_head == input_event_tail:
+        return
+    input_event_times[input_event_head] = time.ticks_ms()
+    input_event_types[input_event_head] = event_type
+    input_event_head = next_head
+
+def pir_irq_handler(pin):
+    """PIR rising edge interrupt"""
+    push_input_event(EVENT_PIR)
+
+def pir_latch_handler(pin):
+    """PIR rising edge interrupt for the polling runtime (a pulse shorter than a blocking call is not lost)"""
+    global pir_edge_latched
+    pir_edge_latched = True
+
+def keypad_irq_handler(pin):
+    """Keypad column falling edge interrupt (any key pressed while all rows are low)"""
+    if not keypad_scanning:
+        push_input_event(EVENT_KEY)
+
+def setup_irq_input(pir, rows, cols):
+    """Enable interrupt-driven PIR and keypad input"""
+    global irq_input_enabled
+    # Hold all rows low so pressing any key pulls its column low
+    for row in rows:
+        row.value(0)
+    pir.irq(trigger=machine.Pin.IRQ_RISING, handler=pir_irq_handler)
+    for col in cols:
+        col.irq(trigger=machine.Pin.IRQ_FALLING, handler=keypad_irq_handler)
+    irq_input_enabled = True
+    print("Interrupt input enabled (PIR rising edge, keypad columns)")
+
+def drain_input_events():
+    """Drain interrupt ring buffer, return (ticks_ms of first PIR edge or None, key event seen)"""
+    global input_event_tail
+    pir_time = None
+    key_event = False
+    while input_event_tail != input_event_head:
+        if input_event_types[input_event_tail] == EVENT_PIR:
+            if pir_time is None:
+                pir_time = input_event_times[input_event_tail]
+        else:
+            key_event = True
+        input_event_tail = (input_event_tail + 1) % INPUT_EVENT_BUFFER_SIZE
+    return pir_time, key_event
+
+def wait_for_input_event(timeout_ms):
+    """Idle the CPU until an interrupt event arrives or timeout_ms passes"""
+    deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+    while input_event_tail == input_event_head and time.ticks_diff(deadline, time.ticks_ms()) > 0:
+        # Sleeps until the next interrupt (pin IRQ or system tick)
+        machine.idle()
+
 def scan_keypad(rows, cols):
     """Scan keypad, return pressed key (improved version)"""
+    global keypad_scanning
     key = None
     
+    if irq_input_enabled:
+        # Rows are held low while idle, release them all before scanning one by one
+        keypad_scanning = True
+        for row in rows:
+            row.value(1)
+    
     # Scan each row
     for i, row in enumerate(rows):
         row.value(0)  # Pull current row low
@@ -224,8 +535,492 @@ def scan_keypad(rows, cols):
         if key:
             break
     
+    if irq_input_enabled:
+        for row in rows:
+            row.value(0)
+        keypad_scanning = False
+    
     return key
 
+def split_url(url):
+    """Split http://host:port/path into (host, port, path)"""
+    rest = url.split("://", 1)[-1]
+    slash = rest.find("/")
+    if slash < 0:
+        host_port, path = rest, "/"
+    else:
+        host_port, path = rest[:slash], rest[slash:]
+    if ":" in host_port:
+        host, port = host_port.split(":", 1)
+        return host, int(port), path
+    return host_port, 80, path
+
+class KeepAliveResponse:
+    """Minimal urequests-compatible response returned by the keep-alive client"""
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return str(self.content, "utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        # Connection stays open for the next request
+        pass
+
+def http_close():
+    """Close persistent connection"""
+    global http_socket
+    if http_socket is not None:
+        try:
+            http_socket.close()
+        except Exception:
+            pass
+        http_socket = None
+
+def http_connect(host, port, timeout):
+    """Open persistent connection to server"""
+    global http_socket, http_address
+    http_close()
+    sock = socket.socket()
+    sock.settimeout(timeout)
+    sock.connect(socket.getaddrinfo(host, port)[0][-1])
+    http_socket = sock
+    http_address = (host, port)
+
+def find_in_buffer(buf, pattern, start, end):
+    """Find pattern in buf[start:end] without allocating (bytearray has no find() in MicroPython), -1 if missing"""
+    first = pattern[0]
+    pattern_len = len(pattern)
+    i = start
+    last = end - pattern_len
+    while i <= last:
+        if buf[i] == first:
+            j = 1
+            while j < pattern_len and buf[i + j] == pattern[j]:
+                j += 1
+            if j == pattern_len:
+                return i
+        i += 1
+    return -1
+
+def find_header_value(buf, end, name):
+    """Find integer value of header name (bytes, e.g. b"content-length:") in buf[:end], or -1"""
+    # Compare case-insensitively without allocating a lowercase copy
+    name_len = len(name)
+    i = find_in_buffer(buf, b"\r\n", 0, end)
+    while 0 <= i < end:
+        start = i + 2
+        j = 0
+        while j < name_len and start + j < end and (buf[start + j] | 0x20) == (name[j] | 0x20):
+            j += 1
+        if j == name_len:
+            k = start + j
+            while k < end and buf[k] == 32:
+                k += 1
+            value = 0
+            while k < end and 48 <= buf[k] <= 57:
+                value = value * 10 + buf[k] - 48
+                k += 1
+            return value
+        i = find_in_buffer(buf, b"\r\n", start, end)
+    return -1
+
+def read_http_response(sock):
+    """Read one HTTP response into the preallocated buffer, return (status code, body, keep-alive)"""
+    received = 0
+    header_end = -1
+    while header_end < 0:
+        if received >= HTTP_RECV_BUFFER_SIZE:
+            raise OSError("HTTP header too large")
+        n = sock.readinto(http_recv_view[received:])
+        if not n:
+            # Server closed the connection (e.g. idle keep-alive timeout)
+            raise OSError("connection closed" if received == 0 else "incomplete response")
+        # Only search the newly received bytes (plus 3 in case the terminator was split)
+        header_end = find_in_buffer(http_recv_buffer, b"\r\n\r\n", max(0, received - 3), received + n)
+        received += n
+
+    # "HTTP/1.1 200 OK": status code digits at offset 9..11
+    status_code = (http_recv_buffer[9] - 48) * 100 + (http_recv_buffer[10] - 48) * 10 + (http_recv_buffer[11] - 48)
+    body_start = header_end + 4
+    content_length = find_header_value(http_recv_buffer, header_end, b"content-length:")
+    # HTTP/1.1 keeps the connection open unless the server says "Connection: close"
+    keep_alive = http_recv_buffer[7] == 49 and find_in_buffer(http_recv_buffer, b"onnection: close", 0, header_end) < 0
+
+    if content_length < 0:
+        # No length: body ends when the server closes the connection
+        body = bytearray(http_recv_view[body_start:received])
+        while True:
+            chunk = sock.recv(512)
+            if not chunk:
+                break
+            body.extend(chunk)
+        return status_code, body, False
+
+    body_end = body_start + content_length
+    if body_end <= HTTP_RECV_BUFFER_SIZE:
+        while received < body_end:
+            n = sock.readinto(http_recv_view[received:body_end])
+            if not n:
+                raise OSError("incomplete response")
+            received += n
+        return status_code, http_recv_view[body_start:body_end], keep_alive
+
+    # Larger than the preallocated buffer (rare): read the rest into a new buffer
+    body = bytearray(content_length)
+    got = received - body_start
+    body[:got] = http_recv_view[body_start:received]
+    body_view = memoryview(body)
+    while got < content_length:
+        n = sock.readinto(body_view[got:])
+        if not n:
+            raise OSError("incomplete response")
+        got += n
+    return status_code, body, keep_alive
+
+def http_exchange(method, url, body=b"", content_type="application/json", timeout=HTTP_TIMEOUT):
+    """Send request over the persistent connection, reconnecting if the server closed it
+    
+    Returns (status code, body). The body may be a view into the shared receive buffer,
+    valid only until the next request.
+    """
+    entry = request_head_cache.get(url)
+    if entry is not None and entry[0] == method and entry[1] == content_type and entry[2] == len(body):
+        # Same request as last time (polling): reuse the encoded head
+        host, port, request_head = entry[3], entry[4], entry[5]
+    else:
+        host, port, path = split_url(url)
+        request_head = "{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n\r\n".format(
+            method, path, host, content_type, len(body)).encode()
+        if LOW_ALLOC_MODE and (url in request_head_cache or len(request_head_cache) < REQUEST_HEAD_CACHE_MAX):
+            request_head_cache[url] = (method, content_type, len(body), host, port, request_head)
+
+    for attempt in range(2):
+        reused = http_socket is not None and http_address[0] == host and http_address[1] == port
+        if not reused:
+            http_connect(host, port, timeout)
+        sent = False
+        try:
+            http_socket.settimeout(timeout)
+            http_socket.sendall(request_head)
+            if body:
+                http_socket.sendall(body)
+            sent = True
+            status_code, content, keep_alive = read_http_response(http_socket)
+        except OSError as e:
+            http_close()
+            # A reused socket may have been closed by the server while idle: retry once on a new one.
+            # Once a POST is sent the server may already have handled it (consumed a code, recorded
+            # a trigger), so only GETs are resent; callers retry POSTs through their own queues
+            if reused and attempt == 0 and (not sent or (method == "GET" and "connection closed" in str(e))):
+                continue
+            raise
+        if not keep_alive:
+            http_close()
+        return status_code, content
+
+def keepalive_request(method, url, data=None, timeout=HTTP_TIMEOUT):
+    """Send JSON request over the persistent connection, return urequests-compatible response"""
+    body = json.dumps(data).encode() if data is not None else b""
+    status_code, content = http_exchange(method, url, body, "application/json", timeout)
+    return KeepAliveResponse(status_code, bytes(content))
+
+def http_post(url, json=None, headers=None, timeout=HTTP_TIMEOUT):
+    """POST JSON (keep-alive client or urequests, see USE_KEEPALIVE_HTTP)"""
+    if USE_KEEPALIVE_HTTP:
+        return keepalive_request("POST", url, json, timeout)
+    return urequests.post(url, json=json, headers=headers, timeout=timeout)
+
+def http_get(url, timeout=HTTP_TIMEOUT):
+    """GET (keep-alive client or urequests, see USE_KEEPALIVE_HTTP)"""
+    if USE_KEEPALIVE_HTTP:
+        return keepalive_request("GET", url, None, timeout)
+    return urequests.get(url, timeout=timeout)
+
+def parse_frame(body):
+    """Return (opcode, payload length) of a binary protocol frame, or (-1, 0) if malformed"""
+    if len(body) < FRAME_HEADER_SIZE or body[0] != 0x44 or body[1] != 0x53 or body[2] != FRAME_VERSION:
+        return -1, 0
+    length = (body[4] << 8) | body[5]
+    if len(body) < FRAME_HEADER_SIZE + length:
+        return -1, 0
+    return body[3], length
+
+def cached_url(server_url, path):
+    """Return server_url + path, built once per server (polling reuses the same string)"""
+    entry = url_cache.get(path)
+    if entry is None or entry[0] is not server_url:
+        entry = (server_url, server_url + path)
+        url_cache[path] = entry
+    return entry[1]
+
+def parse_command_id(body, offset):
+    """Return command ID from the OP_COMMAND_ID frame at body[offset:], or 0 if there is none"""
+    if (len(body) < offset + FRAME_HEADER_SIZE + 4 or body[offset] != 0x44 or body[offset + 1] != 0x53
+            or body[offset + 3] != OP_COMMAND_ID):
+        return 0
+    i = offset + FRAME_HEADER_SIZE
+    return (body[i] << 24) | (body[i + 1] << 16) | (body[i + 2] << 8) | body[i + 3]
+
+def accept_command_id(command_id):
+    """Remember command ID for the ack, return False if this command was already executed"""
+    global command_ack_id
+    command_ack_id = command_id
+    return command_id == 0 or command_id != last_executed_command_id
+
+def ack_mobile_command(server_url):
+    """Ack the executed command so the server stops delivering it (a failed ack is retried on redelivery)"""
+    global command_ack_id, last_executed_command_id
+    if not command_ack_id:
+        return
+    last_executed_command_id = command_ack_id
+    try:
+        response = http_post(
+            server_url + "/ack_command",
+            json={"id": command_ack_id},
+            headers=JSON_HEADERS,
+            timeout=5
+        )
+        response.close()
+    except Exception:
+        # Lease runs out and the server sends the command again, accept_command_id skips it
+        pass
+    command_ack_id = 0
+
+def get_mobile_command_low_alloc(server_url):
+    """Get mobile command over the keep-alive connection, "no command" replies are not parsed"""
+    try:
+        status_code, body = http_exchange("GET", cached_url(server_url, "/get_mobile_command"), b"", "application/json", 5)
+        if status_code != 200:
+            return None
+        body_len = len(body)
+        if (find_in_buffer(body, b'"has_command":false', 0, body_len) >= 0
+                or find_in_buffer(body, b'"has_command": false', 0, body_len) >= 0):
+            return None
+        result = json.loads(bytes(body))
+        if result.get('has_command', False):
+            if not accept_command_id(result.get('id', 0)):
+                ack_mobile_command(server_url)
+                return None
+            return result.get('command', None)
+        return None
+    except Exception:
+        # Silent failure, same as get_mobile_command
+        return None
+
+def get_mobile_command_binary(server_url):
+    """Get mobile command using the binary protocol (no JSON parsing)"""
+    try:
+        status_code, body = http_exchange("GET", cached_url(server_url, COMMAND_POLL_BINARY_PATH), timeout=5)
+        if status_code != 200:
+            return None
+        opcode, length = parse_frame(body)
+        if opcode <= OP_NONE:
+            return None
+        if opcode in COMMAND_NAMES:
+            command = COMMAND_NAMES[opcode]
+        elif opcode in COMMAND_PREFIXES:
+            # Rebuild command string understood by execute_mobile_command
+            payload = str(bytes(body[FRAME_HEADER_SIZE:FRAME_HEADER_SIZE + length]), "utf-8")
+            command = COMMAND_PREFIXES[opcode] + payload
+        else:
+            return None
+        if not accept_command_id(parse_command_id(body, FRAME_HEADER_SIZE + length)):
+            ack_mobile_command(server_url)
+            return None
+        return command
+    except Exception:
+        # Silent failure, same as JSON polling
+        return None
+
+def send_trigger_binary(url):
+    """Send PIR trigger request using the binary protocol"""
+    try:
+        print("Sending PIR trigger request to server (binary)...")
+        struct.pack_into(">I", trigger_frame, FRAME_HEADER_SIZE, int(time.time()) & 0xFFFFFFFF)
+        status_code, body = http_exchange("POST", url + "/trigger", trigger_frame, BINARY_CONTENT_TYPE)
+        opcode, _ = parse_frame(body)
+        if status_code == 200 and opcode == OP_TRIGGER_ACCEPTED:
+            print("✓ Server response successful! Face detection started")
+            return True
+        elif status_code == 200 and opcode == OP_TRIGGER_BUSY:
+            print("✓ Server response successful! Face detection already in progress")
+            return True
+        else:
+            print("✗ Server response failed, status code:", status_code)
+            return False
+    except Exception as e:
+        print("✗ Request error:", e)
+        return False
+
+def count_spilled_triggers():
+    """Count triggers left in the spill file (e.g. from before a soft reset)"""
+    global trigger_spill_count, trigger_spill_stale
+    trigger_spill_count = 0
+    trigger_spill_stale = 0
+    if TRIGGER_SPILL_FILE is None:
+        return 0
+    try:
+        with open(TRIGGER_SPILL_FILE) as f:
+            for line in f:
+                if line.strip():
+                    trigger_spill_count += 1
+    except OSError:
+        pass
+    # No RTC: time.time() restarted at boot, so the stored times cannot be turned into ages
+    trigger_spill_stale = trigger_spill_count
+    return trigger_spill_count
+
+def pending_trigger_count():
+    """Number of triggers waiting to be sent"""
+    return trigger_queue_count + trigger_spill_count
+
+def spill_trigger(event_time):
+    """Move one trigger from RAM to the flash spill file, return True if it was written"""
+    global trigger_spill_count
+    if TRIGGER_SPILL_FILE is None or trigger_spill_count >= TRIGGER_SPILL_MAX:
+        print("⚠️  Trigger queue full, oldest trigger dropped")
+        return False
+    try:
+        with open(TRIGGER_SPILL_FILE, "a") as f:
+            f.write("{}\n".format(event_time))
+        trigger_spill_count += 1
+        return True
+    except OSError as e:
+        print("⚠️  Trigger spill failed, oldest trigger dropped: {}".format(e))
+        return False
+
+def enqueue_trigger(event_time):
+    """Queue a trigger the server did not receive (oldest RAM entry spills to flash when full)"""
+    global trigger_queue_head, trigger_queue_count, trigger_queue_removed, trigger_batch_spilled
+    if trigger_queue_count == TRIGGER_QUEUE_SIZE:
+        # The head may be part of a batch still being sent: its spilled line is removed with the batch
+        in_batch = trigger_queue_removed < trigger_batch_end
+        if spill_trigger(trigger_queue_times[trigger_queue_head]) and in_batch:
+            trigger_batch_spilled += 1
+        trigger_queue_head = (trigger_queue_head + 1) % TRIGGER_QUEUE_SIZE
+        trigger_queue_count -= 1
+        trigger_queue_removed += 1
+    trigger_queue_times[(trigger_queue_head + trigger_queue_count) % TRIGGER_QUEUE_SIZE] = event_time
+    trigger_queue_count += 1
+    print("Trigger queued for retry ({} pending)".format(pending_trigger_count()))
+
+def get_trigger_batch():
+    """Return (batched /trigger request body, spill file lines included), oldest trigger first
+    The RAM triggers included are remembered for clear_trigger_batch"""
+    global trigger_batch_end, trigger_batch_spilled
+    now = int(time.time())
+    spill_count = trigger_spill_count
+    times = []
+    if trigger_spill_count:
+        try:
+            with open(TRIGGER_SPILL_FILE) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        times.append(int(line) if len(times) >= trigger_spill_stale else None)
+        except (OSError, ValueError) as e:
+            print("⚠️  Trigger spill file unreadable: {}".format(e))
+    for i in range(trigger_queue_count):
+        times.append(trigger_queue_times[(trigger_queue_head + i) % TRIGGER_QUEUE_SIZE])
+    trigger_batch_end = trigger_queue_removed + trigger_queue_count
+    trigger_batch_spilled = 0
+    # Ages instead of times (server and ESP32 clocks differ); None if queued before this boot
+    events = [{"age": now - t if t is not None and now >= t else None} for t in times]
+    return {
+        "action": "pir_trigger_face_detection",
+        "device": "ESP32",
+        "trigger": "PIR_sensor",
+        "events": events
+    }, spill_count
+
+def drop_spilled_triggers(count):
+    """Remove the first count lines of the spill file"""
+    global trigger_spill_count, trigger_spill_stale
+    count = min(count, trigger_spill_count)
+    if not count:
+        return
+    trigger_spill_count -= count
+    trigger_spill_stale = max(0, trigger_spill_stale - count)
+    try:
+        if trigger_spill_count == 0:
+            os.remove(TRIGGER_SPILL_FILE)
+            return
+        with open(TRIGGER_SPILL_FILE) as f:
+            lines = [line for line in f if line.strip()]
+        with open(TRIGGER_SPILL_FILE, "w") as f:
+            for line in lines[count:]:
+                f.write(line)
+    except OSError:
+        pass
+
+def clear_trigger_batch(spill_count):
+    """Drop triggers the server accepted (triggers queued or spilled during the request stay)"""
+    global trigger_queue_head, trigger_queue_count, trigger_queue_removed, trigger_batch_end, trigger_retry_delay
+    # RAM triggers of the batch that did not spill to flash while the request was in flight
+    sent = max(0, trigger_batch_end - trigger_queue_removed)
+    trigger_queue_head = (trigger_queue_head + sent) % TRIGGER_QUEUE_SIZE
+    trigger_queue_count -= sent
+    trigger_queue_removed += sent
+    # Spilled lines that were sent: the ones read for the batch, then the batch's own RAM triggers
+    drop_spilled_triggers(spill_count + trigger_batch_spilled)
+    trigger_batch_end = trigger_queue_removed
+    trigger_retry_delay = TRIGGER_RETRY_MIN
+
+def trigger_flush_failed():
+    """Schedule next flush attempt with exponential backoff"""
+    global trigger_retry_delay, trigger_retry_at, trigger_batch_end
+    trigger_batch_end = trigger_queue_removed  # Nothing in flight any more
+    trigger_retry_at = time.ticks_add(time.ticks_ms(), trigger_retry_delay * 1000)
+    print("Trigger retry in {} seconds ({} pending)".format(trigger_retry_delay, pending_trigger_count()))
+    trigger_retry_delay = min(trigger_retry_delay * 2, TRIGGER_RETRY_MAX)
+
+def trigger_flush_due():
+    """True if queued triggers are waiting and the backoff delay has passed"""
+    return pending_trigger_count() > 0 and time.ticks_diff(time.ticks_ms(), trigger_retry_at) >= 0
+
+def flush_trigger_queue(url):
+    """Send all queued triggers in one batched request"""
+    request_data, spill_count = get_trigger_batch()
+    print("Sending {} queued PIR trigger(s) to server...".format(len(request_data["events"])))
+    try:
+        response = http_post(
+            url + "/trigger",
+            json=request_data,
+            headers=JSON_HEADERS,
+            timeout=10
+        )
+        status_code = response.status_code
+        result = response.json() if status_code == 200 else None
+        response.close()
+    except Exception as e:
+        print("✗ Request error:", e)
+        status_code = None
+    if status_code == 200:
+        clear_trigger_batch(spill_count)
+        print("✓ Queued triggers delivered, face detection: {}".format(result.get('detection', 'unknown')))
+        return True
+    trigger_flush_failed()
+    return False
+
+def send_or_queue_trigger(url):
+    """Send PIR trigger, keeping it for retry if the server is unreachable"""
+    event_time = int(time.time())
+    if pending_trigger_count():
+        # Keep order: the new trigger goes out with the queued ones (server runs detection for the newest)
+        enqueue_trigger(event_time)
+        return flush_trigger_queue(url)
+    if send_request_to_server(url):
+        return True
+    enqueue_trigger(event_time)
+    trigger_flush_failed()
+    return False
+
 def verify_temp_password(server_url, password):
     """Verify temporary password with server"""
     try:
@@ -233,8 +1028,8 @@ def verify_temp_password(server_url, password):
             "password": password
         }
         
-        headers = {"Content-Type": "application/json"}
-        response = urequests.post(
+        headers = JSON_HEADERS
+        response = http_post(
             server_url + "/verify_temp_password",
             json=request_data,
             headers=headers,
@@ -261,11 +1056,11 @@ def verify_temp_password(server_url, password):
 def generate_temp_password(server_url):
     """Request server to generate temporary password"""
     try:
-        headers = {"Content-Type": "application/json"}
+        headers = JSON_HEADERS
         full_url = server_url + "/generate_temp_password"
         print("Connecting to: {}".format(full_url))
         
-        response = urequests.post(
+        response = http_post(
             full_url,
             headers=headers,
             timeout=10
@@ -315,6 +1110,87 @@ def generate_temp_password(server_url):
             print("  Error code/details: {}".format(e.args))
         return None
 
+def hmac_sha256(key, message):
+    """HMAC-SHA256 of message (MicroPython has no hmac module)"""
+    if len(key) > 64:
+        key = hashlib.sha256(key).digest()
+    key = key + b"\x00" * (64 - len(key))
+    inner = hashlib.sha256(bytes(b ^ 0x36 for b in key) + message).digest()
+    return hashlib.sha256(bytes(b ^ 0x5C for b in key) + inner).digest()
+
+def hash_temp_password(password, salt):
+    """Keyed hash of a temporary password (same format as the server)"""
+    digest = hmac_sha256(DEVICE_SECRET.encode(), (salt + password).encode())
+    return binascii.hexlify(digest)[:TEMP_HASH_LENGTH].decode()
+
+def temp_sync_path():
+    """Path of the sync request (version and device token)"""
+    global device_token
+    if device_token is None:
+        device_token = binascii.hexlify(hmac_sha256(DEVICE_SECRET.encode(), b"device-token"))[:TEMP_HASH_LENGTH].decode()
+    return "/temp_password_sync?version={}&token={}".format(temp_sync_version, device_token)
+
+def apply_temp_sync(result):
+    """Replace local temporary password hashes with a sync response"""
+    global temp_code_expiry, temp_sync_salt, temp_sync_version
+    if not result.get('changed', False):
+        return
+    now = time.ticks_ms()
+    expiry = {}
+    for code_hash, expires_in in result.get('codes', []):
+        expiry[code_hash] = time.ticks_add(now, min(expires_in * 1000, TEMP_EXPIRY_MAX_MS))
+    # Codes used here but not yet reported must not come back with the new set (rehashed, the salt rotates)
+    for code, _, _ in pending_temp_uses:
+        expiry.pop(hash_temp_password(code, result['salt']), None)
+    temp_code_expiry = expiry
+    temp_sync_salt = result['salt']
+    temp_sync_version = result['version']
+    print("Temporary passwords synced: {} live code(s)".format(len(expiry)))
+
+def sync_temp_passwords(server_url):
+    """Download keyed hashes of live temporary passwords (skipped by server if unchanged)"""
+    try:
+        response = http_get(server_url + temp_sync_path(), timeout=5)
+        if response.status_code == 200:
+            apply_temp_sync(response.json())
+        response.close()
+    except Exception:
+        # Silent failure, codes from the last sync stay usable offline
+        pass
+
+def report_temp_password_uses(server_url):
+    """Report offline temporary password uses so the server destroys them (retried until sent)"""
+    while pending_temp_uses:
+        _, code_hash, salt = pending_temp_uses[0]
+        try:
+            response = http_post(
+                server_url + "/consume_temp_password",
+                json={"hash": code_hash, "salt": salt},
+                headers=JSON_HEADERS,
+                timeout=5
+            )
+            status_code = response.status_code
+            response.close()
+        except Exception:
+            return
+        if status_code != 200:
+            return
+        pending_temp_uses.pop(0)
+
+def verify_temp_password_local(password):
+    """Verify temporary password against synced hashes in O(1)
+    Returns True, or None when the code is not in the synced set: it may have been created since the
+    last sync, so the caller asks the server (offline that check fails and the code is refused)"""
+    if temp_sync_salt is None:
+        return None
+    code_hash = hash_temp_password(password, temp_sync_salt)
+    expiry = temp_code_expiry.pop(code_hash, None)
+    if expiry is not None and time.ticks_diff(expiry, time.ticks_ms()) > 0:
+        # One use only: removed locally now, reported to the server by the sync loop
+        pending_temp_uses.append((password, code_hash, temp_sync_salt))
+        return True
+    return None
+
 def check_password(rows, cols, buzzer, server_url, oled):
     """Check password input"""
     password_input = ""
@@ -356,9 +1232,12 @@ def check_password(rows, cols, buzzer, server_url, oled):
                     display_default_status(oled)
                     return True
                 else:
-                    # Check if it's a temporary password
+                    # Check if it's a temporary password (locally if synced, otherwise with server)
                     print("Checking temporary password...")
-                    if verify_temp_password(server_url, password_input):
+                    temp_valid = verify_temp_password_local(password_input) if USE_TEMP_PASSWORD_SYNC else None
+                    if temp_valid is None:
+                        temp_valid = verify_temp_password(server_url, password_input)
+                    if temp_valid:
                         print("✓ Temporary password correct!")
                         beep_buzzer(buzzer, 500, 2500)  # Beep 0.5 seconds
                         display_unlock_status(oled, True, "Temp")
@@ -407,14 +1286,21 @@ def check_password(rows, cols, buzzer, server_url, oled):
 
 def get_mobile_command(server_url):
     """Get mobile command from server (polling)"""
+    if USE_BINARY_PROTOCOL and USE_KEEPALIVE_HTTP:
+        return get_mobile_command_binary(server_url)
+    if LOW_ALLOC_MODE and USE_KEEPALIVE_HTTP:
+        return get_mobile_command_low_alloc(server_url)
     try:
-        response = urequests.get(server_url + "/get_mobile_command", timeout=5)
+        response = http_get(server_url + "/get_mobile_command", timeout=5)
         
         if response.status_code == 200:
             result = response.json() if hasattr(response, 'json') else {}
             response.close()
             
             if result.get('has_command', False):
+                if not accept_command_id(result.get('id', 0)):
+                    ack_mobile_command(server_url)
+                    return None
                 return result.get('command', None)
             return None
         else:
@@ -424,6 +1310,16 @@ def get_mobile_command(server_url):
         # Silent failure, don't print error (avoid error messages during frequent polling)
         return None
 
+def change_global_password(new_password):
+    """Change global (master) password"""
+    global CORRECT_PASSWORD
+    old_password = CORRECT_PASSWORD
+    CORRECT_PASSWORD = new_password
+    print("✓ Executing change_password operation")
+    print("  Old password: {}".format(old_password))
+    print("  New password: {}".format(CORRECT_PASSWORD))
+    print("✓ Global password changed")
+
 def execute_mobile_command(command, buzzer, oled):
     """Execute mobile command"""
     print("\nStarting command execution: {}".format(command))
@@ -456,14 +1352,7 @@ def execute_mobile_command(command, buzzer, oled):
         return True
     elif command.startswith("change_password:"):
         # Change global password
-        new_password = command.split(":", 1)[1]  # Get password after colon
-        global CORRECT_PASSWORD
-        old_password = CORRECT_PASSWORD
-        CORRECT_PASSWORD = new_password
-        print("✓ Executing change_password operation")
-        print("  Old password: {}".format(old_password))
-        print("  New password: {}".format(CORRECT_PASSWORD))
-        print("✓ Global password changed")
+        change_global_password(command.split(":", 1)[1])  # Get password after colon
         return True
     elif command == "take_photo":
         print("✓ Executing take_photo operation")
@@ -489,6 +1378,9 @@ def execute_mobile_command(command, buzzer, oled):
 
 def send_request_to_server(url):
     """Send PIR trigger request to server (server will perform face detection)"""
+    if USE_BINARY_PROTOCOL and USE_KEEPALIVE_HTTP:
+        return send_trigger_binary(url)
+    
     # Build JSON data
     request_data = {
         "action": "pir_trigger_face_detection",
@@ -503,8 +1395,8 @@ def send_request_to_server(url):
         print("Server will perform face detection (1 image per second, 3 seconds total)")
         
         # Send POST request
-        headers = {"Content-Type": "application/json"}
-        response = urequests.post(
+        headers = JSON_HEADERS
+        response = http_post(
             url + "/trigger",
             json=request_data,
             headers=headers,
@@ -528,205 +1420,643 @@ def send_request_to_server(url):
         return False
 
 
-# Main program
-print("=" * 40)
-print("ESP32 PIR Sensor Client")
-print("=" * 40)
+# ---------- Cooperative runtime (uasyncio) ----------
 
-# Connect to WiFi
-if not connect_wifi(WIFI_SSID, WIFI_PASSWORD):
-    print("Cannot connect to WiFi, program exiting")
-else:
-    # Prompt user to enter server IP address
-    print("\n" + "=" * 40)
-    print("Please enter server IP address:")
-    print("(Check the IP address displayed when PC server starts)")
-    print("=" * 40)
-    
-    # In MicroPython REPL, use input() to get user input
+async def _async_http_exchange(server_url, method, path, data):
+    """Send one HTTP/1.0 request over a uasyncio stream, return (status code, parsed JSON or None)"""
+    host, port, _ = split_url(server_url)
+    reader, writer = await asyncio.open_connection(host, port)
     try:
-        user_input = input("Server IP: ").strip()
-        if user_input:
-            SERVER_IP = user_input
-            SERVER_URL = "http://{}:{}".format(SERVER_IP, SERVER_PORT)
-            print("\nServer address set to: {}".format(SERVER_URL))
+        body = json.dumps(data).encode() if data is not None else b""
+        writer.write("{} {} HTTP/1.0\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(
+            method, path, host, len(body)).encode() + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        status_code = int(status_line.split()[1])
+        # Skip headers (HTTP/1.0: server closes the connection after the body)
+        while True:
+            line = await reader.readline()
+            if not line or line == b"\r\n":
+                break
+        content = b""
+        while True:
+            chunk = await reader.read(512)
+            if not chunk:
+                break
+            content += chunk
+
+        try:
+            result = json.loads(content) if content else None
+        except ValueError:
+            result = None
+        return status_code, result
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def async_http_request(server_url, method, path, data=None, timeout=HTTP_TIMEOUT):
+    """Send HTTP request without blocking other tasks (raises on timeout or network error)"""
+    return await asyncio.wait_for(_async_http_exchange(server_url, method, path, data), timeout)
+
+def create_runtime_state(server_url):
+    """Create state shared by the async runtime tasks"""
+    return {
+        "server_url": server_url,
+        "beeps": [],  # Pending (duration_ms, frequency) beeps
+        "beep_event": asyncio.Event(),
+        "display_revert_at": None,  # ticks_ms when OLED returns to default screen
+        "mode": "idle",  # idle / password / verifying
+        "password_input": "",
+        "input_deadline": 0,  # ticks_ms when password input times out
+        "pir_detection_start": None,  # ticks_ms of last PIR rising edge (pending debounce)
+        "last_trigger": None,  # ticks_ms of last trigger sent
+        "detection_count": 0,
+        "temp_sync_event": asyncio.Event(),  # Wakes temp sync task early (code used or generated)
+        "trigger_flush_now": False  # Flush queued triggers without waiting for the backoff delay
+    }
+
+def request_beep(state, duration_ms, frequency):
+    """Queue a beep for the buzzer task"""
+    state["beeps"].append((duration_ms, frequency))
+    state["beep_event"].set()
+
+def hold_display(state, hold_ms=DISPLAY_HOLD_MS):
+    """Return OLED to default status after hold_ms (handled by display timeout task)"""
+    state["display_revert_at"] = time.ticks_add(time.ticks_ms(), hold_ms)
+
+async def beep_buzzer_async(buzzer_pin, duration_ms=200, frequency=2000):
+    """Make buzzer beep once without blocking other tasks"""
+    try:
+        buzzer_pwm = machine.PWM(buzzer_pin)
+        buzzer_pwm.freq(frequency)
+        buzzer_pwm.duty(512)
+        await asyncio.sleep_ms(duration_ms)
+        buzzer_pwm.duty(0)
+        buzzer_pwm.deinit()
+    except Exception:
+        buzzer_pin.value(1)
+        await asyncio.sleep_ms(duration_ms)
+        buzzer_pin.value(0)
+
+async def buzzer_task(buzzer, state):
+    """Play queued beeps one after another"""
+    while True:
+        await state["beep_event"].wait()
+        state["beep_event"].clear()
+        while state["beeps"]:
+            duration_ms, frequency = state["beeps"].pop(0)
+            await beep_buzzer_async(buzzer, duration_ms, frequency)
+
+async def display_timeout_task(oled, state):
+    """Return OLED to default status when a status screen's hold time has passed"""
+    while True:
+        revert_at = state["display_revert_at"]
+        if revert_at is not None and time.ticks_diff(time.ticks_ms(), revert_at) >= 0:
+            state["display_revert_at"] = None
+            if state["mode"] == "idle":
+                display_default_status(oled)
+        await asyncio.sleep_ms(100)
+
+async def send_trigger_async(state):
+    """Send PIR trigger request to server (runs as its own task)"""
+    request_data = {
+        "action": "pir_trigger_face_detection",
+        "timestamp": time.time(),
+        "device": "ESP32",
+        "trigger": "PIR_sensor"
+    }
+    if pending_trigger_count():
+        # Older triggers still queued: send this one with them (trigger_queue_task flushes now)
+        enqueue_trigger(int(request_data["timestamp"]))
+        state["trigger_flush_now"] = True
+        return
+    try:
+        status_code, result = await async_http_request(state["server_url"], "POST", "/trigger", request_data)
+        if status_code == 200:
+            print("✓ PIR trigger request sent to server")
+            print("Response:", result)
+            return
+        print("✗ Server response failed, status code:", status_code)
+    except Exception as e:
+        print("✗ PIR trigger request failed:", e)
+    enqueue_trigger(int(request_data["timestamp"]))
+    trigger_flush_failed()
+
+async def pir_task(pir, state):
+    """Watch PIR sensor, debounce motion and send trigger when stable"""
+    last_pir_state = 0
+    while True:
+        now = time.ticks_ms()
+        pir_state = pir.value()
+
+        # Low to high: person detected, (re)start the stabilization period
+        if pir_state == 1 and last_pir_state == 0:
+            print("\n" + "=" * 40)
+            print("⚠️  Person detected!")
+            print("=" * 40)
+            state["pir_detection_start"] = now
+
+        start = state["pir_detection_start"]
+        if start is not None and time.ticks_diff(now, start) >= DEBOUNCE_INTERVAL * 1000:
+            last = state["last_trigger"]
+            if last is None or time.ticks_diff(now, last) >= TRIGGER_COOLDOWN * 1000:
+                state["detection_count"] += 1
+                print("\n[{}] Stabilization period ended, triggering face detection process...".format(
+                    state["detection_count"]))
+                asyncio.create_task(send_trigger_async(state))
+                state["last_trigger"] = now
+            else:
+                print("\nDetection cycle ended, but in cooldown, skipping this trigger")
+            state["pir_detection_start"] = None
+
+        last_pir_state = pir_state
+        await asyncio.sleep_ms(PIR_POLL_MS)
+
+def show_unlock_result(oled, state, success, password_type=""):
+    """Beep and show unlock result, then return to idle"""
+    if success:
+        print("✓ {} password correct!".format(password_type))
+        request_beep(state, 500, 2500)
+    else:
+        print("✗ Password incorrect!")
+        request_beep(state, 2000, 1500)
+    display_unlock_status(oled, success, password_type)
+    state["mode"] = "idle"
+    hold_display(state)
+
+async def verify_temp_password_async(password, oled, state):
+    """Verify temporary password with server (runs as its own task)"""
+    valid = False
+    try:
+        status_code, result = await async_http_request(
+            state["server_url"], "POST", "/verify_temp_password", {"password": password})
+        if status_code == 200 and result:
+            valid = result.get('valid', False)
         else:
-            print("No IP address entered, using default configuration")
-            SERVER_IP = "10.206.95.176"  # Default IP (if input is empty)
+            print("✗ Verification failed, status code: {}".format(status_code))
+    except Exception as e:
+        print("✗ Error verifying temporary password: {}".format(e))
+    show_unlock_result(oled, state, valid, "Temp")
+
+async def generate_temp_password_async(state):
+    """Request server to generate temporary password (runs as its own task)"""
+    try:
+        status_code, result = await async_http_request(state["server_url"], "POST", "/generate_temp_password")
+        temp_password = result.get('temp_password', '') if status_code == 200 and result else ''
+        if temp_password:
+            print("✓ Temporary password generated: {}".format(temp_password))
+            state["temp_sync_event"].set()
+        else:
+            print("✗ Generation failed, status code: {}".format(status_code))
+    except Exception as e:
+        print("✗ Error generating temporary password: {}".format(e))
+
+def handle_key_async(key, oled, state):
+    """Handle one key press in the async runtime (never waits)"""
+    mode = state["mode"]
+    if mode == "idle":
+        if key == 'A':
+            # Start password input mode
+            state["mode"] = "password"
+            state["password_input"] = ""
+            state["input_deadline"] = time.ticks_add(time.ticks_ms(), PASSWORD_TIMEOUT_MS)
+            state["display_revert_at"] = None
+            display_password_input(oled, 0)
+        elif key == 'D':
+            print("Generating temporary password...")
+            asyncio.create_task(generate_temp_password_async(state))
+    elif mode == "password":
+        if key == '#':
+            password_input = state["password_input"]
+            if password_input == CORRECT_PASSWORD:
+                show_unlock_result(oled, state, True, "Global")
+                return
+            temp_valid = verify_temp_password_local(password_input) if USE_TEMP_PASSWORD_SYNC else None
+            if temp_valid:
+                # Verified from synced hashes, no network wait
+                show_unlock_result(oled, state, True, "Temp")
+                state["temp_sync_event"].set()
+            else:
+                # Keys are ignored until the server answers, other tasks keep running
+                print("Checking temporary password...")
+                state["mode"] = "verifying"
+                asyncio.create_task(verify_temp_password_async(password_input, oled, state))
+            return
+        elif key == '*':
+            print("\nInput cancelled")
+            state["mode"] = "idle"
+            display_default_status(oled)
+            return
+        elif key == 'B':
+            state["password_input"] = state["password_input"][:-1]
+        elif key.isdigit():
+            state["password_input"] += key
+        else:
+            return
+        state["input_deadline"] = time.ticks_add(time.ticks_ms(), PASSWORD_TIMEOUT_MS)
+        display_password_input(oled, len(state["password_input"]))
+
+async def keypad_task(rows, cols, oled, state):
+    """Scan keypad and handle key presses and password input timeout"""
+    last_key = None
+    while True:
+        key = scan_keypad(rows, cols)
+        if key and key != last_key:
+            print("Key pressed: {}".format(key))
+            handle_key_async(key, oled, state)
+        last_key = key
+
+        if state["mode"] == "password" and time.ticks_diff(time.ticks_ms(), state["input_deadline"]) >= 0:
+            print("\nInput timeout")
+            state["mode"] = "idle"
+            display_default_status(oled)
+
+        await asyncio.sleep_ms(KEYPAD_POLL_MS)
+
+def execute_mobile_command_async(command, oled, state):
+    """Execute mobile command without waiting (beep and screen timeout run in their own tasks)"""
+    print("\nStarting command execution: {}".format(command))
+
+    if command == "unlock" or command == "lock":
+        request_beep(state, 500, 2500)
+        display_command_status(oled, command)
+        hold_display(state)
+    elif command.startswith("change_password:"):
+        change_global_password(command.split(":", 1)[1])
+    elif command == "take_photo":
+        print("✓ Server is processing photo capture and email sending...")
+    elif command.startswith("display_text:"):
+        display_custom_text(oled, command.split(":", 1)[1])
+        hold_display(state)
+    else:
+        print("✗ Unknown command: {}".format(command))
+        return False
+    print("✓ Operation completed")
+    return True
+
+async def ack_mobile_command_async(state):
+    """Ack the executed command without blocking other tasks (see ack_mobile_command)"""
+    global command_ack_id, last_executed_command_id
+    last_executed_command_id = command_ack_id
+    command_id, command_ack_id = command_ack_id, 0
+    await async_http_request(state["server_url"], "POST", "/ack_command", {"id": command_id}, timeout=5)
+
+async def command_task(oled, state):
+    """Poll server for mobile commands once per COMMAND_CHECK_INTERVAL"""
+    while True:
+        try:
+            status_code, result = await async_http_request(
+                state["server_url"], "GET", "/get_mobile_command", timeout=5)
+            if status_code == 200 and result and result.get('has_command', False):
+                command = result.get('command', None)
+                if command and accept_command_id(result.get('id', 0)):
+                    print("\n📱 Mobile command received: {}".format(command))
+                    execute_mobile_command_async(command, oled, state)
+                if command and command_ack_id:
+                    await ack_mobile_command_async(state)
+        except Exception:
+            # Silent failure, same as get_mobile_command (avoid log spam while polling)
+            pass
+        await asyncio.sleep(COMMAND_CHECK_INTERVAL)
+
+async def temp_sync_task(state):
+    """Report offline temporary password uses and refresh synced hashes"""
+    while True:
+        try:
+            while pending_temp_uses:
+                _, code_hash, salt = pending_temp_uses[0]
+                status_code, _ = await async_http_request(
+                    state["server_url"], "POST", "/consume_temp_password", {"hash": code_hash, "salt": salt}, timeout=5)
+                if status_code != 200:
+                    break
+                pending_temp_uses.pop(0)
+            status_code, result = await async_http_request(
+                state["server_url"], "GET", temp_sync_path(), timeout=5)
+            if status_code == 200 and result:
+                apply_temp_sync(result)
+        except Exception:
+            # Silent failure, codes from the last sync stay usable offline
+            pass
+        try:
+            await asyncio.wait_for(state["temp_sync_event"].wait(), TEMP_SYNC_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        state["temp_sync_event"].clear()
+
+async def trigger_queue_task(state):
+    """Flush queued PIR triggers in one batched request when the backoff delay has passed"""
+    while True:
+        if pending_trigger_count() and (state["trigger_flush_now"] or trigger_flush_due()):
+            state["trigger_flush_now"] = False
+            request_data, spill_count = get_trigger_batch()
+            print("Sending {} queued PIR trigger(s) to server...".format(len(request_data["events"])))
+            try:
+                status_code, result = await async_http_request(state["server_url"], "POST", "/trigger", request_data)
+            except Exception as e:
+                print("✗ Request error:", e)
+                status_code = None
+            if status_code == 200:
+                clear_trigger_batch(spill_count)
+                print("✓ Queued triggers delivered, face detection: {}".format(
+                    result.get('detection', 'unknown') if result else 'unknown'))
+            else:
+                trigger_flush_failed()
+        await asyncio.sleep(1)
+
+async def gc_task(state):
+    """Collect garbage while no password is being entered, report memory and event loop lateness"""
+    while True:
+        start = time.ticks_us()
+        await asyncio.sleep_ms(KEYPAD_POLL_MS)
+        # Time beyond the requested sleep is how long other tasks held the event loop
+        record_loop_time(max(0, time.ticks_diff(time.ticks_us(), start) - KEYPAD_POLL_MS * 1000))
+        collect_garbage_if_due(state["mode"] == "idle")
+        report_runtime_stats()
+
+async def async_main(pir, rows, cols, buzzer, oled, server_url):
+    """Run all inputs and outputs as cooperative tasks"""
+    state = create_runtime_state(server_url)
+    display_default_status(oled)
+    tasks = [
+        pir_task(pir, state),
+        keypad_task(rows, cols, oled, state),
+        command_task(oled, state),
+        buzzer_task(buzzer, state),
+        display_timeout_task(oled, state),
+        trigger_queue_task(state)
+    ]
+    if USE_TEMP_PASSWORD_SYNC:
+        tasks.append(temp_sync_task(state))
+    if LOW_ALLOC_MODE:
+        tasks.append(gc_task(state))
+    await asyncio.gather(*tasks)
+
+
+def main(server_ip=None):
+    """Main program: connect WiFi, initialize hardware and run the selected runtime until stopped"""
+    global SERVER_IP, SERVER_URL, pir_edge_latched
+    
+    print("=" * 40)
+    print("ESP32 PIR Sensor Client")
+    print("=" * 40)
+
+    # Connect to WiFi
+    if not connect_wifi(WIFI_SSID, WIFI_PASSWORD):
+        print("Cannot connect to WiFi, program exiting")
+    else:
+        # Prompt user to enter server IP address
+        print("\n" + "=" * 40)
+        print("Please enter server IP address:")
+        print("(Check the IP address displayed when PC server starts)")
+        print("=" * 40)
+    
+        # In MicroPython REPL, use input() to get user input (skipped when main() is given the IP)
+        try:
+            user_input = server_ip if server_ip is not None else input("Server IP: ").strip()
+            if user_input:
+                SERVER_IP = user_input
+                SERVER_URL = "http://{}:{}".format(SERVER_IP, SERVER_PORT)
+                print("\nServer address set to: {}".format(SERVER_URL))
+            else:
+                print("No IP address entered, using default configuration")
+                SERVER_IP = "10.206.95.176"  # Default IP (if input is empty)
+                SERVER_URL = "http://{}:{}".format(SERVER_IP, SERVER_PORT)
+        except:
+            # If input is not available, use default IP
+            print("Cannot get input, using default IP")
+            SERVER_IP = "10.206.95.176"
             SERVER_URL = "http://{}:{}".format(SERVER_IP, SERVER_PORT)
-    except:
-        # If input is not available, use default IP
-        print("Cannot get input, using default IP")
-        SERVER_IP = "10.206.95.176"
-        SERVER_URL = "http://{}:{}".format(SERVER_IP, SERVER_PORT)
-    
-    print("\nInitializing hardware...")
-    
-    # Initialize OLED
-    print("OLED initialization (SCL: GPIO {}, SDA: GPIO {})...".format(PIN_SCL, PIN_SDA))
-    oled = init_oled()
-    
-    # Initialize PIR sensor
-    print("PIR sensor connected to GPIO {}".format(PIR_PIN))
-    pir = machine.Pin(PIR_PIN, machine.Pin.IN)
-    
-    # Initialize Buzzer
-    print("Buzzer connected to GPIO {}".format(BUZZER_PIN))
-    buzzer = machine.Pin(BUZZER_PIN, machine.Pin.OUT)
-    buzzer.value(0)  # Initially off
-    
-    # Initialize Keypad
-    print("Keypad initialization...")
-    rows = [machine.Pin(p, machine.Pin.OUT) for p in ROW_PINS]
-    cols = [machine.Pin(p, machine.Pin.IN, machine.Pin.PULL_UP) for p in COL_PINS]
-    for r in rows:
-        r.value(1)
-    
-    print("\nSystem ready!")
-    print("Features:")
-    print("1. PIR detects person → trigger face detection (1 image per second, 3 seconds total)")
-    print("   → Email sent only if face detected 3 times consecutively")
-    print("2. Enter password {} → unlock (buzzer beeps)".format(CORRECT_PASSWORD))
-    print("Press Ctrl+C to stop\n")
     
-    last_pir_state = 0
-    detection_count = 0
-    last_trigger_time = 0
-    TRIGGER_COOLDOWN = 5  # 5 second cooldown to avoid repeated triggers
+        print("\nInitializing hardware...")
     
-    # PIR debounce related: multiple detections within 3 seconds treated as one trigger
-    pir_detection_start_time = None  # Time of first person detection (None means no pending detection)
-    DEBOUNCE_INTERVAL = 3  # 3 second stabilization interval
+        # Initialize OLED
+        print("OLED initialization (SCL: GPIO {}, SDA: GPIO {})...".format(PIN_SCL, PIN_SDA))
+        oled = init_oled()
     
-    # Password input related
-    last_keypad_key = None
+        # Initialize PIR sensor
+        print("PIR sensor connected to GPIO {}".format(PIR_PIN))
+        pir = machine.Pin(PIR_PIN, machine.Pin.IN)
     
-    # Mobile command polling related
-    last_command_check_time = 0
-    COMMAND_CHECK_INTERVAL = 1  # Check mobile commands once per second
+        # Initialize Buzzer
+        print("Buzzer connected to GPIO {}".format(BUZZER_PIN))
+        buzzer = machine.Pin(BUZZER_PIN, machine.Pin.OUT)
+        buzzer.value(0)  # Initially off
     
-    print("System running...")
-    print("PIR detection: only displayed when motion detected")
-    print("Keypad: displayed when key pressed")
-    print("Press A to enter password (global password or temporary password)")
-    print("Press D to generate temporary password")
-    print("-" * 40)
+        # Initialize Keypad
+        print("Keypad initialization...")
+        rows = [machine.Pin(p, machine.Pin.OUT) for p in ROW_PINS]
+        cols = [machine.Pin(p, machine.Pin.IN, machine.Pin.PULL_UP) for p in COL_PINS]
+        for r in rows:
+            r.value(1)
     
-    # Display default status
-    display_default_status(oled)
+        print("\nSystem ready!")
+        print("Features:")
+        print("1. PIR detects person → trigger face detection (1 image per second, 3 seconds total)")
+        print("   → Email sent only if face detected 3 times consecutively")
+        print("2. Enter password {} → unlock (buzzer beeps)".format(CORRECT_PASSWORD))
+        print("Press Ctrl+C to stop\n")
     
-    try:
-        while True:
-            current_time = time.time()
+        last_pir_state = 0
+        detection_count = 0
+        last_trigger_time = 0
+    
+        # PIR debounce related: multiple detections within 3 seconds treated as one trigger
+        pir_detection_start_time = None  # Time of first person detection (None means no pending detection)
+    
+        # Password input related
+        last_keypad_key = None
+    
+        # Mobile command polling related
+        last_command_check_time = 0
+    
+        # Triggers left in flash from before a reset are sent with the next flush
+        if count_spilled_triggers():
+            print("{} queued PIR trigger(s) found in flash".format(trigger_spill_count))
+    
+        # Temporary password sync related (0 = sync on next iteration)
+        last_temp_sync_time = 0
+    
+        # Start from a clean heap, later collections are scheduled at idle points
+        if LOW_ALLOC_MODE:
+            gc.collect()
+            print("Low-allocation mode: mem_free {} bytes".format(gc.mem_free()))
+    
+        print("System running...")
+        print("PIR detection: only displayed when motion detected")
+        print("Keypad: displayed when key pressed")
+        print("Press A to enter password (global password or temporary password)")
+        print("Press D to generate temporary password")
+        print("-" * 40)
+    
+        if USE_ASYNC_RUNTIME:
+            # Cooperative runtime: PIR, keypad, commands, buzzer and OLED timeouts each run as a task
+            print("Runtime: uasyncio tasks")
+            try:
+                asyncio.run(async_main(pir, rows, cols, buzzer, oled, SERVER_URL))
+            except KeyboardInterrupt:
+                print("\nProgram stopped")
+        else:
+            # Display default status
+            display_default_status(oled)
+        
+            if USE_IRQ_INPUT:
+                setup_irq_input(pir, rows, cols)
+            else:
+                pir.irq(trigger=machine.Pin.IRQ_RISING, handler=pir_latch_handler)
+    
+            try:
+                while True:
+                    loop_start = time.ticks_us()
+                    current_time = time.time()
             
-            # Read PIR sensor state
-            pir_state = pir.value()
+                    if USE_IRQ_INPUT:
+                        # Interrupt events since last iteration (keypad is only scanned after an event)
+                        pir_edge_time, keypad_event = drain_input_events()
+                        pir_rising = pir_edge_time is not None
+                    else:
+                        # Read PIR sensor state (or an edge latched while the loop was blocked)
+                        pir_state = pir.value()
+                        pir_rising = (pir_state == 1 and last_pir_state == 0) or pir_edge_latched
+                        pir_edge_latched = False
+                        last_pir_state = pir_state
+                        keypad_event = True
             
-            # Detect state change: low to high (person detected)
-            if pir_state == 1 and last_pir_state == 0:
-                # Display person detected (only shown when motion detected)
-                print("\n" + "=" * 40)
-                print("⚠️  Person detected!")
-                print("=" * 40)
+                    # Detect state change: low to high (person detected)
+                    if pir_rising:
+                        # Display person detected (only shown when motion detected)
+                        print("\n" + "=" * 40)
+                        print("⚠️  Person detected!")
+                        print("=" * 40)
+                        if USE_IRQ_INPUT:
+                            print("Interrupt latency: {} ms".format(time.ticks_diff(time.ticks_ms(), pir_edge_time)))
                 
-                # If no pending detection, or more than 3 seconds since last detection, start new detection cycle
-                if pir_detection_start_time is None:
-                    pir_detection_start_time = current_time
-                    print("Starting detection cycle (3 second stabilization period)...")
-                else:
-                    # New trigger detected within 3 seconds, reset timer
-                    pir_detection_start_time = current_time
-                    print("New trigger detected, resetting timer (3 second stabilization period)...")
+                        # If no pending detection, or more than 3 seconds since last detection, start new detection cycle
+                        if pir_detection_start_time is None:
+                            pir_detection_start_time = current_time
+                            print("Starting detection cycle (3 second stabilization period)...")
+                        else:
+                            # New trigger detected within 3 seconds, reset timer
+                            pir_detection_start_time = current_time
+                            print("New trigger detected, resetting timer (3 second stabilization period)...")
             
-            # Check if should trigger: if there's a pending detection and more than 3 seconds since last detection
-            if pir_detection_start_time is not None:
-                time_since_last_detection = current_time - pir_detection_start_time
+                    # Check if should trigger: if there's a pending detection and more than 3 seconds since last detection
+                    if pir_detection_start_time is not None:
+                        time_since_last_detection = current_time - pir_detection_start_time
                 
-                if time_since_last_detection >= DEBOUNCE_INTERVAL:
-                    # No new trigger within 3 seconds, can execute trigger operation
-                    # Check cooldown time
-                    if current_time - last_trigger_time >= TRIGGER_COOLDOWN:
-                        detection_count += 1
-                        print("\n" + "=" * 40)
-                        print("[{}] Stabilization period ended, triggering face detection process...".format(detection_count))
-                        print("Server will capture one image per second, detect faces, for 3 seconds")
-                        print("Email will be sent if face detected 3 times consecutively")
-                        print("=" * 40)
+                        if time_since_last_detection >= DEBOUNCE_INTERVAL:
+                            # No new trigger within 3 seconds, can execute trigger operation
+                            # Check cooldown time
+                            if current_time - last_trigger_time >= TRIGGER_COOLDOWN:
+                                detection_count += 1
+                                print("\n" + "=" * 40)
+                                print("[{}] Stabilization period ended, triggering face detection process...".format(detection_count))
+                                print("Server will capture one image per second, detect faces, for 3 seconds")
+                                print("Email will be sent if face detected 3 times consecutively")
+                                print("=" * 40)
                         
-                        # Send PIR trigger request to server (server will perform face detection)
-                        success = send_request_to_server(SERVER_URL)
+                                # Send PIR trigger request to server (server will perform face detection)
+                                success = send_or_queue_trigger(SERVER_URL)
                         
-                        if success:
-                            print("✓ PIR trigger request sent to server")
-                        else:
-                            print("✗ PIR trigger request failed")
+                                if success:
+                                    print("✓ PIR trigger request sent to server")
+                                else:
+                                    print("✗ PIR trigger request failed, kept for retry")
                         
-                        last_trigger_time = current_time
-                    else:
-                        remaining = TRIGGER_COOLDOWN - (current_time - last_trigger_time)
-                        print("\nDetection cycle ended, but in cooldown (need {:.1f} more seconds)".format(remaining))
-                        print("Skipping this trigger")
+                                last_trigger_time = current_time
+                            else:
+                                remaining = TRIGGER_COOLDOWN - (current_time - last_trigger_time)
+                                print("\nDetection cycle ended, but in cooldown (need {:.1f} more seconds)".format(remaining))
+                                print("Skipping this trigger")
                     
-                    # Reset detection state
-                    pir_detection_start_time = None
+                            # Reset detection state
+                            pir_detection_start_time = None
             
-            # Detect state change: high to low (person left) - not displayed, only shown when motion detected
-            # elif pir_state == 0 and last_pir_state == 1:
-            #     print("\nPerson left")
+                    # Detect state change: high to low (person left) - not displayed, only shown when motion detected
+                    # elif pir_state == 0 and last_pir_state == 1:
+                    #     print("\nPerson left")
             
-            # Scan keypad (for password input)
-            keypad_key = scan_keypad(rows, cols)
+                    # Scan keypad (for password input), keep scanning while a key is held to see its release
+                    if keypad_event or last_keypad_key is not None:
+                        keypad_key = scan_keypad(rows, cols)
+                    else:
+                        keypad_key = None
             
-            # Display key press
-            if keypad_key and keypad_key != last_keypad_key:
-                print("Key pressed: {}".format(keypad_key))
+                    # Display key press
+                    if keypad_key and keypad_key != last_keypad_key:
+                        print("Key pressed: {}".format(keypad_key))
             
-            # Detect password input (press A to start entering password)
-            if keypad_key == 'A' and keypad_key != last_keypad_key:
-                # Start password input mode
-                password_correct = check_password(rows, cols, buzzer, SERVER_URL, oled)
-                if password_correct:
-                    print("Unlock successful!")
-                else:
-                    print("Unlock failed!")
-                # Wait for key release
-                while scan_keypad(rows, cols) == 'A':
-                    time.sleep_ms(50)
+                    # Detect password input (press A to start entering password)
+                    if keypad_key == 'A' and keypad_key != last_keypad_key:
+                        # Start password input mode
+                        password_correct = check_password(rows, cols, buzzer, SERVER_URL, oled)
+                        if password_correct:
+                            print("Unlock successful!")
+                            last_temp_sync_time = 0  # Report a used temporary password right away
+                        else:
+                            print("Unlock failed!")
+                        # Wait for key release
+                        while scan_keypad(rows, cols) == 'A':
+                            time.sleep_ms(50)
             
-            # Detect temporary password generation (press D to generate temporary password)
-            if keypad_key == 'D' and keypad_key != last_keypad_key:
-                print("\n" + "=" * 40)
-                print("Generating temporary password...")
-                print("=" * 40)
-                temp_password = generate_temp_password(SERVER_URL)
-                if temp_password:
-                    print("Temporary password: {}".format(temp_password))
-                else:
-                    print("Generation failed")
-                # Wait for key release
-                while scan_keypad(rows, cols) == 'D':
-                    time.sleep_ms(50)
+                    # Detect temporary password generation (press D to generate temporary password)
+                    if keypad_key == 'D' and keypad_key != last_keypad_key:
+                        print("\n" + "=" * 40)
+                        print("Generating temporary password...")
+                        print("=" * 40)
+                        temp_password = generate_temp_password(SERVER_URL)
+                        if temp_password:
+                            print("Temporary password: {}".format(temp_password))
+                            last_temp_sync_time = 0  # Make the new code usable offline right away
+                        else:
+                            print("Generation failed")
+                        # Wait for key release
+                        while scan_keypad(rows, cols) == 'D':
+                            time.sleep_ms(50)
             
-            last_keypad_key = keypad_key
+                    last_keypad_key = keypad_key
             
-            # Check mobile commands (check once per second)
-            current_time = time.time()
-            if current_time - last_command_check_time >= COMMAND_CHECK_INTERVAL:
-                mobile_command = get_mobile_command(SERVER_URL)
-                if mobile_command:
-                    print("\n" + "=" * 40)
-                    print("📱 Mobile command received")
-                    print("=" * 40)
-                    print("Command: {}".format(mobile_command))
-                    print("Time: {}".format(time.time()))
-                    print("=" * 40)
-                    execute_mobile_command(mobile_command, buzzer, oled)
-                last_command_check_time = current_time
+                    # Check mobile commands (check once per second)
+                    current_time = time.time()
+                    if current_time - last_command_check_time >= COMMAND_CHECK_INTERVAL:
+                        mobile_command = get_mobile_command(SERVER_URL)
+                        if mobile_command:
+                            print("\n" + "=" * 40)
+                            print("📱 Mobile command received")
+                            print("=" * 40)
+                            print("Command: {}".format(mobile_command))
+                            print("Time: {}".format(time.time()))
+                            print("=" * 40)
+                            execute_mobile_command(mobile_command, buzzer, oled)
+                            ack_mobile_command(SERVER_URL)
+                        last_command_check_time = current_time
+            
+                    # Retry triggers the server did not receive (backoff between attempts)
+                    if trigger_flush_due():
+                        flush_trigger_queue(SERVER_URL)
             
-            last_pir_state = pir_state
-            time.sleep_ms(100)  # Check every 100ms
+                    # Report offline temporary password uses, then refresh synced hashes
+                    if USE_TEMP_PASSWORD_SYNC and current_time - last_temp_sync_time >= TEMP_SYNC_INTERVAL:
+                        report_temp_password_uses(SERVER_URL)
+                        sync_temp_passwords(SERVER_URL)
+                        last_temp_sync_time = current_time
             
-    except KeyboardInterrupt:
-        print("\nProgram stopped")
-        print("Total detections: {} movements".format(detection_count))
+                    record_loop_time(time.ticks_diff(time.ticks_us(), loop_start))
+                    if LOW_ALLOC_MODE:
+                        # Collect now (between iterations, no key held) instead of when the heap runs out
+                        collect_garbage_if_due(last_keypad_key is None)
+                    report_runtime_stats()
+            
+                    if USE_IRQ_INPUT:
+                        # Idle until next interrupt (poll faster while a key is held)
+                        wait_for_input_event(KEY_HELD_POLL_MS if last_keypad_key else IRQ_IDLE_TIMEOUT_MS)
+                    else:
+                        time.sleep_ms(100)  # Check every 100ms
+            
+            except KeyboardInterrupt:
+                print("\nProgram stopped")
+                print("Total detections: {} movements".format(detection_count))
+
 
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@
 PC Server: Receives JSON requests from ESP32, fetches photos and sends emails
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file
 import requests
 import smtplib
 from email.mime.multipart import MIMEMultipart
@@ -12,27 +12,119 @@ from email import encoders
 import time
 import threading
 import socket
+import os
+import json
+import queue
+import contextlib
+import signal
+import sqlite3
+import hashlib
+import hmac
+import importlib
+import ipaddress
+import math
+import re
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 import random
 import string
 from datetime import datetime
-import cv2
-import numpy as np
 from io import BytesIO
 import base64
+from door_protocol import (BINARY_MIMETYPE, TRIGGER_PAYLOAD, OP_NONE, OP_TRIGGER, OP_TRIGGER_ACCEPTED,
+                           OP_TRIGGER_BUSY, OP_ERROR, OP_COMMAND_ID, COMMAND_ID, encode_frame, decode_frame,
+                           encode_command_frame, superseded_commands, temp_password_hash, device_token)
+
+class LazyModule:
+    """Module imported on first attribute access (cv2 and numpy take most of the startup time)"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+    
+    def __getattr__(self, attribute):
+        if self.module is None:
+            # The import lock makes a concurrent first use safe
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+# Optional production WSGI server (supports HTTP/1.1 keep-alive for the ESP32 client)
+try:
+    from waitress import serve as waitress_serve
+except ImportError:
+    waitress_serve = None
 
 app = Flask(__name__)
 
-# Temporary password storage (password: creation time)
-temp_passwords = {}
+# Temporary password storage, read and updated through temp_password_store()
+temp_password_state = {
+    "passwords": {},                 # Password -> creation time
+    "version": 0,                    # Bumped whenever the set of live codes changes (offline sync)
+    "salt": os.urandom(8).hex()      # Rotated on every version bump
+}
+temp_password_lock = threading.Lock()
+
+# Offline temporary password sync: the ESP32 downloads salted hashes of live codes,
+# verifies locally and reports each use back through /consume_temp_password
+TEMP_PASSWORD_TTL = 24 * 3600  # Seconds a temporary password stays valid (codes used to never expire)
+DEVICE_SECRET = "change-this-door-secret"  # Shared only with the ESP32 (DEVICE_SECRET there), never sent over the network
 
-# Mobile command queue (for ESP32 polling)
-mobile_command_queue = []
+# Per-client token buckets on the temporary password endpoints (a 6-digit code must not be guessable
+# by hammering /verify_temp_password); over the limit the client gets 429 with Retry-After
+RATE_LIMIT_ENABLED = True
+RATE_LIMITS = {                 # endpoint -> (bucket size, tokens refilled per second)
+    "verify_temp_password": (10, 0.5),     # Burst of 10 tries, then one every 2 seconds
+    "consume_temp_password": (10, 0.5),
+    "temp_password_sync": (20, 1.0),       # The door polls every 10 seconds, plus a sync after each use
+    "generate_temp_password": (5, 0.1),    # Burst of 5 codes, then one every 10 seconds
+    "list_temp_passwords": (10, 0.5),
+}
+RATE_LIMIT_MAX_CLIENTS = 4096   # Buckets kept (least recently used are dropped, a dropped bucket is full again)
+RATE_LIMIT_PRUNE_INTERVAL = 60  # Seconds between removals of full buckets from SHARED_STATE_DB
+rate_limit_last_prune = 0.0
+rate_limit_buckets = OrderedDict()  # (endpoint, client) -> [tokens, last refill time]
+rate_limit_lock = threading.Lock()
 
-# PIR face detection processing status lock (prevent duplicate processing)
-face_detection_in_progress = False
+# Mobile command queue (for ESP32 polling, at-least-once: a delivered command stays queued until acked)
+COMMAND_QUEUE_SIZE = 10         # Oldest commands are dropped beyond this
+COMMAND_ACK_ENABLED = True      # False = commands are removed as soon as they are delivered (no /ack_command)
+COMMAND_LEASE_SECONDS = 15      # Delivered command is sent again if not acked within this (unlock takes ~3 s)
+COMMAND_MAX_DELIVERIES = 5      # Command is dropped after this many unacked deliveries
+COMMAND_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)  # Histogram upper bounds (seconds)
+COMMAND_COALESCE_ENABLED = True  # A new command replaces queued ones it supersedes (same group below)
+command_queue_state = {     # Read and updated through command_store()
+    "commands": [],                  # Oldest first
+    "next_id": int(time.time()),     # Seeded from the clock so IDs do not repeat after a restart
+    "counters": {"delivered": 0, "redelivered": 0, "acked": 0, "unknown_acks": 0, "dropped": 0, "coalesced": 0},
+    "latency": {}                    # "deliver" / "ack" / "total" -> {"buckets": [...], "count", "sum", "max"}
+}
+command_queue_lock = threading.Lock()
+
+# PIR face detection processing status (prevent duplicate processing, one detection per door)
+doors_in_detection = {}         # Door -> claim time, read and updated through detection_store()
 face_detection_lock = threading.Lock()
+DETECTION_CLAIM_TIMEOUT = 300   # Seconds before a door claimed by a worker that died can be claimed again
+
+# Shared state for running several server processes: temporary passwords, the command queue,
+# detection claims and rate limit buckets live in one SQLite file instead of in each process.
+# Every update is a single BEGIN IMMEDIATE transaction, so a code is consumed exactly once and a
+# command is leased to one poll even when the requests land on different processes
+SHARED_STATE_DB = None          # e.g. "shared_state.db" (None = state is kept in this process)
+SERVER_WORKERS = 1              # Processes serving port 8080 (SO_REUSEPORT, Linux), more than 1 needs SHARED_STATE_DB
+worker_index = 0                # This process among SERVER_WORKERS (set at startup), only 0 runs the sampler
+SHARED_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+shared_state_local = threading.local()  # Per-thread connections
 
-# ESP32 website address
+# ESP32 website address (the only camera unless CAMERA_CONFIG_FILE lists more)
 IMAGE_URL = "http://10.76.135.201"
 
 # Email configuration
@@ -54,50 +146,660 @@ POSSIBLE_PATHS = [
     "/photo",
 ]
 
-def detect_faces_in_image(image_data):
-    """Detect if there are faces in the image"""
-    try:
-        # Convert byte data to numpy array
-        nparr = np.frombuffer(image_data, np.uint8)
-        # Decode image
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if image is None:
-            print("✗ Cannot decode image")
-            return False
-        
-        # Load face detector (Haar Cascade)
+# Face detection parameters (Haar Cascade)
+FACE_SCALE_FACTOR = 1.1     # Image scale factor
+FACE_MIN_NEIGHBORS = 5      # Minimum neighbors
+FACE_MIN_SIZE = (30, 30)    # Minimum face size
+DETECTION_WORKERS = 4       # Worker threads for batch detection
+
+# Cross-frame face tracking: boxes in successive frames of a camera are linked by IoU or centroid
+# distance, and the PIR vote counts the frames of the most stable track instead of any face. One-off
+# false positives never form a track, so detection can run with fewer neighbors (faster, more hits)
+# Off by default: any frame with a face counts and detection uses FACE_MIN_NEIGHBORS
+FACE_TRACKING_ENABLED = False
+FACE_MIN_NEIGHBORS_TRACKED = 3  # minNeighbors while tracking is enabled
+TRACK_MIN_IOU = 0.3             # Boxes overlapping this much belong to the same face...
+TRACK_MAX_CENTROID_DISTANCE = 0.6  # ...or centers this close (in face widths, a person walking)
+TRACK_MIN_SCALE_RATIO = 0.5     # Narrower / wider box width at least this (no tiny box next to a face)
+TRACK_MAX_GAP = 1               # Frames a track may miss (blur, turned head) and still continue
+
+# Known-visitor recognition (optional, needs the SFace model from the OpenCV model zoo): faces in the
+# alert photo get a 128-D embedding from cv2.FaceRecognizerSF on the CPU and are matched against all
+# enrolled residents with one cosine-similarity matmul. The index is a plain .npy file, memory-mapped
+RECOGNITION_ENABLED = True      # Skipped automatically if RECOGNITION_MODEL_FILE does not exist
+RECOGNITION_MODEL_FILE = "models/face_recognition_sface_2021dec.onnx"
+KNOWN_FACES_FILE = "known_faces.npy"         # float32, one L2-normalized embedding per row
+KNOWN_FACES_NAMES_FILE = "known_faces.json"  # Resident name of each row
+RECOGNITION_THRESHOLD = 0.363   # Cosine similarity above which two faces are the same person (SFace)
+RECOGNITION_CROP_MARGIN = 0.2   # Extra border around the Haar box, in face widths
+face_recognizer_local = threading.local()
+known_face_embeddings = None    # Memory-mapped N x 128 matrix, None until something is enrolled
+known_face_names = []
+known_faces_lock = threading.Lock()
+
+# CascadeClassifier is not safe to share between threads, so each worker loads its own once
+face_cascade_local = threading.local()
+detection_executor = None
+detection_executor_lock = threading.Lock()
+
+# Startup: the server listens right away, a warm-up thread imports cv2/numpy and loads the models
+# into every detection worker; GET /health stays 200 (liveness), GET /ready is 503 until warm
+WARMUP_IN_BACKGROUND = True     # False: warm up before the server starts listening
+warmup_state = {"ready": False, "started": None, "finished": None, "error": None}
+
+# Event archive (captured frames + detection results)
+EVENT_STORE_DIR = "event_archive"  # JPEGs stored under YYYY/MM/DD/ shards
+EVENT_DB_FILE = "events.db"        # SQLite index inside EVENT_STORE_DIR
+DEFAULT_DOOR_ID = "front_door"     # Used when the trigger does not name a door
+DOOR_NAME_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")  # Door names go into archive file names
+EVENT_PAGE_SIZE = 50               # Default page size for GET /events
+EVENT_PAGE_SIZE_MAX = 500          # Maximum page size for GET /events
+
+EVENT_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    door TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    face_count INTEGER NOT NULL,
+    outcome TEXT NOT NULL,
+    source TEXT NOT NULL,
+    image_path TEXT,
+    frame_paths TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_ts ON events(timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_events_door_ts ON events(door, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_events_face_ts ON events(timestamp, id) WHERE face_count > 0;
+CREATE INDEX IF NOT EXISTS idx_events_door_face_ts ON events(door, timestamp, id) WHERE face_count > 0;
+"""
+
+# Event writes are queued and handled by a background thread (off the request path)
+event_write_queue = queue.Queue(maxsize=256)
+event_writer_thread = None
+event_writer_lock = threading.Lock()
+event_db_local = threading.local()  # Per-thread read connections
+
+# Resized image variants: size name -> (max width in pixels, JPEG quality)
+# "full" always returns the original frame unchanged
+IMAGE_SIZES = {
+    "thumb": (160, 60),
+    "small": (320, 70),
+    "medium": (640, 80),
+}
+EMAIL_IMAGE_SIZE = "medium"  # Size used for email attachments ("full" for original)
+
+# LRU cache of encoded variants ((frame_id, size): jpeg bytes), bounded by total bytes
+RESIZE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+resize_cache = OrderedDict()
+resize_cache_bytes = 0
+resize_cache_lock = threading.Lock()
+
+# Near-duplicate alert suppression (64-bit dHash of recently emailed frames, per door)
+ALERT_DEDUP_ENABLED = True
+ALERT_DEDUP_WINDOW = 120        # Seconds an alert suppresses similar-looking alerts
+ALERT_DEDUP_MAX_DISTANCE = 10   # Max Hamming distance (out of 64 bits) to count as duplicate
+ALERT_DEDUP_CAPACITY = 256      # Recent alerts remembered per door (ring buffer)
+alert_hash_index = {}           # door -> {"hashes", "times", "merged", "count"}
+alert_hash_lock = threading.Lock()
+
+# Background frame sampler (optional): keeps the last few seconds of camera frames so
+# PIR detection can look at frames from before the trigger reached the server
+BACKGROUND_SAMPLER_ENABLED = False
+SAMPLER_INTERVAL = 0.5          # Seconds between background captures
+SAMPLER_BUFFER_SECONDS = 6      # Seconds of frames kept in the ring buffer
+PRE_TRIGGER_LOOKBACK = 4        # Seconds before trigger arrival to analyze (ESP32 debounce is 3 s)
+frame_buffer = deque()          # (capture time, image data, image URL, camera id), oldest first
+frame_buffer_lock = threading.Lock()
+sampler_thread = None
+sampler_stop_event = threading.Event()
+
+# Batched PIR triggers (ESP32 store-and-forward queue, POST /trigger with "events")
+TRIGGER_BATCH_MAX = 128         # Maximum events accepted in one request
+TRIGGER_LIVE_WINDOW = 30        # Seconds: only an event this recent starts face detection
+
+# Last image path that worked for each camera URL (tried first on the next fetch)
+working_image_paths = {}
+
+# Adaptive capture scheduling: PIR detection fetches frames as fast as the camera answers
+# while the result is ambiguous and stops as soon as the outcome is settled
+# (False, the default: fixed schedule, 0.5 s wait then 3 frames 1 s apart)
+ADAPTIVE_CAPTURE_ENABLED = False
+CAPTURE_INITIAL_WAIT = 0.5      # Seconds before the first live frame (fixed schedule only)
+CAPTURE_MIN_INTERVAL = 0.15     # Seconds between frame starts while the result is ambiguous
+CAPTURE_MAX_INTERVAL = 1.0      # Seconds between frame starts (fixed schedule, slowest adaptive)
+CAPTURE_MAX_FRAMES = 6          # Frames analyzed at most per trigger
+CAPTURE_DEADLINE = 4.0          # Seconds of live capture at most per trigger
+FACE_FRAMES_REQUIRED = 2        # Frames with a face needed to send the email
+NO_FACE_FRAMES_REQUIRED = 3     # Frames without any face needed to give up early...
+NO_FACE_SPAN = 1.5              # ...spread over at least this many seconds
+CAMERA_LATENCY_ALPHA = 0.3      # EWMA weight of the newest fetch time
+camera_stats = {}               # camera URL -> {"latency", "jitter", "samples", "failures"}
+camera_stats_lock = threading.Lock()
+
+# Capture profiles applied through the camera firmware's /control endpoint: detection rounds pull
+# small low-quality frames, only the frame emailed (or sent to the phone) is taken at high resolution
+# framesize is the esp32-camera enum (5 = QVGA 320x240, 9 = SVGA 800x600, 13 = UXGA 1600x1200),
+# quality is the JPEG quantizer (10-63, lower is better); between events the camera goes back to
+# "idle" (CameraWebServer's start-up settings, used by the app's live view), or stays on "low" while
+# the background sampler pulls detection frames
+CAPTURE_PROFILES_ENABLED = True
+CAPTURE_PROFILES = {
+    "low": {"framesize": 5, "quality": 30},
+    "high": {"framesize": 9, "quality": 10},
+    "idle": {"framesize": 5, "quality": 10},
+}
+CAPTURE_PROFILE_DISCARD = 1     # Frames dropped after switching to "high" (may predate the switch)
+CAPTURE_PROFILE_REFRESH = 60    # Seconds before an unchanged profile is sent again (camera may have rebooted)
+camera_profiles = {}            # camera URL -> (profile name, time applied)
+camera_profile_locks = {}       # camera URL -> RLock, held for a whole high resolution capture
+camera_profile_locks_lock = threading.Lock()
+
+# Camera registry: camera id -> base URL, door -> camera ids (first healthy one takes photos for the app)
+# Loaded from CAMERA_CONFIG_FILE at startup, without it IMAGE_URL is the only camera:
+# {"cameras": {"front": "http://10.76.135.201", "porch": "http://10.76.135.202"},
+#  "doors": {"front_door": ["front", "porch"]}}
+CAMERA_CONFIG_FILE = "cameras.json"
+DEFAULT_CAMERA_ID = "camera"
+CAMERA_UNHEALTHY_FAILURES = 3   # Consecutive failed fetches before a camera counts as unhealthy
+CAMERA_FETCH_WORKERS = 2        # Fetch threads per camera (sampler and detection may overlap)
+camera_registry = {DEFAULT_CAMERA_ID: IMAGE_URL}
+door_cameras = {DEFAULT_DOOR_ID: [DEFAULT_CAMERA_ID]}
+camera_registry_lock = threading.Lock()  # camera_registry and door_cameras are swapped together
+camera_executors = {}           # camera id -> ThreadPoolExecutor (own pool, a slow camera never delays another)
+camera_executor_lock = threading.Lock()
+
+# Runtime configuration: CONFIG_FILE overrides the module defaults listed in RELOADABLE_SETTINGS and is
+# re-read when it changes (CAMERA_CONFIG_FILE too), so changes apply to the next job without a restart.
+# The whole file is validated before anything is swapped in; a bad file is reported and ignored
+CONFIG_FILE = "server_config.json"
+CONFIG_POLL_INTERVAL = 2        # Seconds between checks for changed config files
+config_lock = threading.Lock()
+config_defaults = {}            # Values before the first load (a key removed from the file gets its default back)
+config_settings = None          # Current RELOADABLE_SETTINGS values, replaced (never changed in place) by a reload
+config_status = {"loaded_at": None, "changed": [], "error": None}
+config_watcher_thread = None
+SECRET_SETTINGS = {"SMTP_PASSWORD", "DEVICE_SECRET"}  # Masked in GET /config and logs
+
+# name -> (type, check); everything else (paths, worker counts, buffer sizes) needs a restart
+RELOADABLE_SETTINGS = {
+    "IMAGE_URL": (str, lambda v: v.startswith(("http://", "https://"))),
+    "POSSIBLE_PATHS": (list, lambda v: len(v) > 0 and all(isinstance(path, str) for path in v)),
+    "SMTP_SERVER": (str, lambda v: len(v) > 0),
+    "SMTP_PORT": (int, lambda v: 0 < v < 65536),
+    "SMTP_USER": (str, None),
+    "SMTP_PASSWORD": (str, None),
+    "DEVICE_SECRET": (str, lambda v: len(v) >= 8),
+    "EMAIL_TO": (str, lambda v: "@" in v),
+    "EMAIL_IMAGE_SIZE": (str, lambda v: v == "full" or v in IMAGE_SIZES),
+    "COMMAND_QUEUE_SIZE": (int, lambda v: v > 0),
+    "COMMAND_ACK_ENABLED": (bool, None),
+    "COMMAND_LEASE_SECONDS": (float, lambda v: v > 0),
+    "COMMAND_MAX_DELIVERIES": (int, lambda v: v > 0),
+    "COMMAND_COALESCE_ENABLED": (bool, None),
+    "FACE_SCALE_FACTOR": (float, lambda v: 1.0 < v <= 2.0),
+    "FACE_MIN_NEIGHBORS": (int, lambda v: v >= 0),
+    "FACE_MIN_SIZE": (tuple, lambda v: len(v) == 2 and all(isinstance(n, int) and n > 0 for n in v)),
+    "FACE_TRACKING_ENABLED": (bool, None),
+    "FACE_MIN_NEIGHBORS_TRACKED": (int, lambda v: v >= 0),
+    "TRACK_MIN_IOU": (float, lambda v: 0 <= v <= 1),
+    "TRACK_MAX_CENTROID_DISTANCE": (float, lambda v: v >= 0),
+    "TRACK_MIN_SCALE_RATIO": (float, lambda v: 0 <= v <= 1),
+    "TRACK_MAX_GAP": (int, lambda v: v >= 0),
+    "ALERT_DEDUP_ENABLED": (bool, None),
+    "ALERT_DEDUP_WINDOW": (float, lambda v: v >= 0),
+    "ALERT_DEDUP_MAX_DISTANCE": (int, lambda v: 0 <= v <= 64),
+    "BACKGROUND_SAMPLER_ENABLED": (bool, None),
+    "SAMPLER_INTERVAL": (float, lambda v: v > 0),
+    "PRE_TRIGGER_LOOKBACK": (float, lambda v: v >= 0),
+    "TRIGGER_LIVE_WINDOW": (float, lambda v: v >= 0),
+    "ADAPTIVE_CAPTURE_ENABLED": (bool, None),
+    "CAPTURE_INITIAL_WAIT": (float, lambda v: v >= 0),
+    "CAPTURE_MIN_INTERVAL": (float, lambda v: v >= 0),
+    "CAPTURE_MAX_INTERVAL": (float, lambda v: v > 0),
+    "CAPTURE_MAX_FRAMES": (int, lambda v: v > 0),
+    "CAPTURE_DEADLINE": (float, lambda v: v > 0),
+    "FACE_FRAMES_REQUIRED": (int, lambda v: v > 0),
+    "NO_FACE_FRAMES_REQUIRED": (int, lambda v: v > 0),
+    "NO_FACE_SPAN": (float, lambda v: v >= 0),
+    "CAPTURE_PROFILES_ENABLED": (bool, None),
+    "CAPTURE_PROFILES": (dict, lambda v: {"low", "high"} <= set(v) <= {"low", "high", "idle"} and all(
+        isinstance(profile, dict) and all(isinstance(value, int) for value in profile.values())
+        for profile in v.values())),
+    "CAMERA_UNHEALTHY_FAILURES": (int, lambda v: v > 0),
+    "RECOGNITION_THRESHOLD": (float, lambda v: -1 <= v <= 1),
+    "RATE_LIMIT_ENABLED": (bool, None),
+    "RATE_LIMITS": (dict, lambda v: set(v) == set(RATE_LIMITS) and all(
+        isinstance(limit, tuple) and len(limit) == 2 and all(isinstance(n, (int, float)) for n in limit)
+        and limit[0] >= 1 and limit[1] > 0 for limit in v.values())),
+}
+
+def get_face_cascade():
+    """Get face detector (Haar Cascade) for the current thread, loaded once per thread"""
+    face_cascade = getattr(face_cascade_local, "cascade", None)
+    if face_cascade is None:
         face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        face_cascade_local.cascade = face_cascade
+    return face_cascade
+
+def get_detection_executor():
+    """Get shared worker pool for batch face detection"""
+    global detection_executor
+    with detection_executor_lock:
+        if detection_executor is None:
+            detection_executor = ThreadPoolExecutor(max_workers=DETECTION_WORKERS)
+        return detection_executor
+
+def analyze_frame(image_data, index=0, settings=None):
+    """Decode one JPEG and detect faces, return result dict with boxes, confidence and timing"""
+    settings = settings or get_settings()
+    result = {
+        "index": index,
+        "has_face": False,
+        "face_count": 0,
+        "boxes": [],
+        "confidence": [],
+        "max_confidence": 0.0,
+        "decode_ms": 0.0,
+        "detect_ms": 0.0,
+        "error": None
+    }
+    if image_data is None:
+        result["error"] = "no image"
+        return result
+    
+    try:
+        started = time.perf_counter()
+        # Decode directly to grayscale (face detection requires grayscale)
+        gray = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        decoded = time.perf_counter()
+        result["decode_ms"] = (decoded - started) * 1000
         
-        # Convert to grayscale (face detection requires grayscale)
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if gray is None:
+            result["error"] = "cannot decode image"
+            return result
         
-        # Detect faces
-        faces = face_cascade.detectMultiScale(
+        # detectMultiScale3 returns the same faces as detectMultiScale plus a score per face
+        faces, _, level_weights = get_face_cascade().detectMultiScale3(
             gray,
-            scaleFactor=1.1,  # Image scale factor
-            minNeighbors=5,    # Minimum neighbors
-            minSize=(30, 30)   # Minimum face size
+            scaleFactor=settings["FACE_SCALE_FACTOR"],
+            minNeighbors=settings["FACE_MIN_NEIGHBORS_TRACKED" if settings["FACE_TRACKING_ENABLED"] else "FACE_MIN_NEIGHBORS"],
+            minSize=settings["FACE_MIN_SIZE"],
+            outputRejectLevels=True
         )
+        result["detect_ms"] = (time.perf_counter() - decoded) * 1000
         
         if len(faces) > 0:
-            print("✓ Detected {} face(s)".format(len(faces)))
-            return True
-        else:
-            print("✗ No face detected")
-            return False
-            
+            result["has_face"] = True
+            result["face_count"] = len(faces)
+            result["boxes"] = [[int(v) for v in box] for box in faces]
+            result["confidence"] = [float(w) for w in np.ravel(level_weights)]
+            result["max_confidence"] = max(result["confidence"])
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+def detect_faces_in_images(images, settings=None):
+    """Detect faces in a list of JPEG buffers (decoded and analyzed in parallel), one result dict per frame"""
+    if not images:
+        return []
+    # Even a single frame goes to the pool: its workers already have the cascade loaded (warm-up)
+    executor = get_detection_executor()
+    futures = [executor.submit(analyze_frame, image_data, i, settings) for i, image_data in enumerate(images)]
+    return [future.result() for future in futures]
+
+def warm_up_detection_worker(barrier):
+    """Load models in one detection worker thread and run the cascade once"""
+    get_face_cascade().detectMultiScale(np.zeros((64, 64), np.uint8))
+    get_face_recognizer()
+    # Keep this worker busy until every worker has loaded, so each task lands on its own thread
+    barrier.wait(timeout=60)
+
+def warm_up():
+    """Import cv2/numpy and load detection (and recognition) models, then mark the server ready"""
+    warmup_state["started"] = time.time()
+    try:
+        barrier = threading.Barrier(DETECTION_WORKERS)
+        executor = get_detection_executor()
+        futures = [executor.submit(warm_up_detection_worker, barrier) for _ in range(DETECTION_WORKERS)]
+        for future in futures:
+            future.result()
+        # Map the enrolled-resident index (recognition is skipped without the SFace model)
+        if get_face_recognizer() is not None:
+            print("✓ Face recognition enabled, {} enrolled face(s)".format(load_known_faces()))
+        elif RECOGNITION_ENABLED:
+            print("Face recognition off: model {} not found".format(RECOGNITION_MODEL_FILE))
+        warmup_state["ready"] = True
+        print("✓ Warm-up done in {:.2f} seconds, ready for face detection".format(time.time() - warmup_state["started"]))
     except Exception as e:
-        print("✗ Face detection error: {}".format(e))
+        warmup_state["error"] = str(e)
+        print("✗ Warm-up failed: {}".format(e))
+    warmup_state["finished"] = time.time()
+
+def start_warmup():
+    """Run warm_up in a background thread"""
+    thread = threading.Thread(target=warm_up)
+    thread.daemon = True
+    thread.start()
+
+def detect_faces_in_image(image_data):
+    """Detect if there are faces in the image"""
+    result = analyze_frame(image_data)
+    
+    if result["error"]:
+        print("✗ Face detection error: {}".format(result["error"]))
         return False
+    
+    if result["has_face"]:
+        print("✓ Detected {} face(s)".format(result["face_count"]))
+        return True
+    else:
+        print("✗ No face detected")
+        return False
+
+def box_iou(boxes_a, boxes_b):
+    """IoU matrix (N x M) between two arrays of x, y, w, h boxes"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    overlap_w = np.clip(np.minimum((a[:, 0] + a[:, 2])[:, None], (b[:, 0] + b[:, 2])[None, :])
+                        - np.maximum(a[:, 0][:, None], b[:, 0][None, :]), 0, None)
+    overlap_h = np.clip(np.minimum((a[:, 1] + a[:, 3])[:, None], (b[:, 1] + b[:, 3])[None, :])
+                        - np.maximum(a[:, 1][:, None], b[:, 1][None, :]), 0, None)
+    intersection = overlap_w * overlap_h
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - intersection
+    return intersection / np.maximum(union, 1e-6)
+
+def box_centroid_distance(boxes_a, boxes_b):
+    """Distance matrix (N x M) between box centers, in mean face widths of each pair"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    centers_a = a[:, :2] + a[:, 2:] / 2
+    centers_b = b[:, :2] + b[:, 2:] / 2
+    distance = np.linalg.norm(centers_a[:, None, :] - centers_b[None, :, :], axis=2)
+    return distance / np.maximum((a[:, 2][:, None] + b[:, 2][None, :]) / 2, 1e-6)
+
+def track_faces(frame_boxes, settings=None):
+    """Link face boxes across frames of one camera (list of box lists, oldest first)
+    
+    Returns one dict per track: frame indices, boxes, hits, stability (share of frames the face is in)
+    and mean IoU between successive boxes.
+    """
+    settings = settings or get_settings()
+    tracks = []
+    for frame_index, boxes in enumerate(frame_boxes):
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        active = [track for track in tracks if frame_index - track["frames"][-1] <= settings["TRACK_MAX_GAP"] + 1]
+        matched = set()
+        if active and len(boxes):
+            last_boxes = np.array([track["boxes"][-1] for track in active], dtype=np.float32)
+            iou = box_iou(last_boxes, boxes)
+            distance = box_centroid_distance(last_boxes, boxes)
+            widths_a = last_boxes[:, 2][:, None]
+            widths_b = boxes[:, 2][None, :]
+            scale = np.minimum(widths_a, widths_b) / np.maximum(np.maximum(widths_a, widths_b), 1e-6)
+            valid = (((iou >= settings["TRACK_MIN_IOU"]) | (distance <= settings["TRACK_MAX_CENTROID_DISTANCE"]))
+                     & (scale >= settings["TRACK_MIN_SCALE_RATIO"]))
+            cost = np.where(valid, (1 - iou) + distance, np.inf)
+            # Greedy assignment, cheapest pair first (a handful of faces, no need for Hungarian)
+            for _ in range(min(cost.shape)):
+                track_index, box_index = np.unravel_index(np.argmin(cost), cost.shape)
+                if not np.isfinite(cost[track_index, box_index]):
+                    break
+                track = active[track_index]
+                track["frames"].append(frame_index)
+                track["boxes"].append(boxes[box_index].tolist())
+                track["ious"].append(float(iou[track_index, box_index]))
+                matched.add(box_index)
+                cost[track_index, :] = np.inf
+                cost[:, box_index] = np.inf
+        for box_index in range(len(boxes)):
+            if box_index not in matched:
+                tracks.append({"track_id": len(tracks), "frames": [frame_index],
+                               "boxes": [boxes[box_index].tolist()], "ious": []})
+    for track in tracks:
+        track["hits"] = len(track["frames"])
+        track["stability"] = track["hits"] / float(len(frame_boxes))
+        track["mean_iou"] = float(np.mean(track["ious"])) if track["ious"] else 0.0
+        del track["ious"]
+    return tracks
+
+def face_vote_frames(results, frame_cameras, settings=None):
+    """Frames that count toward the face vote: with tracking, the frames of the most stable track
+    
+    Returns (list of True/False per frame, best track dict or None). Boxes are only comparable
+    within one camera, so each camera's frames are tracked separately.
+    """
+    settings = settings or get_settings()
+    if not settings["FACE_TRACKING_ENABLED"]:
+        return [result["has_face"] for result in results], None
+    best_track = None
+    for camera_id in set(frame_cameras):
+        indices = [i for i, frame_camera in enumerate(frame_cameras) if frame_camera == camera_id]
+        for track in track_faces([results[i]["boxes"] for i in indices], settings):
+            track["camera"] = camera_id
+            track["frames"] = [indices[i] for i in track["frames"]]
+            if best_track is None or (track["hits"], track["mean_iou"]) > (best_track["hits"], best_track["mean_iou"]):
+                best_track = track
+    flags = [False] * len(results)
+    if best_track is not None:
+        for i in best_track["frames"]:
+            flags[i] = True
+    return flags, best_track
+
+def get_face_recognizer():
+    """Get SFace recognizer for the current thread (None if recognition is off or the model is missing)"""
+    if not RECOGNITION_ENABLED or not os.path.exists(RECOGNITION_MODEL_FILE):
+        return None
+    recognizer = getattr(face_recognizer_local, "recognizer", None)
+    if recognizer is None:
+        recognizer = cv2.FaceRecognizerSF.create(RECOGNITION_MODEL_FILE, "")
+        face_recognizer_local.recognizer = recognizer
+    return recognizer
 
-def get_image_from_esp32(url, max_retries=3):
-    """Get photo from ESP32 website"""
+def compute_face_embeddings(image_data, boxes):
+    """L2-normalized embedding (M x 128) of each face box in a JPEG, None if recognition is unavailable
+    
+    SFace expects faces aligned from landmarks; the Haar cascade has none, so each box is cropped
+    with a margin and scaled to 112 x 112 instead (slightly lower accuracy, no extra detector).
+    """
+    recognizer = get_face_recognizer()
+    if recognizer is None or not len(boxes):
+        return None
+    image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    embeddings = []
+    for x, y, w, h in boxes:
+        margin = int(w * RECOGNITION_CROP_MARGIN)
+        crop = image[max(0, y - margin):min(height, y + h + margin), max(0, x - margin):min(width, x + w + margin)]
+        feature = recognizer.feature(cv2.resize(crop, (112, 112))).reshape(-1)
+        embeddings.append(feature / max(float(np.linalg.norm(feature)), 1e-6))
+    return np.array(embeddings, dtype=np.float32)
+
+def load_known_faces():
+    """Memory-map the enrolled embeddings and load their names (nothing enrolled yet is fine)"""
+    global known_face_embeddings, known_face_names
+    with known_faces_lock:
+        if not os.path.exists(KNOWN_FACES_FILE):
+            known_face_embeddings, known_face_names = None, []
+            return 0
+        embeddings = np.load(KNOWN_FACES_FILE, mmap_mode="r")
+        with open(KNOWN_FACES_NAMES_FILE) as f:
+            names = json.load(f)
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(names):
+            raise ValueError("{} has {} rows but {} lists {} names".format(
+                KNOWN_FACES_FILE, embeddings.shape[0], KNOWN_FACES_NAMES_FILE, len(names)))
+        known_face_embeddings, known_face_names = embeddings, names
+        return len(names)
+
+def match_known_faces(embeddings, settings=None):
+    """Best enrolled match of each embedding: [(name or None, similarity)], one matmul for all faces"""
+    threshold = (settings or get_settings())["RECOGNITION_THRESHOLD"]
+    with known_faces_lock:
+        if known_face_embeddings is None or embeddings is None or not len(embeddings):
+            return [(None, 0.0)] * (0 if embeddings is None else len(embeddings))
+        similarity = embeddings @ known_face_embeddings.T  # M x N cosine similarities
+        best = np.argmax(similarity, axis=1)
+        scores = similarity[np.arange(len(best)), best]
+        return [(known_face_names[index] if score >= threshold else None, float(score))
+                for index, score in zip(best, scores)]
+
+def enroll_known_face(name, embedding):
+    """Append one embedding to the index file and re-map it, return the number of enrolled faces"""
+    global known_face_embeddings, known_face_names
+    with known_faces_lock:
+        if known_face_embeddings is not None:
+            embeddings = np.vstack([np.asarray(known_face_embeddings), embedding.reshape(1, -1)])
+        else:
+            embeddings = embedding.reshape(1, -1)
+        names = known_face_names + [name]
+        # Release the old mapping before replacing the file (Windows cannot replace a mapped file)
+        known_face_embeddings = None
+        with open(KNOWN_FACES_FILE + ".tmp", "wb") as f:
+            np.save(f, embeddings.astype(np.float32))
+        with open(KNOWN_FACES_NAMES_FILE + ".tmp", "w") as f:
+            json.dump(names, f)
+        os.replace(KNOWN_FACES_FILE + ".tmp", KNOWN_FACES_FILE)
+        os.replace(KNOWN_FACES_NAMES_FILE + ".tmp", KNOWN_FACES_NAMES_FILE)
+        known_face_embeddings = np.load(KNOWN_FACES_FILE, mmap_mode="r")
+        known_face_names = names
+        return len(names)
+
+def recognize_visitors(image_data, boxes, settings=None):
+    """Names of enrolled residents among the face boxes of a JPEG (None if recognition is unavailable)"""
+    started = time.perf_counter()
+    # Run in a detection worker, where the recognizer was loaded during warm-up
+    embeddings = get_detection_executor().submit(compute_face_embeddings, image_data, boxes).result()
+    if embeddings is None:
+        return None
+    embedded = time.perf_counter()
+    matches = match_known_faces(embeddings, settings)
+    print("Recognition: {} face(s), embeddings {:.1f} ms, lookup {:.3f} ms over {} enrolled".format(
+        len(matches), (embedded - started) * 1000, (time.perf_counter() - embedded) * 1000, len(known_face_names)))
+    for name, score in matches:
+        print("  {} (similarity {:.2f})".format(name or "Unknown", score))
+    return [name for name, _ in matches if name is not None]
+
+def get_frame_id(image_data):
+    """Get a short content-based ID for a frame"""
+    return hashlib.blake2b(image_data, digest_size=8).hexdigest()
+
+def get_resized_image(image_data, size, frame_id=None):
+    """Get JPEG of the frame at the requested size (encoded once per frame and size, then cached)"""
+    global resize_cache_bytes
+    
+    if size is None or size == "full":
+        return image_data
+    if size not in IMAGE_SIZES:
+        raise ValueError("Unknown image size: {}".format(size))
+    
+    if frame_id is None:
+        frame_id = get_frame_id(image_data)
+    key = (frame_id, size)
+    
+    with resize_cache_lock:
+        cached = resize_cache.get(key)
+        if cached is not None:
+            resize_cache.move_to_end(key)
+            return cached
+    
+    max_width, quality = IMAGE_SIZES[size]
+    image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        print("✗ Cannot decode image for resizing")
+        return image_data
+    
+    height, width = image.shape[:2]
+    if width > max_width:
+        # INTER_AREA gives the best quality when shrinking
+        new_height = max(1, int(round(height * max_width / float(width))))
+        image = cv2.resize(image, (max_width, new_height), interpolation=cv2.INTER_AREA)
+    
+    success, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    resized_data = encoded.tobytes() if success else image_data
+    # Never return something larger than the original frame
+    if len(resized_data) >= len(image_data):
+        resized_data = image_data
+    
+    with resize_cache_lock:
+        if key not in resize_cache:
+            resize_cache[key] = resized_data
+            resize_cache_bytes += len(resized_data)
+            # Evict least recently used variants until under the size limit
+            while resize_cache_bytes > RESIZE_CACHE_MAX_BYTES and len(resize_cache) > 1:
+                _, evicted = resize_cache.popitem(last=False)
+                resize_cache_bytes -= len(evicted)
+    
+    return resized_data
+
+def compute_dhash(image_data):
+    """Compute 64-bit difference hash of a JPEG frame (None if it cannot be decoded)"""
+    # Reduced decode is much faster and the hash only needs a 9x8 thumbnail
+    gray = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return np.packbits(bits).view('>u8')[0].astype(np.uint64)
+
+def get_alert_hash_entry(door):
+    """Get (or create) hash ring buffer for a door, caller must hold alert_hash_lock"""
+    entry = alert_hash_index.get(door)
+    if entry is None:
+        entry = {
+            "hashes": np.zeros(ALERT_DEDUP_CAPACITY, dtype=np.uint64),
+            "times": np.full(ALERT_DEDUP_CAPACITY, -np.inf),
+            "merged": np.zeros(ALERT_DEDUP_CAPACITY, dtype=np.int64),
+            "count": 0
+        }
+        alert_hash_index[door] = entry
+    return entry
+
+def find_duplicate_alert(door, frame_hash, now=None, settings=None):
+    """Find a recent alert similar to frame_hash; merge into it and return (index, distance, merged count), or None"""
+    settings = settings or get_settings()
+    if now is None:
+        now = time.time()
+    with alert_hash_lock:
+        entry = get_alert_hash_entry(door)
+        # Hamming distance to every remembered hash at once: XOR, then count the set bits
+        xor = np.bitwise_xor(entry["hashes"], frame_hash)
+        distances = np.unpackbits(xor.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+        candidates = ((entry["times"] >= now - settings["ALERT_DEDUP_WINDOW"])
+                      & (distances <= settings["ALERT_DEDUP_MAX_DISTANCE"]))
+        if not candidates.any():
+            return None
+        index = int(np.argmin(np.where(candidates, distances, 65)))
+        entry["merged"][index] += 1
+        return index, int(distances[index]), int(entry["merged"][index])
+
+def register_alert(door, frame_hash, now=None):
+    """Remember hash of an alerted frame"""
+    if now is None:
+        now = time.time()
+    with alert_hash_lock:
+        entry = get_alert_hash_entry(door)
+        slot = entry["count"] % ALERT_DEDUP_CAPACITY
+        entry["hashes"][slot] = frame_hash
+        entry["times"][slot] = now
+        entry["merged"][slot] = 0
+        entry["count"] += 1
+
+def get_image_from_esp32(url, max_retries=3, quiet=False, track_latency=True, settings=None):
+    """Get photo from ESP32 website (track_latency=False keeps off-profile fetches out of camera_stats)"""
+    # Try the path that worked last time first (if it is still configured)
+    paths = list((settings or get_settings())["POSSIBLE_PATHS"])
+    working_path = working_image_paths.get(url)
+    if working_path in paths:
+        paths.remove(working_path)
+        paths.insert(0, working_path)
+    
     for attempt in range(max_retries):
-        for path in POSSIBLE_PATHS:
+        for path in paths:
             full_url = url + path if path else url
             try:
-                print("Trying to fetch photo from {}... (attempt {}/{})".format(full_url, attempt + 1, max_retries))
+                if not quiet:
+                    print("Trying to fetch photo from {}... (attempt {}/{})".format(full_url, attempt + 1, max_retries))
+                started = time.perf_counter()
                 response = requests.get(full_url, timeout=30, stream=True)
                 
                 if response.status_code == 200:
@@ -106,33 +808,437 @@ def get_image_from_esp32(url, max_retries=3):
                     # Check if it's an image
                     if 'image' in content_type or path.endswith(('.jpg', '.jpeg', '.png')):
                         image_data = response.content
-                        print("✓ Photo fetched successfully, size: {} bytes".format(len(image_data)))
+                        fetch_time = time.perf_counter() - started
+                        if not quiet:
+                            print("✓ Photo fetched successfully, size: {} bytes, {:.0f} ms".format(
+                                len(image_data), fetch_time * 1000))
                         response.close()
+                        working_image_paths[url] = path
+                        if track_latency:
+                            record_camera_fetch(url, fetch_time)
                         return image_data, full_url
                     else:
                         response.close()
                         
             except Exception as e:
-                print("Error: {}, trying next path...".format(e))
+                if not quiet:
+                    print("Error: {}, trying next path...".format(e))
                 continue
         
         if attempt < max_retries - 1:
-            print("Waiting 3 seconds before retry...")
+            if not quiet:
+                print("Waiting 3 seconds before retry...")
             time.sleep(3)
     
-    print("✗ All attempts failed")
+    if not quiet:
+        print("✗ All attempts failed")
+    if track_latency:
+        record_camera_fetch(url, None)
     return None, None
 
-def send_email_smtp(image_data, image_filename, to_email):
-    """Send email using SMTP"""
+def get_camera_profile_lock(url):
+    """Get (or create) the profile lock of a camera"""
+    with camera_profile_locks_lock:
+        lock = camera_profile_locks.get(url)
+        if lock is None:
+            lock = camera_profile_locks[url] = threading.RLock()
+        return lock
+
+def set_camera_profile(url, name, settings=None):
+    """Apply a capture profile through the camera's /control endpoint, skipped if it is already active"""
+    settings = settings or get_settings()
+    if not settings["CAPTURE_PROFILES_ENABLED"]:
+        return False
+    with get_camera_profile_lock(url):
+        current = camera_profiles.get(url)
+        if current is not None and current[0] == name and time.time() - current[1] < CAPTURE_PROFILE_REFRESH:
+            return True
+        try:
+            for variable, value in sorted(settings["CAPTURE_PROFILES"][name].items()):
+                response = requests.get(url + "/control", params={"var": variable, "val": value}, timeout=5)
+                response.close()
+                if response.status_code != 200:
+                    raise RuntimeError("{}={} rejected (HTTP {})".format(variable, value, response.status_code))
+        except Exception as e:
+            print("✗ Cannot set capture profile {} on {}: {}".format(name, url, e))
+            camera_profiles.pop(url, None)
+            return False
+        camera_profiles[url] = (name, time.time())
+        return True
+
+def idle_profile(settings):
+    """Profile a camera is left on between events"""
+    if settings["BACKGROUND_SAMPLER_ENABLED"] or "idle" not in settings["CAPTURE_PROFILES"]:
+        return "low"
+    return "idle"
+
+def restore_idle_profiles(urls, settings=None):
+    """Switch cameras back to the idle profile once an event is over"""
+    settings = settings or get_settings()
+    if not settings["CAPTURE_PROFILES_ENABLED"]:
+        return
+    for url in urls:
+        set_camera_profile(url, idle_profile(settings), settings)
+
+def capture_high_res_frame(url, max_retries=3, settings=None):
+    """Fetch one frame with the "high" profile and switch the camera back to its idle profile afterwards"""
+    settings = settings or get_settings()
+    if not settings["CAPTURE_PROFILES_ENABLED"]:
+        return get_image_from_esp32(url, max_retries, settings=settings)
+    # Hold the profile lock so the sampler cannot switch back to "low" halfway through
+    with get_camera_profile_lock(url):
+        if not set_camera_profile(url, "high", settings):
+            return get_image_from_esp32(url, max_retries, settings=settings)
+        print("Capturing high resolution frame...")
+        for _ in range(CAPTURE_PROFILE_DISCARD):
+            get_image_from_esp32(url, max_retries=1, quiet=True, track_latency=False, settings=settings)
+        image_data, image_url = get_image_from_esp32(url, max_retries, track_latency=False, settings=settings)
+        set_camera_profile(url, idle_profile(settings), settings)
+    return image_data, image_url
+
+def fetch_low_res_frame(url, max_retries=3, quiet=False, settings=None):
+    """Fetch one frame with the "low" profile (the one detection runs on)"""
+    set_camera_profile(url, "low", settings)
+    return get_image_from_esp32(url, max_retries, quiet, settings=settings)
+
+def load_camera_registry(path=CAMERA_CONFIG_FILE):
+    """Load cameras and the door mapping from a JSON file, IMAGE_URL for every door if it does not exist"""
+    global camera_registry, door_cameras
+    if not os.path.exists(path):
+        with camera_registry_lock:
+            camera_registry = {DEFAULT_CAMERA_ID: IMAGE_URL}
+            door_cameras = {DEFAULT_DOOR_ID: [DEFAULT_CAMERA_ID]}
+        print("Camera config {} not found, using {} for every door".format(path, IMAGE_URL))
+        return False
+    with open(path) as f:
+        config = json.load(f)
+    registry = {str(camera_id): url.rstrip("/") for camera_id, url in config["cameras"].items()}
+    doors = {}
+    for door, camera_ids in config.get("doors", {DEFAULT_DOOR_ID: list(registry)}).items():
+        unknown = [camera_id for camera_id in camera_ids if camera_id not in registry]
+        if unknown or not camera_ids:
+            raise ValueError("Door {} needs one or more known cameras (unknown: {})".format(door, ", ".join(unknown)))
+        doors[door] = list(camera_ids)
+    with camera_registry_lock:
+        camera_registry = registry
+        door_cameras = doors
+    print("✓ Loaded {} camera(s) for {} door(s) from {}".format(len(registry), len(doors), path))
+    return True
+
+def get_door_cameras(door):
+    """[(camera id, base URL)] of a door, unknown doors use the default door's cameras"""
+    with camera_registry_lock:
+        registry, doors = camera_registry, door_cameras
+    camera_ids = doors.get(door) or doors.get(DEFAULT_DOOR_ID) or list(registry)
+    return [(camera_id, registry[camera_id]) for camera_id in camera_ids]
+
+def is_known_door(door):
+    """Whether door is a configured door with a name that is safe to archive under"""
+    if not valid_door_name(door):
+        return False
+    with camera_registry_lock:
+        return door in door_cameras
+
+def get_photo_camera(door):
+    """Base URL of the camera that takes photos for a door: the first healthy one, else the first"""
+    cameras = get_door_cameras(door)
+    for _, url in cameras:
+        if is_camera_healthy(url):
+            return url
+    return cameras[0][1]
+
+def validate_setting(name, value):
+    """Check a value from CONFIG_FILE against RELOADABLE_SETTINGS, return it converted to the setting's type"""
+    expected_type, check = RELOADABLE_SETTINGS[name]
+    # JSON has no tuples and writes 1.0 as 1
+    if expected_type is float and isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)
+    elif expected_type is tuple and isinstance(value, list):
+        value = tuple(value)
+    elif name == "RATE_LIMITS" and isinstance(value, dict):
+        # Compared with the tuple defaults on every reload, as lists they would always count as changed
+        value = {key: tuple(limit) if isinstance(limit, list) else limit for key, limit in value.items()}
+    if not isinstance(value, expected_type) or (expected_type is int and isinstance(value, bool)):
+        raise ValueError("{} must be {}, got {!r}".format(name, expected_type.__name__, value))
+    if check is not None and not check(value):
+        raise ValueError("{} has an invalid value: {!r}".format(name, value))
+    return value
+
+def format_setting(name, value):
+    """Setting value for logs and GET /config (secrets masked)"""
+    return "***" if name in SECRET_SETTINGS and value else value
+
+def get_settings():
+    """Current values of RELOADABLE_SETTINGS (a job takes this once, so a reload cannot change it midway)"""
+    global config_settings
+    settings = config_settings
+    if settings is None:
+        with config_lock:
+            if config_settings is None:
+                config_settings = {name: globals()[name] for name in RELOADABLE_SETTINGS}
+            settings = config_settings
+    return settings
+
+def load_config(path=CONFIG_FILE):
+    """Validate the config file, then swap all settings in at once; return the names that changed"""
+    global config_settings
+    with config_lock:
+        if not config_defaults:
+            config_defaults.update({name: globals()[name] for name in RELOADABLE_SETTINGS})
+        overrides = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                overrides = json.load(f)
+            if not isinstance(overrides, dict):
+                raise ValueError("{} must contain a JSON object".format(path))
+            unknown = sorted(set(overrides) - set(RELOADABLE_SETTINGS))
+            if unknown:
+                raise ValueError("Unknown or restart-only setting(s): {}".format(", ".join(unknown)))
+        values = dict(config_defaults)
+        for name, value in overrides.items():
+            values[name] = validate_setting(name, value)
+        changed = {name: value for name, value in values.items() if globals()[name] != value}
+        # Jobs read the get_settings() snapshot they started with, so only jobs started from now on
+        # see the new values; the globals serve single reads (request handlers, background threads)
+        globals().update(changed)
+        config_settings = dict(values)
+        config_status.update({"loaded_at": time.time(), "changed": sorted(changed), "error": None})
+    apply_config_changes(changed)
+    if changed:
+        print("✓ Config {} applied: {}".format(path, ", ".join(
+            "{}={}".format(name, format_setting(name, value)) for name, value in sorted(changed.items()))))
+    return sorted(changed)
+
+def apply_config_changes(changed):
+    """Update components that keep state derived from a setting"""
+    if "IMAGE_URL" in changed and not os.path.exists(CAMERA_CONFIG_FILE):
+        load_camera_registry()
+    if "POSSIBLE_PATHS" in changed:
+        # A remembered path may no longer be in the list
+        working_image_paths.clear()
+    if "CAPTURE_PROFILES" in changed or "CAPTURE_PROFILES_ENABLED" in changed:
+        # Profiles are re-sent to every camera on its next fetch
+        camera_profiles.clear()
+    if "BACKGROUND_SAMPLER_ENABLED" in changed and config_watcher_thread is not None:
+        # Same as at startup: the pre-trigger buffer is per process, only the first worker samples
+        if BACKGROUND_SAMPLER_ENABLED and worker_index == 0:
+            start_frame_sampler()
+        else:
+            stop_frame_sampler()
+
+def get_file_state(path):
+    """(mtime, size) of a file, None if it does not exist"""
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+def config_watcher_loop():
+    """Background thread: reload CONFIG_FILE and CAMERA_CONFIG_FILE when they change"""
+    loaders = ((CONFIG_FILE, load_config), (CAMERA_CONFIG_FILE, load_camera_registry))
+    states = {path: get_file_state(path) for path, _ in loaders}
+    while True:
+        time.sleep(CONFIG_POLL_INTERVAL)
+        for path, loader in loaders:
+            state = get_file_state(path)
+            if state == states[path]:
+                continue
+            states[path] = state
+            try:
+                loader(path)
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                config_status["error"] = "{}: {}".format(path, e)
+                print("✗ {} not applied, keeping the running configuration: {}".format(path, e))
+
+def start_config_watcher():
+    """Start config watcher thread (only once)"""
+    global config_watcher_thread
+    if config_watcher_thread is not None:
+        return
+    config_watcher_thread = threading.Thread(target=config_watcher_loop)
+    config_watcher_thread.daemon = True
+    config_watcher_thread.start()
+
+def get_camera_executor(camera_id):
+    """Get the fetch worker pool of a camera"""
+    with camera_executor_lock:
+        executor = camera_executors.get(camera_id)
+        if executor is None:
+            executor = camera_executors[camera_id] = ThreadPoolExecutor(max_workers=CAMERA_FETCH_WORKERS)
+        return executor
+
+def fetch_camera_frames(cameras, max_retries=3, quiet=False, settings=None):
+    """Fetch one low resolution frame from every camera in parallel, return [(camera id, image data, image URL)]"""
+    if len(cameras) == 1:
+        camera_id, url = cameras[0]
+        return [(camera_id,) + fetch_low_res_frame(url, max_retries, quiet, settings)]
+    futures = []
+    for camera_id, url in cameras:
+        # An unhealthy camera gets a single attempt so its retries cannot hold up the round
+        retries = max_retries if is_camera_healthy(url) else 1
+        futures.append((camera_id, get_camera_executor(camera_id).submit(fetch_low_res_frame, url, retries, quiet, settings)))
+    return [(camera_id,) + future.result() for camera_id, future in futures]
+
+def pick_best_frame(frames, results):
+    """Index of the frame with the most confident face (a fetched frame if none has a face)"""
+    return max(range(len(frames)),
+               key=lambda i: (results[i]["has_face"], results[i]["max_confidence"], frames[i][1] is not None))
+
+def record_camera_fetch(url, fetch_time):
+    """Update latency EWMA and jitter (mean absolute deviation) of a camera, fetch_time None for a failure"""
+    with camera_stats_lock:
+        stats = camera_stats.setdefault(url, {"latency": None, "jitter": 0.0, "samples": 0, "failures": 0,
+                                              "consecutive_failures": 0, "last_success": None})
+        if fetch_time is None:
+            stats["failures"] += 1
+            stats["consecutive_failures"] += 1
+            return
+        stats["consecutive_failures"] = 0
+        stats["last_success"] = time.time()
+        if stats["latency"] is None:
+            stats["latency"] = fetch_time
+        else:
+            deviation = abs(fetch_time - stats["latency"])
+            stats["jitter"] += CAMERA_LATENCY_ALPHA * (deviation - stats["jitter"])
+            stats["latency"] += CAMERA_LATENCY_ALPHA * (fetch_time - stats["latency"])
+        stats["samples"] += 1
+
+def is_camera_healthy(url):
+    """False after CAMERA_UNHEALTHY_FAILURES failed fetches in a row"""
+    with camera_stats_lock:
+        stats = camera_stats.get(url)
+        return stats is None or stats["consecutive_failures"] < CAMERA_UNHEALTHY_FAILURES
+
+def get_camera_stats():
+    """Health and fetch statistics (milliseconds) of every registered camera (for /health)"""
+    result = {}
+    with camera_registry_lock:
+        registry, doors = camera_registry, door_cameras
+    with camera_stats_lock:
+        for camera_id, url in registry.items():
+            stats = camera_stats.get(url)
+            result[camera_id] = {
+                "url": url,
+                "doors": sorted(door for door, camera_ids in doors.items() if camera_id in camera_ids),
+                "healthy": stats is None or stats["consecutive_failures"] < CAMERA_UNHEALTHY_FAILURES,
+                "latency_ms": round(stats["latency"] * 1000, 1) if stats and stats["latency"] is not None else None,
+                "jitter_ms": round(stats["jitter"] * 1000, 1) if stats else None,
+                "samples": stats["samples"] if stats else 0,
+                "failures": stats["failures"] if stats else 0,
+                "last_success": stats["last_success"] if stats else None
+            }
+    return result
+
+def expected_fetch_time(url):
+    """Pessimistic fetch time of a camera (latency + 2 x jitter), None until it has answered once"""
+    with camera_stats_lock:
+        stats = camera_stats.get(url)
+        if stats is None or stats["latency"] is None:
+            return None
+        return stats["latency"] + 2 * stats["jitter"]
+
+def next_capture_interval(urls, ambiguous, settings=None):
+    """Seconds between the start of this round's fetches and the next one (urls: cameras in the round)"""
+    settings = settings or get_settings()
+    max_interval = settings["CAPTURE_MAX_INTERVAL"]
+    if not settings["ADAPTIVE_CAPTURE_ENABLED"]:
+        return max_interval
+    expected = [fetch_time for fetch_time in (expected_fetch_time(url) for url in urls) if fetch_time is not None]
+    if not expected:
+        # Cameras not measured yet: fixed schedule
+        return max_interval
+    expected = max(expected)
+    # Ambiguous results get the next frame as soon as the cameras can deliver it; a slow or
+    # jittery camera cannot go faster than its own fetch time anyway
+    target = settings["CAPTURE_MIN_INTERVAL"] if ambiguous else max_interval / 2
+    return min(max_interval, max(target, expected))
+
+def capture_decision(face_flags, frame_times, settings=None):
+    """Decide from the frames so far (face_vote_frames flags): "face", "no_face", or None to keep capturing"""
+    settings = settings or get_settings()
+    face_frames = sum(face_flags)
+    if face_frames >= settings["FACE_FRAMES_REQUIRED"]:
+        return "face"
+    if face_frames == 0 and len(face_flags) >= settings["NO_FACE_FRAMES_REQUIRED"] \
+            and frame_times[-1] - frame_times[0] >= settings["NO_FACE_SPAN"]:
+        return "no_face"
+    return None
+
+def is_ambiguous(face_flags, settings=None):
+    """True if a face was seen but not in enough frames to decide yet"""
+    return 0 < sum(face_flags) < (settings or get_settings())["FACE_FRAMES_REQUIRED"]
+
+def frame_sampler_loop():
+    """Background thread: fetch a frame from every camera each SAMPLER_INTERVAL seconds into the ring buffer"""
+    while not sampler_stop_event.is_set():
+        started = time.time()
+        with camera_registry_lock:
+            cameras = list(camera_registry.items())
+        frames = fetch_camera_frames(cameras, max_retries=1, quiet=True)
+        with frame_buffer_lock:
+            for camera_id, image_data, image_url in frames:
+                if image_data:
+                    frame_buffer.append((started, image_data, image_url, camera_id))
+            # Drop frames older than the buffer window
+            while frame_buffer and frame_buffer[0][0] < started - SAMPLER_BUFFER_SECONDS:
+                frame_buffer.popleft()
+        sampler_stop_event.wait(max(0, SAMPLER_INTERVAL - (time.time() - started)))
+
+def start_frame_sampler():
+    """Start background frame sampler thread (only once)"""
+    global sampler_thread
+    if sampler_thread is not None and sampler_thread.is_alive():
+        return
+    sampler_stop_event.clear()
+    sampler_thread = threading.Thread(target=frame_sampler_loop)
+    sampler_thread.daemon = True
+    sampler_thread.start()
+    print("✓ Background frame sampler started (every {} seconds, {} second buffer)".format(
+        SAMPLER_INTERVAL, SAMPLER_BUFFER_SECONDS))
+
+def stop_frame_sampler():
+    """Stop background frame sampler thread"""
+    sampler_stop_event.set()
+    with frame_buffer_lock:
+        frame_buffer.clear()
+
+def get_pre_trigger_frames(trigger_time, count=3, camera_ids=None, settings=None):
+    """Get up to count buffered frames (of camera_ids, default all) evenly spread over the PRE_TRIGGER_LOOKBACK window"""
+    if sampler_thread is None or not sampler_thread.is_alive():
+        return []
+    lookback = (settings or get_settings())["PRE_TRIGGER_LOOKBACK"]
+    with frame_buffer_lock:
+        frames = [frame for frame in frame_buffer
+                  if trigger_time - lookback <= frame[0] <= trigger_time
+                  and (camera_ids is None or frame[3] in camera_ids)]
+    if len(frames) <= count:
+        return frames
+    if count == 1:
+        return frames[-1:]
+    # Pick evenly spaced frames, always including the oldest and newest one
+    step = (len(frames) - 1) / float(count - 1)
+    return [frames[int(round(i * step))] for i in range(count)]
+
+def send_email_smtp(image_data, image_filename, to_email, size=None, frame_id=None, subject="ESP32 Photo",
+                    settings=None):
+    """Send email using SMTP (image resized to size, default EMAIL_IMAGE_SIZE)"""
+    settings = settings or get_settings()
+    smtp_user = settings["SMTP_USER"]
     try:
         print("Sending email to {}...".format(to_email))
         
+        # Shrink attachment (cached, so repeated sends of the same frame do not re-encode)
+        original_size = len(image_data)
+        image_data = get_resized_image(image_data, size or settings["EMAIL_IMAGE_SIZE"], frame_id)
+        if len(image_data) != original_size:
+            print("Attachment resized: {} -> {} bytes".format(original_size, len(image_data)))
+        
         # Create email
         msg = MIMEMultipart()
-        msg['From'] = SMTP_USER
+        msg['From'] = smtp_user
         msg['To'] = to_email
-        msg['Subject'] = "ESP32 Photo"
+        msg['Subject'] = subject
         
         # Email body
         body = "This is a photo fetched from ESP32 website.\n\nPhoto file: {}".format(image_filename)
@@ -146,14 +1252,14 @@ def send_email_smtp(image_data, image_filename, to_email):
         msg.attach(attachment)
         
         # Connect to SMTP server and send
-        print("Connecting to SMTP server {}:{}...".format(SMTP_SERVER, SMTP_PORT))
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+        print("Connecting to SMTP server {}:{}...".format(settings["SMTP_SERVER"], settings["SMTP_PORT"]))
+        server = smtplib.SMTP(settings["SMTP_SERVER"], settings["SMTP_PORT"])
         server.starttls()
         print("Logging in...")
-        server.login(SMTP_USER, SMTP_PASSWORD)
+        server.login(smtp_user, settings["SMTP_PASSWORD"])
         print("Sending email...")
         text = msg.as_string()
-        server.sendmail(SMTP_USER, to_email, text)
+        server.sendmail(smtp_user, to_email, text)
         server.quit()
         
         print("✓ Email sent successfully!")
@@ -163,60 +1269,295 @@ def send_email_smtp(image_data, image_filename, to_email):
         print("✗ Email sending failed: {}".format(e))
         return False
 
-def process_request_with_face_detection():
-    """Process request: Wait 0.5 seconds, then fetch one photo per second, detect faces, send email only if at least 2 photos have faces detected"""
-    global face_detection_in_progress
+def open_event_db():
+    """Open a connection to the event index (creates tables on first use)"""
+    os.makedirs(EVENT_STORE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(EVENT_STORE_DIR, EVENT_DB_FILE), timeout=10)
+    conn.row_factory = sqlite3.Row
+    # WAL lets /events queries run while the writer thread is inserting
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(EVENT_DB_SCHEMA)
+    return conn
+
+def get_event_db():
+    """Get read connection for the current thread"""
+    conn = getattr(event_db_local, "conn", None)
+    if conn is None:
+        conn = open_event_db()
+        event_db_local.conn = conn
+    return conn
+
+def write_event_to_disk(conn, event):
+    """Save event frames into date-sharded directory and insert index row"""
+    timestamp = event["timestamp"]
+    shard = datetime.fromtimestamp(timestamp).strftime("%Y/%m/%d")
+    os.makedirs(os.path.join(EVENT_STORE_DIR, shard), exist_ok=True)
+
+    # Slug as well as the check in record_event: nothing from a request reaches the path unfiltered
+    slug = re.sub(r"[^A-Za-z0-9_-]", "_", str(event["door"]))[:64]
+    frame_paths = []
+    image_path = None
+    try:
+        for i, image_data in enumerate(event["frames"]):
+            if image_data is None:
+                continue
+            relative_path = "{}/{}_{}_{}.jpg".format(shard, int(timestamp * 1000), slug, i)
+            frame_paths.append(relative_path)
+            with open(os.path.join(EVENT_STORE_DIR, relative_path), "wb") as f:
+                f.write(image_data)
+            if i == event["selected_index"]:
+                image_path = relative_path
+
+        # Fall back to the last stored frame if the selected one was not captured
+        if image_path is None and frame_paths:
+            image_path = frame_paths[-1]
+
+        conn.execute(
+            "INSERT INTO events (door, timestamp, face_count, outcome, source, image_path, frame_paths) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (event["door"], timestamp, event["face_count"], event["outcome"],
+             event["source"], image_path, json.dumps(frame_paths))
+        )
+    except Exception:
+        # No index row, so do not leave its JPEGs behind
+        for relative_path in frame_paths:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(EVENT_STORE_DIR, relative_path))
+        raise
+
+def write_event_batch(conn, batch):
+    """Write events in one transaction, a bad event is skipped and the rest still committed"""
+    try:
+        with conn:
+            for event in batch:
+                try:
+                    write_event_to_disk(conn, event)
+                except Exception as e:
+                    print("✗ Event archive write error ({}): {}".format(event["door"], e))
+    except Exception as e:
+        print("✗ Event archive write error: {}".format(e))
+
+def event_writer_loop():
+    """Background thread: drain event queue and write batches to disk"""
+    conn = open_event_db()
+    while True:
+        batch = [event_write_queue.get()]
+        # Group whatever else is already waiting into the same transaction
+        while len(batch) < 32:
+            try:
+                batch.append(event_write_queue.get_nowait())
+            except queue.Empty:
+                break
+        write_event_batch(conn, batch)
+
+def start_event_writer():
+    """Start event writer thread (only once)"""
+    global event_writer_thread
+    with event_writer_lock:
+        if event_writer_thread is None:
+            event_writer_thread = threading.Thread(target=event_writer_loop)
+            event_writer_thread.daemon = True
+            event_writer_thread.start()
+
+def valid_door_name(door):
+    """Whether door is safe to archive under (letters, digits, "_" and "-")"""
+    return isinstance(door, str) and DOOR_NAME_PATTERN.fullmatch(door) is not None
+
+def record_event(door, face_count, outcome, frames, selected_index=-1, source="pir_trigger", timestamp=None):
+    """Queue an event for the archive (never blocks the caller)"""
+    if not valid_door_name(door):
+        print("⚠️  Event for invalid door name {!r} not archived".format(door))
+        return
+    start_event_writer()
+    event = {
+        "door": door,
+        "timestamp": time.time() if timestamp is None else timestamp,
+        "face_count": face_count,
+        "outcome": outcome,
+        "source": source,
+        "frames": frames,
+        "selected_index": selected_index if selected_index >= 0 else len(frames) - 1
+    }
+    try:
+        event_write_queue.put_nowait(event)
+    except queue.Full:
+        print("⚠️  Event archive queue full, event dropped")
+
+def query_events(since=0.0, door=None, has_face=None, cursor=None, limit=EVENT_PAGE_SIZE):
+    """Query event index, ordered by time, using keyset (cursor) pagination"""
+    conditions = ["timestamp >= ?"]
+    params = [since]
+
+    if door:
+        conditions.append("door = ?")
+        params.append(door)
+    if has_face is True:
+        conditions.append("face_count > 0")
+    elif has_face is False:
+        conditions.append("face_count = 0")
+    if cursor:
+        # Cursor format: "<timestamp>:<id>" of the last row on the previous page
+        cursor_timestamp, cursor_id = cursor.split(":", 1)
+        conditions.append("(timestamp, id) > (?, ?)")
+        params.extend([float(cursor_timestamp), int(cursor_id)])
+
+    sql = ("SELECT id, door, timestamp, face_count, outcome, source, image_path, frame_paths "
+           "FROM events WHERE {} ORDER BY timestamp, id LIMIT ?").format(" AND ".join(conditions))
+    params.append(limit)
+    rows = get_event_db().execute(sql, params).fetchall()
+
+    events = []
+    for row in rows:
+        events.append({
+            "id": row["id"],
+            "door": row["door"],
+            "timestamp": row["timestamp"],
+            "time": datetime.fromtimestamp(row["timestamp"]).strftime("%Y-%m-%d %H:%M:%S"),
+            "face_count": row["face_count"],
+            "outcome": row["outcome"],
+            "source": row["source"],
+            "frame_count": len(json.loads(row["frame_paths"])),
+            "image_url": "/events/{}/image".format(row["id"]) if row["image_path"] else None
+        })
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = "{!r}:{}".format(rows[-1]["timestamp"], rows[-1]["id"])
+    return events, next_cursor
+
+def claim_door_detection(door):
+    """Mark door as busy with face detection, return False if it already is (in any server process)"""
+    now = time.time()
+    with detection_store() as claims:
+        claimed_at = claims.get(door)
+        if claimed_at is not None and now - claimed_at < DETECTION_CLAIM_TIMEOUT:
+            return False
+        claims[door] = now
+        return True
+
+def release_door_detection(door):
+    """Clear the claim taken by claim_door_detection"""
+    with detection_store() as claims:
+        claims.pop(door, None)
+
+def is_door_in_detection(door):
+    """Check if a face detection is running for door (in any server process)"""
+    with detection_store(write=False) as claims:
+        claimed_at = claims.get(door)
+        return claimed_at is not None and time.time() - claimed_at < DETECTION_CLAIM_TIMEOUT
+
+def process_request_with_face_detection(door=DEFAULT_DOOR_ID, trigger_time=None):
+    """Process request: fetch photos, detect faces, send email only if at least 2 photos have faces detected
     
+    With ADAPTIVE_CAPTURE_ENABLED frames are fetched back to back at a pace set by the measured camera
+    latency, and capture stops as soon as the result is settled; otherwise 0.5 seconds wait, then 3
+    photos one second apart. If the background sampler is running, frames buffered before trigger_time
+    are used first.
+    """
     # Set processing flag
-    with face_detection_lock:
-        if face_detection_in_progress:
-            print("\n⚠️  Face detection in progress, ignoring this request")
-            return False, "Face detection in progress"
-        face_detection_in_progress = True
+    if not claim_door_detection(door):
+        print("\n⚠️  Face detection in progress, ignoring this request")
+        return False, "Face detection in progress"
     
+    # One settings snapshot for the whole job (a config reload applies from the next job)
+    settings = get_settings()
+    adaptive = settings["ADAPTIVE_CAPTURE_ENABLED"]
+    cameras = []
     try:
         print("\n" + "=" * 50)
-        print("Starting PIR trigger request processing...")
-        print("Waiting 0.5 seconds before starting face detection")
-        print("Will perform face detection (1 image per second, 3 seconds total)")
+        cameras = get_door_cameras(door)
+        print("Starting PIR trigger request processing ({}, camera(s): {})...".format(
+            door, ", ".join(camera_id for camera_id, _ in cameras)))
+        if adaptive:
+            print("Will perform face detection (adaptive: up to {} images in {} seconds, stops once settled)".format(
+                settings["CAPTURE_MAX_FRAMES"], settings["CAPTURE_DEADLINE"]))
+        else:
+            print("Waiting 0.5 seconds before starting face detection")
+            print("Will perform face detection (1 image per second, 3 seconds total)")
         print("New PIR trigger requests will be ignored during this period")
         print("=" * 50)
         
-        # Wait 0.5 seconds before starting detection
-        print("Waiting 0.5 seconds...")
-        time.sleep(0.5)
+        # Frames captured while the ESP32 was still debouncing (empty if sampler is off)
+        if trigger_time is None:
+            trigger_time = time.time()
+        buffered_frames = get_pre_trigger_frames(trigger_time, camera_ids=[camera_id for camera_id, _ in cameras],
+                                                settings=settings)
+        
+        if buffered_frames:
+            print("Using {} buffered frame(s) from before the trigger, no initial wait".format(len(buffered_frames)))
+            # Analyze all buffered frames in one batch
+            buffered_results = detect_faces_in_images([frame[1] for frame in buffered_frames], settings)
+        elif not adaptive:
+            # Wait 0.5 seconds before starting detection
+            print("Waiting {} seconds...".format(settings["CAPTURE_INITIAL_WAIT"]))
+            time.sleep(settings["CAPTURE_INITIAL_WAIT"])
         print("Starting face detection")
         
-        face_detection_results = []  # Store face detection result for each image
+        detection_results = []  # analyze_frame result for each image
+        frame_times = []  # Capture time of each image
         captured_images = []  # Store captured image data
+        frame_cameras = []  # Camera id of each image
+        max_frames = settings["CAPTURE_MAX_FRAMES"] if adaptive else 3
+        capture_started = time.time()
         
-        # Fetch one photo per second for 3 seconds
-        for i in range(3):
-            print("\n--- Detection {}/3 ---".format(i + 1))
-            print("Fetching photo...")
-            
-            image_data, image_url = get_image_from_esp32(IMAGE_URL)
+        for i in range(max_frames):
+            print("\n--- Detection {}/{} ---".format(i + 1, max_frames))
+            frame_started = time.time()
             
-            if image_data:
-                # Detect faces
-                print("Detecting faces...")
-                has_face = detect_faces_in_image(image_data)
-                face_detection_results.append(has_face)
-                captured_images.append((image_data, image_url))
-                
-                if has_face:
-                    print("✓ Detection {}: Face detected".format(i + 1))
-                else:
-                    print("✗ Detection {}: No face detected".format(i + 1))
+            if i < len(buffered_frames):
+                frame_time, image_data, image_url, camera_id = buffered_frames[i]
+                result = buffered_results[i]
+                print("Using buffered photo from {:.1f} seconds before trigger".format(trigger_time - frame_time))
             else:
+                print("Fetching photo...")
+                # A failed fetch is just a frame without a face in adaptive mode, no 3 second retry wait
+                frames = fetch_camera_frames(cameras, max_retries=1 if adaptive else 3, settings=settings)
+                frame_time = frame_started
+                # All cameras' frames are analyzed together, the best one stands for this round
+                round_results = detect_faces_in_images([frame[1] for frame in frames], settings)
+                best = pick_best_frame(frames, round_results)
+                camera_id, image_data, image_url = frames[best]
+                result = round_results[best]
+                if len(frames) > 1:
+                    print("Best frame from camera {} ({} of {} camera(s) answered)".format(
+                        camera_id, sum(1 for frame in frames if frame[1]), len(frames)))
+            
+            detection_results.append(result)
+            frame_times.append(frame_time)
+            captured_images.append((image_data, image_url) if image_data else (None, None))
+            frame_cameras.append(camera_id)
+            
+            if not image_data:
                 print("✗ Detection {}: Photo fetch failed".format(i + 1))
-                face_detection_results.append(False)
-                captured_images.append((None, None))
+            elif result["error"]:
+                print("✗ Detection {}: Face detection error: {}".format(i + 1, result["error"]))
+            elif result["has_face"]:
+                print("✓ Detection {}: {} face(s) detected in {:.1f} ms".format(i + 1, result["face_count"], result["detect_ms"]))
+            else:
+                print("✗ Detection {}: No face detected".format(i + 1))
             
-            # If not the last time, wait 1 second
-            if i < 2:
-                print("Waiting 1 second before next detection...")
-                time.sleep(1)
+            face_flags, best_track = face_vote_frames(detection_results, frame_cameras, settings)
+            if adaptive:
+                decision = capture_decision(face_flags, frame_times, settings)
+                if decision is not None:
+                    print("Result settled after {} image(s) ({}), {:.2f} seconds".format(
+                        i + 1, decision.replace("_", " "), time.time() - capture_started))
+                    break
+                if time.time() - capture_started >= settings["CAPTURE_DEADLINE"]:
+                    print("Capture deadline of {} seconds reached".format(settings["CAPTURE_DEADLINE"]))
+                    break
+            
+            # If not the last time and this photo was fetched live, wait until the next frame is due
+            if i < max_frames - 1 and i >= len(buffered_frames):
+                interval = next_capture_interval([url for _, url in cameras], is_ambiguous(face_flags, settings), settings)
+                delay = max(0, interval - (time.time() - frame_started))
+                if delay > 0:
+                    print("Waiting {:.2f} seconds before next detection...".format(delay))
+                    time.sleep(delay)
+        
+        # With tracking only frames showing the same face count (one-off detections are dropped)
+        face_detection_results = face_flags
         
         # Count number of detections with faces
         face_detected_count = sum(face_detection_results)
@@ -226,102 +1567,264 @@ def process_request_with_face_detection():
         print("Face detection results summary:")
         print("=" * 50)
         for i, result in enumerate(face_detection_results, 1):
-            status = "✓ Face detected" if result else "✗ No face detected"
+            if result:
+                status = "✓ Face detected"
+            elif detection_results[i - 1]["has_face"]:
+                status = "✗ Face detected, not on the tracked face"
+            else:
+                status = "✗ No face detected"
             print("Detection {}: {}".format(i, status))
-        print("Faces detected: {}/3".format(face_detected_count))
+        if best_track is not None:
+            print("Most stable track: camera {}, {}/{} frames (stability {:.2f}, mean IoU {:.2f})".format(
+                best_track["camera"], best_track["hits"], len(face_detection_results),
+                best_track["stability"], best_track["mean_iou"]))
+        print("Faces detected: {}/{}".format(face_detected_count, len(face_detection_results)))
         
-        if face_detected_count >= 2:
+        if face_detected_count >= settings["FACE_FRAMES_REQUIRED"]:
             print("\n✓ At least 2 photos have faces detected!")
             
-            # Find the last photo with face detected, if none use the 3rd photo
+            # Find the last photo with face detected, if none use the last photo
             photo_to_send_index = -1
             for i in range(len(face_detection_results) - 1, -1, -1):
                 if face_detection_results[i]:
                     photo_to_send_index = i
                     break
             
-            # If no photo with face found, use the 3rd photo
+            # If no photo with face found, use the last photo
             if photo_to_send_index == -1:
-                photo_to_send_index = 2
+                photo_to_send_index = len(face_detection_results) - 1
+            
+            # Detection ran on low resolution frames, take the emailed one at high resolution
+            # (keep the detection frame if the person already left the picture)
+            photo_result = detection_results[photo_to_send_index]
+            if settings["CAPTURE_PROFILES_ENABLED"]:
+                high_res_image = capture_high_res_frame(camera_registry.get(frame_cameras[photo_to_send_index], settings["IMAGE_URL"]),
+                                                        max_retries=1, settings=settings)
+                high_res_result = analyze_frame(high_res_image[0], settings=settings) if high_res_image[0] is not None else None
+                if high_res_result is not None and high_res_result["has_face"]:
+                    print("✓ High resolution frame has a face, sending it instead")
+                    captured_images[photo_to_send_index] = high_res_image
+                    photo_result = high_res_result
+                else:
+                    print("✗ High resolution frame unavailable or without face, sending detection frame")
             
             print("Sending photo from detection {}...".format(photo_to_send_index + 1))
             
+            # Merge into a recent alert if this frame looks almost the same
+            alert_hash = None
+            if settings["ALERT_DEDUP_ENABLED"] and captured_images[photo_to_send_index][0] is not None:
+                alert_hash = compute_dhash(captured_images[photo_to_send_index][0])
+                duplicate = find_duplicate_alert(door, alert_hash, settings=settings) if alert_hash is not None else None
+                if duplicate:
+                    _, distance, merged_count = duplicate
+                    print("\n⚠️  Similar alert sent within the last {} seconds (distance {}), not sending email".format(
+                        settings["ALERT_DEDUP_WINDOW"], distance))
+                    print("Alerts merged into previous email: {}".format(merged_count))
+                    record_event(door, face_detected_count, "duplicate",
+                                 [image[0] for image in captured_images], photo_to_send_index)
+                    return False, "Similar alert already sent, merged ({} merged)".format(merged_count)
+            
             # Send selected photo
             if captured_images[photo_to_send_index][0] is not None:
+                # Name enrolled residents in the subject (generic subject if recognition is off)
+                subject = "ESP32 Photo"
+                visitors = recognize_visitors(captured_images[photo_to_send_index][0], photo_result["boxes"], settings)
+                if visitors:
+                    subject = "Known visitor at {}: {}".format(door, ", ".join(sorted(set(visitors))))
+                elif visitors is not None:
+                    subject = "Unknown visitor at {}".format(door)
                 filename = "esp32_image_{}.jpg".format(int(time.time()))
-                email_success = send_email_smtp(captured_images[photo_to_send_index][0], filename, EMAIL_TO)
+                email_success = send_email_smtp(captured_images[photo_to_send_index][0], filename, settings["EMAIL_TO"],
+                                                subject=subject, settings=settings)
+                record_event(door, face_detected_count, "email_sent" if email_success else "email_failed",
+                             [image[0] for image in captured_images], photo_to_send_index)
                 
                 if email_success:
+                    if alert_hash is not None:
+                        register_alert(door, alert_hash)
                     print("\n" + "=" * 50)
                     print("✓ Processing completed!")
                     print("Photo URL: {}".format(captured_images[photo_to_send_index][1]))
-                    print("Email sent to: {}".format(EMAIL_TO))
+                    print("Email sent to: {}".format(settings["EMAIL_TO"]))
                     print("=" * 50)
                     return True, "At least 2 photos have faces detected, email sent"
                 else:
                     return False, "At least 2 photos have faces detected, but email sending failed"
             else:
+                record_event(door, face_detected_count, "fetch_failed", [image[0] for image in captured_images])
                 return False, "At least 2 photos have faces detected, but photo fetch failed"
         else:
             print("\n✗ Only {} photo(s) have faces detected (need at least 2), not sending email".format(face_detected_count))
+            record_event(door, face_detected_count, "no_face", [image[0] for image in captured_images])
             return False, "Only {} photo(s) have faces detected, conditions not met".format(face_detected_count)
     finally:
         # Clear processing flag
-        with face_detection_lock:
-            face_detection_in_progress = False
-            print("\n✓ Face detection processing completed, lock released, ready to receive new PIR trigger requests")
+        release_door_detection(door)
+        print("\n✓ Face detection processing completed, lock released, ready to receive new PIR trigger requests")
+        # Detection left the cameras on "low", give the app's live view its normal picture back
+        restore_idle_profiles([url for _, url in cameras], settings)
 
-def process_request():
+def process_request(size=None, door=DEFAULT_DOOR_ID):
     """Process request: Fetch photo and send email (old version, kept for compatibility)"""
     print("\n" + "=" * 50)
     print("Starting request processing...")
     print("=" * 50)
+    settings = get_settings()
     
     # 1. Fetch photo
-    image_data, image_url = get_image_from_esp32(IMAGE_URL)
+    image_data, image_url = capture_high_res_frame(get_photo_camera(door), settings=settings)
     
     if image_data:
         # 2. Send email
         filename = "esp32_image_{}.jpg".format(int(time.time()))
-        email_success = send_email_smtp(image_data, filename, EMAIL_TO)
+        email_success = send_email_smtp(image_data, filename, settings["EMAIL_TO"], size, settings=settings)
+        record_event(door, 0, "email_sent" if email_success else "email_failed",
+                     [image_data], source="take_photo")
         
         if email_success:
             print("\n" + "=" * 50)
             print("✓ Processing completed!")
             print("Photo URL: {}".format(image_url))
-            print("Email sent to: {}".format(EMAIL_TO))
+            print("Email sent to: {}".format(settings["EMAIL_TO"]))
             print("=" * 50)
             return True, "Photo fetched successfully, email sent"
         else:
             return False, "Photo fetched successfully, but email sending failed"
     else:
+        record_event(door, 0, "fetch_failed", [], source="take_photo")
         return False, "Photo fetch failed"
 
+def wants_binary_response():
+    """Check if ESP32 asked for the binary protocol (?format=bin or Accept header)"""
+    return request.args.get('format') == 'bin' or BINARY_MIMETYPE in request.headers.get('Accept', '')
+
+def binary_response(opcode, payload=b"", status_code=200):
+    """Return binary protocol frame as Flask response"""
+    return Response(encode_frame(opcode, payload), status=status_code, mimetype=BINARY_MIMETYPE)
+
+def start_face_detection(door, trigger_time):
+    """Start face detection for a trigger in a background thread, return False if that door is already busy"""
+    if is_door_in_detection(door):
+        print("⚠️  Face detection in progress, ignoring this PIR trigger request")
+        return False
+
+    # Process face detection and email sending in background thread to avoid blocking response
+    thread = threading.Thread(target=process_request_with_face_detection, args=(door, trigger_time))
+    thread.daemon = True
+    thread.start()
+    return True
+
+def valid_trigger_event(event):
+    """True if a queued trigger is {"age": seconds or null, "door": optional name} (the door is checked later)"""
+    if not isinstance(event, dict):
+        return False
+    age = event.get('age')
+    # bool is an int subclass, reject it explicitly
+    if age is not None and (isinstance(age, bool) or not isinstance(age, (int, float)) or not math.isfinite(age)):
+        return False
+    return isinstance(event.get('door', ''), str)
+
+def process_trigger_batch(data):
+    """Handle queued triggers from the ESP32: archive late events, run detection for a live one"""
+    events = data.get('events') or []
+    if not isinstance(events, list) or len(events) > TRIGGER_BATCH_MAX:
+        return jsonify({
+            "status": "error",
+            "message": "events must be a list of at most {} items".format(TRIGGER_BATCH_MAX)
+        }), 400
+    if not all(valid_trigger_event(event) for event in events):
+        return jsonify({
+            "status": "error",
+            "message": "each event must be an object with a numeric or null age"
+        }), 400
+
+    now = time.time()
+    # Ages are relative (the ESP32 clock is not synchronized); None means unknown (device rebooted)
+    parsed = []
+    rejected = 0
+    for event in events:
+        age = event.get('age')
+        door = event.get('door', data.get('door', DEFAULT_DOOR_ID))
+        # An unknown or unsafe door only loses its own event, the rest of the batch is still handled
+        if not is_known_door(door):
+            print("⚠️  Queued PIR trigger for unknown door {!r} rejected".format(door))
+            rejected += 1
+            continue
+        parsed.append((door, age if age is not None and age >= 0 else None))
+
+    # The most recent event, if still fresh, gets face detection on the current camera frames
+    live_index = None
+    for i, (door, age) in enumerate(parsed):
+        if age is not None and age <= TRIGGER_LIVE_WINDOW and (live_index is None or age < parsed[live_index][1]):
+            live_index = i
+
+    print("\nReceived {} queued PIR trigger(s) from {}".format(len(parsed), data.get('device', 'unknown')))
+
+    detection = "skipped"
+    if live_index is not None:
+        door, age = parsed[live_index]
+        detection = "started" if start_face_detection(door, now - age) else "busy"
+
+    # Camera frames from the other moments are gone, keep a record that motion happened
+    for i, (door, age) in enumerate(parsed):
+        if i != live_index or detection != "started":
+            record_event(door, 0, "delayed_trigger", [], source="pir_trigger_queued",
+                         timestamp=now - age if age is not None else now)
+    print("  Face detection: {}".format(detection))
+    return jsonify({
+        "status": "success",
+        "accepted": len(parsed),
+        "rejected": rejected,
+        "detection": detection
+    }), 200
+
 @app.route('/trigger', methods=['POST'])
 def trigger():
     """Receive ESP32 PIR trigger request (with face detection)"""
+    binary = request.mimetype == BINARY_MIMETYPE
     try:
-        data = request.get_json()
+        if binary:
+            # Binary trigger frame: timestamp + device name
+            try:
+                opcode, payload = decode_frame(request.get_data())
+            except ValueError as e:
+                return binary_response(OP_ERROR, str(e).encode("utf-8"), 400)
+            if opcode != OP_TRIGGER or len(payload) < TRIGGER_PAYLOAD.size:
+                return binary_response(OP_ERROR, b"Expected trigger frame", 400)
+            data = {
+                "action": "pir_trigger_face_detection",
+                "timestamp": TRIGGER_PAYLOAD.unpack_from(payload)[0],
+                "device": payload[TRIGGER_PAYLOAD.size:].decode("utf-8", "replace")
+            }
+        else:
+            data = request.get_json()
+            if 'events' in data:
+                # Bulk variant: triggers queued on the ESP32 while the server was unreachable
+                return process_trigger_batch(data)
         print("\nReceived ESP32 PIR trigger request:")
         print("  Action: {}".format(data.get('action', 'unknown')))
         print("  Timestamp: {}".format(data.get('timestamp', 'unknown')))
         print("  Device: {}".format(data.get('device', 'unknown')))
         
-        # Check if face detection is in progress
-        with face_detection_lock:
-            if face_detection_in_progress:
-                print("⚠️  Face detection in progress, ignoring this PIR trigger request")
-                return jsonify({
-                    "status": "busy",
-                    "message": "Face detection in progress, ignoring this request"
-                }), 200
+        door = data.get('door', DEFAULT_DOOR_ID)
+        if not is_known_door(door):
+            return jsonify({
+                "status": "error",
+                "message": "Unknown door: {!r}".format(door)
+            }), 400
         
-        # Process face detection and email sending in background thread to avoid blocking response
-        thread = threading.Thread(target=process_request_with_face_detection)
-        thread.daemon = True
-        thread.start()
+        # Start face detection unless it is already in progress
+        if not start_face_detection(door, time.time()):
+            if binary:
+                return binary_response(OP_TRIGGER_BUSY)
+            return jsonify({
+                "status": "busy",
+                "message": "Face detection in progress, ignoring this request"
+            }), 200
         
         # Return response immediately
+        if binary:
+            return binary_response(OP_TRIGGER_ACCEPTED)
         return jsonify({
             "status": "success",
             "message": "PIR trigger received, face detection in progress..."
@@ -329,6 +1832,8 @@ def trigger():
         
     except Exception as e:
         print("Error processing request: {}".format(e))
+        if binary:
+            return binary_response(OP_ERROR, str(e).encode("utf-8"), 500)
         return jsonify({
             "status": "error",
             "message": str(e)
@@ -336,31 +1841,379 @@ def trigger():
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
+    """Health check endpoint (liveness: always 200 while the server runs, "ready" tells if models are warm)"""
     return jsonify({
         "status": "ok",
-        "server": "running"
+        "server": "running",
+        "pid": os.getpid(),  # With SERVER_WORKERS > 1 the rest of this response is per worker
+        "ready": warmup_state["ready"],
+        "warmup": warmup_state,
+        "cameras": get_camera_stats()
+    }), 200
+
+@app.route('/config', methods=['GET'])
+def get_config():
+    """Current values of the reloadable settings and the result of the last reload"""
+    return jsonify({
+        "status": "success",
+        "file": CONFIG_FILE,
+        "settings": {name: format_setting(name, globals()[name]) for name in sorted(RELOADABLE_SETTINGS)},
+        "last_reload": config_status
+    }), 200
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness check: 200 once detection models are loaded, 503 before"""
+    if warmup_state["ready"]:
+        return jsonify({"status": "ready"}), 200
+    return jsonify({
+        "status": "warming_up" if warmup_state["error"] is None else "error",
+        "error": warmup_state["error"]
+    }), 503
+
+@app.route('/events', methods=['GET'])
+def list_events():
+    """Query archived events: /events?since=&door=&has_face=&cursor=&limit="""
+    try:
+        since = float(request.args.get('since', 0))
+        door = request.args.get('door') or None
+        has_face_arg = request.args.get('has_face', '').lower()
+        has_face = None
+        if has_face_arg in ('1', 'true', 'yes'):
+            has_face = True
+        elif has_face_arg in ('0', 'false', 'no'):
+            has_face = False
+        limit = min(max(int(request.args.get('limit', EVENT_PAGE_SIZE)), 1), EVENT_PAGE_SIZE_MAX)
+        cursor = request.args.get('cursor') or None
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": "Invalid query parameter: {}".format(e)
+        }), 400
+
+    try:
+        events, next_cursor = query_events(since, door, has_face, cursor, limit)
+    except ValueError:
+        return jsonify({
+            "status": "error",
+            "message": "Invalid cursor"
+        }), 400
+    except Exception as e:
+        print("Error querying events: {}".format(e))
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+    return jsonify({
+        "status": "success",
+        "events": events,
+        "count": len(events),
+        "next_cursor": next_cursor
     }), 200
 
+@app.route('/events/<int:event_id>/image', methods=['GET'])
+def get_event_image(event_id):
+    """Return the selected JPEG of an archived event (?size=thumb|small|medium|full)"""
+    size = request.args.get('size') or "full"
+    if size != "full" and size not in IMAGE_SIZES:
+        return jsonify({
+            "status": "error",
+            "message": "Unknown size, use one of: full, {}".format(", ".join(IMAGE_SIZES))
+        }), 400
+    
+    row = get_event_db().execute("SELECT image_path FROM events WHERE id = ?", (event_id,)).fetchone()
+    if row is None or row["image_path"] is None:
+        return jsonify({
+            "status": "error",
+            "message": "Event image not found"
+        }), 404
+    
+    image_path = os.path.abspath(os.path.join(EVENT_STORE_DIR, row["image_path"]))
+    if size == "full":
+        return send_file(image_path, mimetype='image/jpeg')
+    
+    with open(image_path, "rb") as f:
+        image_data = f.read()
+    resized_data = get_resized_image(image_data, size, "event_{}".format(event_id))
+    return send_file(BytesIO(resized_data), mimetype='image/jpeg')
+
+@app.route('/enroll_face', methods=['POST'])
+def enroll_face():
+    """Enroll a resident for recognition: {"name": ..., "image_base64": optional JPEG, "door": optional}
+    
+    Without image_base64 a photo is taken with the door's camera. The photo must show exactly one face.
+    """
+    if get_face_recognizer() is None:
+        return jsonify({
+            "status": "error",
+            "message": "Recognition unavailable (model {} not found)".format(RECOGNITION_MODEL_FILE)
+        }), 503
+    data = request.get_json() or {}
+    name = (data.get('name') or "").strip()
+    if not name:
+        return jsonify({"status": "error", "message": "name is required"}), 400
+    
+    if data.get('image_base64'):
+        try:
+            image_data = base64.b64decode(data['image_base64'])
+        except (ValueError, TypeError):
+            return jsonify({"status": "error", "message": "image_base64 is not valid base64"}), 400
+    else:
+        image_data, _ = capture_high_res_frame(get_photo_camera(data.get('door') or DEFAULT_DOOR_ID))
+        if image_data is None:
+            return jsonify({"status": "error", "message": "Photo fetch failed"}), 502
+    
+    result = analyze_frame(image_data)
+    if result["face_count"] != 1:
+        return jsonify({
+            "status": "error",
+            "message": "Expected exactly one face, found {}".format(result["face_count"])
+        }), 400
+    embeddings = compute_face_embeddings(image_data, result["boxes"])
+    if embeddings is None:
+        return jsonify({"status": "error", "message": "Cannot decode image"}), 400
+    enrolled = enroll_known_face(name, embeddings[0])
+    print("✓ Enrolled face for {} ({} enrolled)".format(name, enrolled))
+    return jsonify({
+        "status": "success",
+        "name": name,
+        "enrolled": enrolled
+    }), 200
+
+@app.route('/known_faces', methods=['GET'])
+def list_known_faces():
+    """Enrolled residents and how many face samples each has"""
+    counts = {}
+    for name in known_face_names:
+        counts[name] = counts.get(name, 0) + 1
+    return jsonify({
+        "status": "success",
+        "recognition_available": get_face_recognizer() is not None,
+        "residents": counts
+    }), 200
+
+def open_shared_state_db():
+    """Open a connection to SHARED_STATE_DB (autocommit, transactions are started explicitly)"""
+    conn = sqlite3.connect(SHARED_STATE_DB, timeout=10, isolation_level=None)
+    # WAL lets polls read while another process is writing
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def get_shared_state_db():
+    """Get shared state connection for the current thread"""
+    conn = getattr(shared_state_local, "conn", None)
+    if conn is None:
+        conn = open_shared_state_db()
+        shared_state_local.conn = conn
+    return conn
+
+def init_shared_state():
+    """Create and seed the shared state (once, before the worker processes start)
+    
+    Temporary passwords survive a restart (TEMP_PASSWORD_TTL still applies). Queued commands and
+    detection claims are reset, as they are without SHARED_STATE_DB, so a stale unlock is never
+    delivered after a restart.
+    """
+    conn = open_shared_state_db()
+    conn.executescript(SHARED_STATE_SCHEMA)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT OR IGNORE INTO state VALUES ('temp_passwords', ?)", (json.dumps(temp_password_state),))
+        conn.execute("INSERT OR REPLACE INTO state VALUES ('commands', ?)", (json.dumps(command_queue_state),))
+        conn.execute("INSERT OR REPLACE INTO state VALUES ('detections', '{}')")
+    conn.close()
+    print("Shared state: {}".format(os.path.abspath(SHARED_STATE_DB)))
+
+@contextlib.contextmanager
+def locked_state(name, local_value, lock, write=True):
+    """Yield a state object for read-modify-write (write=False: consistent read only)
+    
+    Without SHARED_STATE_DB this is local_value under lock. With it, the value is loaded from the
+    database in one transaction (BEGIN IMMEDIATE for writes, which serializes updates from all
+    processes) and saved back when the block ends without an exception.
+    """
+    if not SHARED_STATE_DB:
+        with lock:
+            yield local_value
+        return
+    conn = get_shared_state_db()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        row = conn.execute("SELECT value FROM state WHERE name = ?", (name,)).fetchone()
+        value = json.loads(row[0] if row is not None else json.dumps(local_value))
+        yield value
+        if write:
+            conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (name, json.dumps(value, separators=(",", ":"))))
+
+def temp_password_store(write=True):
+    """Temporary passwords, sync version and salt (see locked_state)"""
+    return locked_state("temp_passwords", temp_password_state, temp_password_lock, write)
+
+def command_store(write=True):
+    """Mobile command queue, delivery counters and latency histograms (see locked_state)"""
+    return locked_state("commands", command_queue_state, command_queue_lock, write)
+
+def detection_store(write=True):
+    """Doors with a face detection running (see locked_state)"""
+    return locked_state("detections", doors_in_detection, face_detection_lock, write)
+
+def take_bucket_token(bucket, capacity, refill_rate, now):
+    """Refill a [tokens, last refill time] bucket and take a token: 0 if allowed, else seconds until the next token"""
+    bucket[0] = min(float(capacity), bucket[0] + (now - bucket[1]) * refill_rate)
+    bucket[1] = now
+    if bucket[0] >= 1:
+        bucket[0] -= 1
+        return 0
+    return (1 - bucket[0]) / refill_rate
+
+def prune_shared_rate_limits(conn, now):
+    """Delete buckets idle long enough to be full again, they carry no information (keeps the table small)"""
+    for endpoint, (capacity, refill_rate) in RATE_LIMITS.items():
+        # Name range instead of LIKE so only this endpoint's rows are read (primary key index)
+        conn.execute("DELETE FROM state WHERE name >= ? AND name < ? AND json_extract(value, '$[1]') < ?",
+                     ("rate_limit:{}:".format(endpoint), "rate_limit:{};".format(endpoint),
+                      now - capacity / refill_rate))
+
+def take_shared_rate_limit_token(endpoint, client, now):
+    """take_rate_limit_token with the bucket in SHARED_STATE_DB, so the limit holds across processes"""
+    global rate_limit_last_prune
+    capacity, refill_rate = RATE_LIMITS[endpoint]
+    name = "rate_limit:{}:{}".format(endpoint, client)
+    conn = get_shared_state_db()
+    if now - rate_limit_last_prune >= RATE_LIMIT_PRUNE_INTERVAL:
+        rate_limit_last_prune = now
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            prune_shared_rate_limits(conn, now)
+    # Per request only one row is read and written
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT value FROM state WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            bucket = [float(capacity), now]
+        else:
+            bucket = json.loads(row[0])
+        wait = take_bucket_token(bucket, capacity, refill_rate, now)
+        conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (name, json.dumps(bucket)))
+        return wait
+
+def take_rate_limit_token(endpoint, client, now=None):
+    """Take a token from a client's bucket: 0 if allowed, else seconds until the next token"""
+    if SHARED_STATE_DB:
+        # Wall clock: buckets are compared across processes and restarts
+        return take_shared_rate_limit_token(endpoint, client, time.time() if now is None else now)
+    capacity, refill_rate = RATE_LIMITS[endpoint]
+    if now is None:
+        now = time.monotonic()
+    key = (endpoint, client)
+    with rate_limit_lock:
+        bucket = rate_limit_buckets.get(key)
+        if bucket is None:
+            bucket = rate_limit_buckets[key] = [float(capacity), now]
+            if len(rate_limit_buckets) > RATE_LIMIT_MAX_CLIENTS:
+                rate_limit_buckets.popitem(last=False)
+        else:
+            rate_limit_buckets.move_to_end(key)
+        return take_bucket_token(bucket, capacity, refill_rate, now)
+
+def rate_limit_response(endpoint):
+    """429 response if the requesting client is over its limit for endpoint, else None"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    wait = take_rate_limit_token(endpoint, request.remote_addr)
+    if not wait:
+        return None
+    print("⚠️  Rate limit: {} from {}, retry in {:.1f} seconds".format(endpoint, request.remote_addr, wait))
+    response = jsonify({
+        "status": "error",
+        "message": "Too many requests, try again later",
+        "retry_after": int(math.ceil(wait))
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(int(math.ceil(wait)))
+    return response
+
+def hash_temp_password(password, salt):
+    """Keyed hash of a temporary password (same format as the ESP32 computes)
+    
+    HMAC with DEVICE_SECRET: a plain salted SHA-256 of a 6-digit code is reversed with 10^6
+    guesses by anyone who sees the sync response, the keyed hash is useless without the secret.
+    """
+    return temp_password_hash(DEVICE_SECRET, password, salt)
+
+def get_device_token():
+    """Token the ESP32 sends to /temp_password_sync (derived from DEVICE_SECRET, which is never sent)"""
+    return device_token(DEVICE_SECRET)
+
+def bump_temp_sync_version(state):
+    """Mark the set of live codes as changed and rotate the salt (state from temp_password_store)"""
+    state["version"] += 1
+    state["salt"] = os.urandom(8).hex()
+
+def expire_temp_passwords(state, now=None):
+    """Remove temporary passwords older than TEMP_PASSWORD_TTL (state from temp_password_store)"""
+    now = time.time() if now is None else now
+    passwords = state["passwords"]
+    expired = [password for password, created in passwords.items() if now - created >= TEMP_PASSWORD_TTL]
+    for password in expired:
+        del passwords[password]
+    if expired:
+        bump_temp_sync_version(state)
+        print("Expired {} temporary password(s)".format(len(expired)))
+
+def consume_temp_password(password):
+    """Destroy a live temporary password, return (whether it was valid, number of codes left)"""
+    with temp_password_store() as state:
+        expire_temp_passwords(state)
+        if password not in state["passwords"]:
+            return False, len(state["passwords"])
+        del state["passwords"][password]
+        bump_temp_sync_version(state)
+        return True, len(state["passwords"])
+
+def temp_sync_response(state, client_version, now):
+    """Body of /temp_password_sync for the given state (from temp_password_store)"""
+    if client_version == state["version"]:
+        return {"status": "success", "changed": False, "version": state["version"]}
+    # [hash, seconds until expiry] pairs, relative times because the ESP32 clock is not synchronized
+    codes = [[hash_temp_password(password, state["salt"]), int(created + TEMP_PASSWORD_TTL - now)]
+             for password, created in state["passwords"].items()]
+    return {
+        "status": "success",
+        "changed": True,
+        "version": state["version"],
+        "salt": state["salt"],
+        "codes": codes
+    }
+
 @app.route('/generate_temp_password', methods=['POST'])
 def generate_temp_password():
     """Generate temporary password"""
+    limited = rate_limit_response('generate_temp_password')
+    if limited is not None:
+        return limited
     try:
         # Generate 6-digit temporary password
         temp_password = ''.join(random.choices(string.digits, k=6))
-        temp_passwords[temp_password] = time.time()
+        with temp_password_store() as state:
+            state["passwords"][temp_password] = time.time()
+            bump_temp_sync_version(state)
+            count = len(state["passwords"])
         
         # Display temporary password in console
         print("\n" + "=" * 50)
         print("🔑 Temporary password generated")
         print("=" * 50)
         print("Temporary password: {}".format(temp_password))
-        print("Current temporary password count: {}".format(len(temp_passwords)))
+        print("Current temporary password count: {}".format(count))
         print("=" * 50)
         
         return jsonify({
             "status": "success",
             "temp_password": temp_password,
+            "expires_in": TEMP_PASSWORD_TTL,
             "message": "Temporary password generated"
         }), 200
     except Exception as e:
@@ -373,6 +2226,9 @@ def generate_temp_password():
 @app.route('/verify_temp_password', methods=['POST'])
 def verify_temp_password():
     """Verify temporary password"""
+    limited = rate_limit_response('verify_temp_password')
+    if limited is not None:
+        return limited
     try:
         data = request.get_json()
         password = data.get('password', '')
@@ -383,16 +2239,15 @@ def verify_temp_password():
                 "message": "Password cannot be empty"
             }), 400
         
-        # Check if it's a temporary password
-        if password in temp_passwords:
-            # Password exists, delete after use
-            del temp_passwords[password]
+        # Check if it's a temporary password (destroyed after use)
+        valid, remaining = consume_temp_password(password)
+        if valid:
             print("\n" + "=" * 50)
             print("✅ Temporary password verification successful")
             print("=" * 50)
             print("Password: {}".format(password))
             print("Password destroyed")
-            print("Remaining temporary password count: {}".format(len(temp_passwords)))
+            print("Remaining temporary password count: {}".format(remaining))
             print("=" * 50)
             
             return jsonify({
@@ -415,27 +2270,118 @@ def verify_temp_password():
             "message": str(e)
         }), 500
 
+@app.route('/temp_password_sync', methods=['GET'])
+def temp_password_sync():
+    """Keyed hashes of live temporary passwords for offline verification on the ESP32 (?token= required)"""
+    limited = rate_limit_response('temp_password_sync')
+    if limited is not None:
+        return limited
+    if not hmac.compare_digest(request.args.get('token', ''), get_device_token()):
+        return jsonify({
+            "status": "error",
+            "message": "Device token required"
+        }), 401
+    client_version = request.args.get('version', type=int)
+    now = time.time()
+    # Polls only read; the write transaction is needed only when a code has expired
+    with temp_password_store(write=False) as state:
+        expired = any(now - created >= TEMP_PASSWORD_TTL for created in state["passwords"].values())
+        if not expired:
+            return jsonify(temp_sync_response(state, client_version, now)), 200
+    with temp_password_store() as state:
+        expire_temp_passwords(state, now)
+        return jsonify(temp_sync_response(state, client_version, now)), 200
+
+@app.route('/consume_temp_password', methods=['POST'])
+def consume_temp_password_hash():
+    """Destroy a temporary password the ESP32 accepted offline (identified by salted hash)"""
+    limited = rate_limit_response('consume_temp_password')
+    if limited is not None:
+        return limited
+    data = request.get_json(silent=True) or {}
+    code_hash = data.get('hash', '')
+    salt = data.get('salt', '')
+    if not code_hash or not salt:
+        return jsonify({
+            "status": "error",
+            "message": "hash and salt are required"
+        }), 400
+
+    with temp_password_store() as state:
+        # The door may report with an older salt, so match against the salt it used
+        passwords = state["passwords"]
+        password = next((p for p in passwords if hash_temp_password(p, salt) == code_hash), None)
+        if password is not None:
+            del passwords[password]
+            bump_temp_sync_version(state)
+        remaining = len(passwords)
+
+    if password is None:
+        # Already destroyed (expired, or reported twice after a lost response)
+        print("\nOffline temporary password use reported for unknown code: {}".format(code_hash))
+        return jsonify({"status": "success", "consumed": False}), 200
+
+    print("\n" + "=" * 50)
+    print("✅ Temporary password used at the door (verified offline)")
+    print("=" * 50)
+    print("Password: {}".format(password))
+    print("Password destroyed")
+    print("Remaining temporary password count: {}".format(remaining))
+    print("=" * 50)
+    return jsonify({"status": "success", "consumed": True}), 200
+
 @app.route('/list_temp_passwords', methods=['GET'])
 def list_temp_passwords():
     """List all temporary passwords (for debugging)"""
+    limited = rate_limit_response('list_temp_passwords')
+    if limited is not None:
+        return limited
+    with temp_password_store(write=False) as state:
+        passwords = list(state["passwords"].keys())
     return jsonify({
         "status": "success",
-        "temp_passwords": list(temp_passwords.keys()),
-        "count": len(temp_passwords)
+        "temp_passwords": passwords,
+        "count": len(passwords)
     }), 200
 
+def coalesce_command_queue(store, command):
+    """Remove queued commands superseded by command (store from command_store)
+    
+    Lock state, password and display text only matter in their newest form, so unlock, lock,
+    unlock leaves one unlock and the board does not sit through three 3-second executions.
+    Other commands (take_photo, unknown) are never merged. A superseded command that is
+    already leased to the ESP32 is removed too, so it is not delivered again; its ack is
+    then reported as unknown.
+    """
+    commands = store["commands"]
+    for queued in superseded_commands(commands, command):
+        commands.remove(queued)
+        store["counters"]["coalesced"] += 1
+        print("Command superseded by {}: {} (id {})".format(command, queued["command"], queued["id"]))
+
 def add_command_to_queue(command):
     """Add command to queue (for ESP32 to fetch)"""
-    command_data = {
-        "command": command,
-        "timestamp": time.time(),
-        "received_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    mobile_command_queue.append(command_data)
-    
-    # Keep only the last 10 commands
-    if len(mobile_command_queue) > 10:
-        mobile_command_queue.pop(0)
+    with command_store() as store:
+        commands = store["commands"]
+        command_data = {
+            "id": store["next_id"],
+            "command": command,
+            "timestamp": time.time(),
+            "received_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "delivered_at": None,  # First delivery
+            "lease_until": 0,      # Not delivered again before this
+            "deliveries": 0
+        }
+        store["next_id"] = (store["next_id"] + 1) & 0xFFFFFFFF or 1
+        if COMMAND_COALESCE_ENABLED:
+            coalesce_command_queue(store, command)
+        commands.append(command_data)
+        
+        # Keep only the last COMMAND_QUEUE_SIZE commands
+        while len(commands) > COMMAND_QUEUE_SIZE:
+            dropped = commands.pop(0)
+            store["counters"]["dropped"] += 1
+            print("Command queue full, dropped: {} (id {})".format(dropped["command"], dropped["id"]))
     
     # Print received command
     print("\n" + "=" * 50)
@@ -476,10 +2422,14 @@ def receive_change_password():
 @app.route('/take_photo', methods=['GET'])
 def receive_take_photo():
     """Receive take_photo command (GET request), execute photo capture and send email"""
+    size = request.args.get('size') or None
+    if size is not None and size != "full" and size not in IMAGE_SIZES:
+        return "Error: unknown size, use one of: full, {}".format(", ".join(IMAGE_SIZES)), 400
+    
     add_command_to_queue('take_photo')
     
     # Process photo capture and email sending in background thread
-    thread = threading.Thread(target=process_request)
+    thread = threading.Thread(target=process_request, args=(size, request.args.get('door') or DEFAULT_DOOR_ID))
     thread.daemon = True
     thread.start()
     
@@ -533,19 +2483,28 @@ def receive_mobile_command():
         
         # Special handling for take_photo command: fetch photo and return to iOS app (no email)
         if command == "take_photo":
+            size = data.get('size') or "full"
+            if size != "full" and size not in IMAGE_SIZES:
+                return jsonify({
+                    "status": "error",
+                    "message": "Unknown size, use one of: full, {}".format(", ".join(IMAGE_SIZES))
+                }), 400
+            
             print("\n" + "=" * 50)
             print("📱 Received take_photo command (from iOS app)")
             print("=" * 50)
             print("Fetching photo...")
             
             # Fetch photo
-            image_data, image_url = get_image_from_esp32(IMAGE_URL)
+            image_data, image_url = capture_high_res_frame(get_photo_camera(data.get('door') or DEFAULT_DOOR_ID))
             
             if image_data:
-                # Encode image data as base64
+                # Resize for the phone if requested, then encode as base64
+                frame_id = get_frame_id(image_data)
+                image_data = get_resized_image(image_data, size, frame_id)
                 image_base64 = base64.b64encode(image_data).decode('utf-8')
                 
-                print("✓ Photo fetched successfully, size: {} bytes".format(len(image_data)))
+                print("✓ Photo fetched successfully, size: {} bytes ({})".format(len(image_data), size))
                 print("=" * 50)
                 
                 return jsonify({
@@ -553,7 +2512,9 @@ def receive_mobile_command():
                     "message": "Photo fetched successfully",
                     "command": command,
                     "image_base64": image_base64,
-                    "image_size": len(image_data)
+                    "image_size": len(image_data),
+                    "frame_id": frame_id,
+                    "size": size
                 }), 200
             else:
                 return jsonify({
@@ -577,73 +2538,306 @@ def receive_mobile_command():
             "message": str(e)
         }), 500
 
+def record_command_latency(store, kind, seconds):
+    """Add one sample to a command latency histogram ("deliver", "ack" or "total", store from command_store)"""
+    histogram = store["latency"].get(kind)
+    if histogram is None:
+        histogram = {"buckets": [0] * (len(COMMAND_LATENCY_BUCKETS) + 1), "count": 0, "sum": 0.0, "max": 0.0}
+        store["latency"][kind] = histogram
+    index = 0
+    while index < len(COMMAND_LATENCY_BUCKETS) and seconds > COMMAND_LATENCY_BUCKETS[index]:
+        index += 1
+    histogram["buckets"][index] += 1
+    histogram["count"] += 1
+    histogram["sum"] += seconds
+    histogram["max"] = max(histogram["max"], seconds)
+
+def lease_next_command(now):
+    """Return the earliest queued command (marking it delivered), or None while it is leased to the ESP32
+    
+    Delivery is strictly in order: later commands wait until the earliest one is acked or dropped,
+    so a redelivered unlock can never overtake a lock queued after it.
+    """
+    if SHARED_STATE_DB:
+        # Most polls find nothing to deliver: check with a read so they never wait for the write lock
+        with command_store(write=False) as store:
+            if not store["commands"] or store["commands"][0]["lease_until"] > now:
+                return None
+    with command_store() as store:
+        commands = store["commands"]
+        counters = store["counters"]
+        while commands:
+            command = commands[0]
+            if command["lease_until"] > now:
+                return None
+            if command["deliveries"] >= COMMAND_MAX_DELIVERIES:
+                # Delivered repeatedly without an ack (ESP32 keeps failing): stop retrying
+                commands.remove(command)
+                counters["dropped"] += 1
+                print("Command never acked, dropped: {} (id {})".format(command["command"], command["id"]))
+                continue
+            if command["delivered_at"] is None:
+                command["delivered_at"] = now
+                counters["delivered"] += 1
+                record_command_latency(store, "deliver", now - command["timestamp"])
+            else:
+                counters["redelivered"] += 1
+                print("Command not acked, delivering again: {} (id {})".format(command["command"], command["id"]))
+            command["deliveries"] += 1
+            if COMMAND_ACK_ENABLED:
+                command["lease_until"] = now + COMMAND_LEASE_SECONDS
+            else:
+                commands.remove(command)
+            return command
+        return None
+
+def ack_command(command_id, now):
+    """Remove acked command from the queue, return False if it is unknown (already acked or dropped)"""
+    with command_store() as store:
+        for command in store["commands"]:
+            if command["id"] == command_id:
+                break
+        else:
+            store["counters"]["unknown_acks"] += 1
+            return False
+        store["commands"].remove(command)
+        store["counters"]["acked"] += 1
+        if command["delivered_at"] is not None:
+            record_command_latency(store, "ack", now - command["delivered_at"])
+        record_command_latency(store, "total", now - command["timestamp"])
+        return True
+
+def get_command_stats():
+    """Command delivery counters, latency histograms and the pending queue"""
+    now = time.time()
+    with command_store(write=False) as store:
+        latency = {}
+        for kind, histogram in store["latency"].items():
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(list(COMMAND_LATENCY_BUCKETS) + ["+Inf"], histogram["buckets"]):
+                cumulative += count
+                buckets.append({"le": bound, "count": cumulative})
+            latency[kind] = {
+                "count": histogram["count"],
+                "mean": round(histogram["sum"] / histogram["count"], 3),
+                "max": round(histogram["max"], 3),
+                "buckets": buckets
+            }
+        pending = [{
+            "id": command["id"],
+            "command": command["command"],
+            "age": round(now - command["timestamp"], 1),
+            "deliveries": command["deliveries"],
+            "leased": command["lease_until"] > now
+        } for command in store["commands"]]
+        return {"counters": dict(store["counters"]), "latency": latency, "pending": pending}
+
 @app.route('/get_mobile_command', methods=['GET'])
 def get_mobile_command():
-    """ESP32 gets mobile command (polling method)"""
-    if mobile_command_queue:
-        # Return earliest command and remove it
-        command = mobile_command_queue.pop(0)
+    """ESP32 gets mobile command (polling method, JSON or binary frame with ?format=bin)
+    
+    The command stays queued until the ESP32 acks its ID with /ack_command, and is delivered
+    again once its lease runs out (the ESP32 crashed or lost the ack). Binary responses carry
+    the ID in an OP_COMMAND_ID frame after the command frame.
+    """
+    command = lease_next_command(time.time())
+    if command is not None:
+        if wants_binary_response():
+            frames = encode_command_frame(command["command"]) + encode_frame(OP_COMMAND_ID, COMMAND_ID.pack(command["id"]))
+            return Response(frames, mimetype=BINARY_MIMETYPE)
         return jsonify({
             "status": "success",
             "has_command": True,
             "command": command["command"],
+            "id": command["id"],
             "timestamp": command["timestamp"]
         }), 200
     else:
         # No pending commands, return simple response (reduce log output)
+        if wants_binary_response():
+            return binary_response(OP_NONE)
         return jsonify({
             "status": "success",
             "has_command": False,
             "command": None
         }), 200
 
+@app.route('/ack_command', methods=['POST'])
+def receive_command_ack():
+    """ESP32 acks an executed command ({"id": ...}) so it is not delivered again"""
+    data = request.get_json(silent=True) or {}
+    command_id = data.get('id')
+    if not isinstance(command_id, int) or isinstance(command_id, bool):
+        return jsonify({
+            "status": "error",
+            "message": "Command id must be an integer"
+        }), 400
+    # Unknown IDs are not an error: a repeated ack after a lost response must not make the ESP32 retry
+    return jsonify({
+        "status": "success",
+        "acked": ack_command(command_id, time.time())
+    }), 200
+
+@app.route('/command_stats', methods=['GET'])
+def command_stats_endpoint():
+    """Mobile command delivery stats (enqueue -> deliver -> ack latency histograms, pending commands)"""
+    stats = get_command_stats()
+    stats["status"] = "success"
+    return jsonify(stats), 200
+
+def create_server_socket(port):
+    """Listening socket that every worker process binds (the kernel spreads connections between them)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("0.0.0.0", port))
+    return sock
+
+def start_server_workers():
+    """Set up shared state and fork SERVER_WORKERS - 1 extra server processes, return (worker index, child pids)
+    
+    Must run before any thread is started (a forked child only has the calling thread). Every worker
+    loads its own models and serves port 8080 on its own SO_REUSEPORT socket.
+    """
+    workers = SERVER_WORKERS
+    if workers > 1 and not SHARED_STATE_DB:
+        print("⚠️  SERVER_WORKERS > 1 needs SHARED_STATE_DB (codes and commands would differ per process), running one process")
+        workers = 1
+    if workers > 1 and (waitress_serve is None or not hasattr(socket, "SO_REUSEPORT") or not hasattr(os, "fork")):
+        print("⚠️  SERVER_WORKERS > 1 needs waitress and SO_REUSEPORT (Linux), running one process")
+        workers = 1
+    if SHARED_STATE_DB:
+        init_shared_state()
+    worker_pids = []
+    for worker_index in range(1, workers):
+        pid = os.fork()
+        if pid == 0:
+            return worker_index, []
+        worker_pids.append(pid)
+    return 0, worker_pids
+
 def get_local_ip():
-    """Get local IP address"""
+    """Get local IP address (of the interface that reaches the cameras, no outside network needed)"""
+    # Connecting a UDP socket only picks a route, nothing is sent; camera IPs are on the LAN the
+    # ESP32 uses, host names are skipped so this never waits for DNS
+    targets = []
+    for url in camera_registry.values():
+        host = urlsplit(url).hostname
+        try:
+            if host and ipaddress.ip_address(host).version == 4:
+                targets.append(host)
+        except ValueError:
+            pass
+    for target in targets + ["10.255.255.255"]:
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                s.connect((target, 80))
+                ip = s.getsockname()[0]
+            finally:
+                s.close()
+            if not ip.startswith("0."):
+                return ip
+        except OSError:
+            continue
     try:
-        # Create a UDP socket
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        # No need to actually connect, just use it to get local IP
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
+        # Fallback method: use hostname
+        hostname = socket.gethostname()
+        ip = socket.gethostbyname(hostname)
         return ip
     except Exception:
-        try:
-            # Fallback method: use hostname
-            hostname = socket.gethostname()
-            ip = socket.gethostbyname(hostname)
-            return ip
-        except Exception:
-            return "Unable to get IP"
+        return "Unable to get IP"
 
 if __name__ == '__main__':
-    # Get local IP address
-    local_ip = get_local_ip()
+    # Fork the extra worker processes first (no thread may exist yet), each one runs everything below
+    worker_index, worker_pids = start_server_workers()
     
-    print("=" * 50)
-    print("ESP32 Photo Email Server")
-    print("=" * 50)
-    print("Starting server...")
-    print("Local IP address: {}".format(local_ip))
-    print("Listening address: http://0.0.0.0:8080")
-    print("Server URL: http://{}:8080".format(local_ip))
-    print("Trigger endpoint: POST /trigger")
-    print("Health check: GET /health")
-    print("Generate temp password: POST /generate_temp_password")
-    print("Verify temp password: POST /verify_temp_password")
-    print("Mobile commands: GET /unlock, GET /lock")
-    print("Change password: GET /change_password?password=[digits]")
-    print("Take photo: GET /take_photo")
-    print("Mobile command (JSON): POST /mobile_command")
-    print("ESP32 get command: GET /get_mobile_command")
-    print("\nFeature description:")
-    print("- PIR trigger: Wait 0.5 seconds, then capture one image per second, detect faces, for 3 seconds")
-    print("- Email sent only if at least 2 photos have faces detected")
-    print("\nWaiting for ESP32 and mobile requests...")
-    print("Please enter the following IP address in ESP32 client:")
-    print(">>> {}".format(local_ip))
-    print("=" * 50)
+    # Load settings and door/camera mapping (fall back to the defaults above), then watch both files
+    for path, loader in ((CONFIG_FILE, load_config), (CAMERA_CONFIG_FILE, load_camera_registry)):
+        try:
+            loader(path)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            config_status["error"] = "{}: {}".format(path, e)
+            print("✗ {} not applied, starting with the defaults: {}".format(path, e))
+    start_config_watcher()
+    
+    # Load models (cv2/numpy are imported here, not at module load)
+    if WARMUP_IN_BACKGROUND:
+        start_warmup()
+    else:
+        warm_up()
+    
+    if worker_index == 0:
+        # Get local IP address (startup banner from the first worker only)
+        local_ip = get_local_ip()
+    
+        print("=" * 50)
+        print("ESP32 Photo Email Server")
+        print("=" * 50)
+        print("Starting server...")
+        print("Local IP address: {}".format(local_ip))
+        print("Listening address: http://0.0.0.0:8080")
+        print("Server URL: http://{}:8080".format(local_ip))
+        print("Trigger endpoint: POST /trigger")
+        print("Health check: GET /health (liveness), GET /ready (readiness)")
+        print("Generate temp password: POST /generate_temp_password")
+        print("Verify temp password: POST /verify_temp_password")
+        print("Temp password sync (ESP32): GET /temp_password_sync?version=, POST /consume_temp_password")
+        print("Mobile commands: GET /unlock, GET /lock")
+        print("Change password: GET /change_password?password=[digits]")
+        print("Take photo: GET /take_photo?size=[thumb|small|medium|full]")
+        print("Mobile command (JSON): POST /mobile_command")
+        print("ESP32 get command: GET /get_mobile_command, then POST /ack_command (stats: GET /command_stats)")
+        print("Event archive: GET /events?since=&door=&has_face=&cursor=")
+        print("Known visitors: POST /enroll_face, GET /known_faces")
+        print("Runtime config: GET /config (edit {} or {}, applied without restart)".format(CONFIG_FILE, CAMERA_CONFIG_FILE))
+        print("\nFeature description:")
+        if ADAPTIVE_CAPTURE_ENABLED:
+            print("- PIR trigger: capture images as fast as the camera answers, stop once the result is settled (at most {} seconds)".format(CAPTURE_DEADLINE))
+        else:
+            print("- PIR trigger: Wait 0.5 seconds, then capture one image per second, detect faces, for 3 seconds")
+        print("- Email sent only if at least {} photos have faces detected".format(FACE_FRAMES_REQUIRED))
+        if CAPTURE_PROFILES_ENABLED:
+            print("- Detection on low resolution frames, emailed photo taken at high resolution (camera /control)")
+        if BACKGROUND_SAMPLER_ENABLED:
+            print("- Background sampler: frames from {} seconds before each trigger are analyzed first".format(PRE_TRIGGER_LOOKBACK))
+        print("\nWaiting for ESP32 and mobile requests...")
+        print("Please enter the following IP address in ESP32 client:")
+        print(">>> {}".format(local_ip))
+        print("=" * 50)
+    
+    else:
+        print("Worker {} started (pid {})".format(worker_index, os.getpid()))
+    
+    # Start event archive writer before accepting requests
+    start_event_writer()
+    
+    for door, camera_ids in sorted(door_cameras.items()):
+        print("Door {}: camera(s) {}".format(door, ", ".join(
+            "{} ({})".format(camera_id, camera_registry[camera_id]) for camera_id in camera_ids)))
     
-    # Run Flask server
-    app.run(host='0.0.0.0', port=8080, debug=False)
+    # Start background frame sampler (pre-trigger buffer) if enabled; the buffer is per process, so
+    # with several workers only the first one samples (triggers on the others capture live frames)
+    if BACKGROUND_SAMPLER_ENABLED and worker_index == 0:
+        start_frame_sampler()
+    
+    # Run server: waitress keeps ESP32 connections alive between polls,
+    # Flask's development server closes the connection after every response
+    try:
+        if waitress_serve is not None and (worker_index or worker_pids):
+            if worker_index == 0:
+                print("Using waitress server (HTTP keep-alive enabled), {} worker processes".format(len(worker_pids) + 1))
+            waitress_serve(app, sockets=[create_server_socket(8080)], threads=8)
+        elif waitress_serve is not None:
+            print("Using waitress server (HTTP keep-alive enabled)")
+            waitress_serve(app, host='0.0.0.0', port=8080, threads=8)
+        else:
+            app.run(host='0.0.0.0', port=8080, debug=False)
+    finally:
+        for pid in worker_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
 
@@ -0,0 +1,6 @@
+"""
+CPython simulation harness for esp32_keypad_client.py
+
+Stand-in machine, network, urequests and ssd1306 modules, a simulated clock and a scripted
+server, so the client runs deterministically on a PC (see harness.py)
+"""
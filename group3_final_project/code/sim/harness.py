@@ -0,0 +1,326 @@
+"""
+Run esp32_keypad_client.py under CPython with a simulated clock and scripted inputs
+
+    python -m sim.harness                                   # built-in demo timeline
+    python -m sim.harness sim/timelines/keypad_burst.txt --duration 40
+    python -m sim.harness --set USE_IRQ_INPUT=True --set USE_BINARY_PROTOCOL=True
+
+Run from the code directory. Timeline files have one event per line, "<seconds> <event> [args]":
+
+    1.0  pir 1           PIR output high (pir 0 = low)
+    5.0  keys A123#      type keys (each held KEY_PRESS_MS, KEY_GAP_MS apart)
+    8.0  command unlock  queue a mobile command on the server
+    20   server down     server unreachable (server up = reachable again)
+    25   temp 482913     create a temporary password on the server
+
+Only the polling and interrupt runtimes are simulated (USE_ASYNC_RUNTIME needs uasyncio).
+"""
+
+import argparse
+import ast
+import contextlib
+import importlib
+import io
+import sys
+
+from sim import machine, network, simnet, simtime, ssd1306, urequests
+
+CLIENT_MODULE = "esp32_keypad_client"
+SERVER_IP = "10.0.0.1"
+KEY_PRESS_MS = 120
+KEY_GAP_MS = 150
+
+DEMO_TIMELINE = """
+# Visitor walks up, resident enters master password, phone unlocks, server goes away for a while
+2.0   pir 1
+4.0   pir 0
+12.0  keys A123#
+20.0  command unlock
+24.0  temp 482913
+36.0  keys A482913#
+44.0  server down
+46.0  pir 1
+47.0  pir 0
+52.0  keys A999#
+70.0  server up
+75.0  command display_text:Back online
+"""
+
+
+class SimGC:
+    """Stand-in for MicroPython gc: collections cost a fixed pause, no heap model"""
+
+    def __init__(self, pause_us=1500, free_bytes=110000):
+        self.pause_us = pause_us
+        self.free_bytes = free_bytes
+        self.collections = 0
+
+    def collect(self):
+        self.collections += 1
+        simtime.advance(self.pause_us)
+
+    def mem_free(self):
+        return self.free_bytes
+
+    def mem_alloc(self):
+        return 0
+
+    def enable(self):
+        pass
+
+    def disable(self):
+        pass
+
+
+class Stats:
+    """Summary of a list of microsecond samples"""
+
+    def __init__(self, samples_us):
+        self.samples = sorted(samples_us)
+
+    def __str__(self):
+        if not self.samples:
+            return "no samples"
+        n = len(self.samples)
+        return "n={} avg={:.1f} ms p50={:.1f} ms max={:.1f} ms".format(
+            n, sum(self.samples) / n / 1000.0, self.samples[n // 2] / 1000.0, self.samples[-1] / 1000.0)
+
+
+def parse_timeline(text):
+    """Parse timeline text into [(seconds, event, argument)]"""
+    timeline = []
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        # "#" is also the keypad confirm key, so only whole-line comments are allowed
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split(None, 2)
+        if len(parts) < 2:
+            raise ValueError("Timeline line {}: expected '<seconds> <event> [args]'".format(line_number))
+        timeline.append((float(parts[0]), parts[1], parts[2] if len(parts) > 2 else ""))
+    return timeline
+
+
+def install_stubs():
+    """Make the stand-in modules importable under their MicroPython names"""
+    sys.modules["machine"] = machine
+    sys.modules["network"] = network
+    sys.modules["urequests"] = urequests
+    sys.modules["ssd1306"] = ssd1306
+
+
+def load_client(config):
+    """Import a fresh copy of the client and point it at the simulated clock, GC and sockets"""
+    install_stubs()
+    sys.modules.pop(CLIENT_MODULE, None)
+    client = importlib.import_module(CLIENT_MODULE)
+    client.time = simtime
+    client.socket = simnet
+    client.TRIGGER_SPILL_FILE = None  # Keep runs side-effect free (override with --set)
+    for name, value in config.items():
+        if not hasattr(client, name):
+            raise ValueError("Unknown client setting: {}".format(name))
+        setattr(client, name, value)
+    if client.USE_ASYNC_RUNTIME:
+        raise ValueError("USE_ASYNC_RUNTIME is not supported by the simulator")
+    return client
+
+
+def run_simulation(timeline, duration=90.0, config=None, latency_ms=15, keep_alive=True,
+                   gc_pause_us=1500, cpu_time=False, verbose=False):
+    """Run the client against a timeline, return a metrics dict"""
+    simtime.reset(duration, cpu_time)
+    machine.reset_state()
+    network.reset_state()
+    server = simnet.SimServer(latency_ms, keep_alive)
+    simnet.server = server
+    sim_gc = SimGC(gc_pause_us)
+
+    client = load_client(config or {})
+    client.gc = sim_gc
+
+    # Input models: PIR output level and the keypad matrix (pull-up columns, rows driven low)
+    world = {"pir": 0, "key": None}
+    key_positions = {}
+    for i, row_keys in enumerate(client.KEYS):
+        for j, key in enumerate(row_keys):
+            key_positions[key] = (i, j)
+
+    machine.input_models[client.PIR_PIN] = lambda: world["pir"]
+
+    def column_model(column):
+        def level():
+            key = world["key"]
+            if key is None:
+                return 1
+            row, col = key_positions[key]
+            return 0 if col == column and machine.pin_outputs.get(client.ROW_PINS[row], 1) == 0 else 1
+        return level
+
+    for j, pin_id in enumerate(client.COL_PINS):
+        machine.input_models[pin_id] = column_model(j)
+
+    # Instrumentation
+    pir_edges = []  # time_us of PIR rising edges
+    key_presses = []  # (time_us, key)
+    key_latency = []  # Press -> first scan that returns the key
+    confirm_latency = []  # "#" press -> next buzzer beep
+    loop_times = []
+    pending = {"key": None, "pressed_at": 0}
+
+    original_scan = client.scan_keypad
+
+    def scan_keypad(rows, cols):
+        key = original_scan(rows, cols)
+        if key is not None and key == pending["key"]:
+            key_latency.append(simtime.now_us - pending["pressed_at"])
+            pending["key"] = None
+        return key
+
+    client.scan_keypad = scan_keypad
+
+    original_record = client.record_loop_time
+
+    def record_loop_time(elapsed_us):
+        loop_times.append(elapsed_us)
+        original_record(elapsed_us)
+
+    client.record_loop_time = record_loop_time
+
+    def set_pir(level):
+        if level and not world["pir"]:
+            pir_edges.append(simtime.now_us)
+        world["pir"] = level
+        machine.update_inputs()
+
+    def press(key):
+        world["key"] = key
+        key_presses.append((simtime.now_us, key))
+        pending["key"] = key
+        pending["pressed_at"] = simtime.now_us
+        machine.update_inputs()
+
+    def release():
+        world["key"] = None
+        machine.update_inputs()
+
+    def set_server(state):
+        server.up = state == "up"
+
+    for at_s, event, argument in timeline:
+        if event == "pir":
+            simtime.schedule(at_s, lambda level=int(argument or 1): set_pir(level))
+        elif event == "keys":
+            at_us = int(at_s * 1000000)
+            for key in argument.replace(" ", ""):
+                simtime.schedule_us(at_us, lambda key=key: press(key))
+                simtime.schedule_us(at_us + KEY_PRESS_MS * 1000, release)
+                at_us += (KEY_PRESS_MS + KEY_GAP_MS) * 1000
+        elif event == "command":
+            simtime.schedule(at_s, lambda command=argument: server.queue_command(command))
+        elif event == "server":
+            simtime.schedule(at_s, lambda state=argument: set_server(state))
+        elif event == "temp":
+            simtime.schedule(at_s, lambda code=argument: server.add_temp_password(code))
+        else:
+            raise ValueError("Unknown timeline event: {}".format(event))
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if verbose else output):
+        try:
+            client.main(server_ip=SERVER_IP)
+        except simtime.SimulationEnd:
+            pass
+
+    # Beeps: buzzer PWM duty set above zero
+    beeps = [at_us for at_us, pin_id, _, duty in machine.pwm_log if pin_id == client.BUZZER_PIN and duty > 0]
+    for at_us, key in key_presses:
+        if key == "#":
+            later = [beep for beep in beeps if beep >= at_us]
+            if later:
+                confirm_latency.append(later[0] - at_us)
+    pir_latency = []
+    for edge in pir_edges:
+        later = [trigger for trigger in server.triggers if trigger >= edge]
+        if later:
+            pir_latency.append(later[0] - edge)
+
+    return {
+        "duration_s": simtime.now_us / 1000000.0,
+        "loop_iterations": len(loop_times),
+        "loop_time": Stats(loop_times),
+        "key_latency": Stats(key_latency),
+        "keys_missed": len(key_presses) - len(key_latency),
+        "confirm_to_beep": Stats(confirm_latency),
+        "pir_to_trigger": Stats(pir_latency),
+        "command_latency": Stats(server.command_latency_us),
+        "command_ack_latency": Stats(server.command_ack_latency_us),
+        "command_redeliveries": server.redeliveries,
+        "network_calls": dict(server.calls),
+        "network_total": sum(server.calls.values()),
+        "connections": server.connections,
+        "bytes_to_server": server.bytes_in,
+        "bytes_from_server": server.bytes_out,
+        "queued_triggers": server.queued_triggers,
+        "i2c": dict(machine.i2c_stats),
+        "gc_collections": sim_gc.collections,
+        "idle_calls": machine.idle_calls,
+        "output": output.getvalue(),
+    }
+
+
+def print_report(metrics):
+    print("Simulated time:      {:.1f} s".format(metrics["duration_s"]))
+    print("Loop iterations:     {} ({})".format(metrics["loop_iterations"], metrics["loop_time"]))
+    print("Key press -> scan:   {} (missed: {})".format(metrics["key_latency"], metrics["keys_missed"]))
+    print("'#' -> beep:         {}".format(metrics["confirm_to_beep"]))
+    print("PIR edge -> trigger: {}".format(metrics["pir_to_trigger"]))
+    print("Command latency:     {}".format(metrics["command_latency"]))
+    print("Command -> ack:      {} (redelivered: {})".format(
+        metrics["command_ack_latency"], metrics["command_redeliveries"]))
+    print("Network calls:       {} over {} connection(s), bodies {} B sent / {} B received".format(
+        metrics["network_total"], metrics["connections"], metrics["bytes_to_server"], metrics["bytes_from_server"]))
+    for call, count in sorted(metrics["network_calls"].items()):
+        print("  {:<32} {}".format(call, count))
+    if metrics["queued_triggers"]:
+        print("Queued triggers delivered: {}".format(metrics["queued_triggers"]))
+    i2c = metrics["i2c"]
+    print("I2C:                 {} transactions, {} B, {:.1f} ms".format(
+        i2c["transactions"], i2c["bytes"], i2c["us"] / 1000.0))
+    print("GC collections:      {}".format(metrics["gc_collections"]))
+
+
+def parse_setting(text):
+    name, _, value = text.partition("=")
+    try:
+        return name.strip(), ast.literal_eval(value.strip())
+    except (ValueError, SyntaxError):
+        return name.strip(), value.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the ESP32 keypad client on CPython")
+    parser.add_argument("timeline", nargs="?", help="timeline file (default: built-in demo)")
+    parser.add_argument("--duration", type=float, default=90.0, help="simulated seconds")
+    parser.add_argument("--latency-ms", type=float, default=15, help="network round trip per request")
+    parser.add_argument("--no-keep-alive", action="store_true", help="server closes the connection after each response")
+    parser.add_argument("--gc-pause-us", type=int, default=1500, help="cost of one gc.collect()")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="override a client setting, e.g. USE_IRQ_INPUT=True")
+    parser.add_argument("--cpu-time", action="store_true", help="add host CPU time to the clock (not deterministic)")
+    parser.add_argument("--verbose", action="store_true", help="show client output")
+    args = parser.parse_args()
+
+    if args.timeline:
+        with open(args.timeline) as f:
+            timeline = parse_timeline(f.read())
+    else:
+        timeline = parse_timeline(DEMO_TIMELINE)
+    config = dict(parse_setting(setting) for setting in args.set)
+    metrics = run_simulation(timeline, args.duration, config, args.latency_ms, not args.no_keep_alive,
+                             args.gc_pause_us, args.cpu_time, args.verbose)
+    print_report(metrics)
+
+
+if __name__ == "__main__":
+    main()
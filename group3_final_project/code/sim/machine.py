@@ -0,0 +1,137 @@
+"""
+Stand-in for the MicroPython machine module: Pin (with edge IRQs), PWM, I2C and idle()
+
+Input pin levels come from models installed by the harness (PIR output, keypad matrix).
+Levels are re-evaluated whenever an output pin or a model changes, and IRQ handlers run
+on the resulting edges, like interrupts on the real board.
+"""
+
+from sim import simtime
+
+pin_outputs = {}  # Pin id -> level driven by the client
+input_models = {}  # Pin id -> function() returning the input level
+irq_pins = []  # Pins with an IRQ handler
+pwm_log = []  # (time_us, pin id, frequency, duty) for every duty change
+i2c_stats = {"transactions": 0, "bytes": 0, "us": 0}
+idle_calls = 0
+
+
+def reset_state():
+    """Forget all pins, models and counters (start of a run)"""
+    global idle_calls
+    pin_outputs.clear()
+    input_models.clear()
+    del irq_pins[:]
+    del pwm_log[:]
+    i2c_stats.update(transactions=0, bytes=0, us=0)
+    idle_calls = 0
+
+
+def update_inputs():
+    """Re-evaluate input levels and run IRQ handlers on edges"""
+    for pin in list(irq_pins):
+        level = pin.value()
+        if level == pin.last_level:
+            continue
+        pin.last_level = level
+        if (level and pin.trigger & Pin.IRQ_RISING) or (not level and pin.trigger & Pin.IRQ_FALLING):
+            pin.handler(pin)
+
+
+def idle():
+    """Sleep until the next interrupt or system tick (1 ms)"""
+    global idle_calls
+    idle_calls += 1
+    next_event = simtime.next_event_us()
+    step = 1000 if next_event is None else max(1, min(1000, next_event - simtime.now_us))
+    simtime.advance(step)
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self.pull = pull
+        self.handler = None
+        self.trigger = 0
+        self.last_level = 0
+        if value is not None:
+            self.value(value)
+
+    def value(self, level=None):
+        if level is None:
+            if self.mode != Pin.OUT and self.id in input_models:
+                return input_models[self.id]()
+            return pin_outputs.get(self.id, 1 if self.pull == Pin.PULL_UP else 0)
+        pin_outputs[self.id] = 1 if level else 0
+        # Driving a pin can change inputs (keypad rows -> columns)
+        update_inputs()
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+        if self in irq_pins:
+            irq_pins.remove(self)
+        self.handler = handler
+        self.trigger = trigger
+        self.last_level = self.value()
+        if handler is not None:
+            irq_pins.append(self)
+
+
+class PWM:
+    def __init__(self, pin, freq=0, duty=0):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty(self, value=None):
+        if value is None:
+            return self._duty
+        self._duty = value
+        pwm_log.append((simtime.now_us, self.pin.id, self._freq, value))
+
+    def deinit(self):
+        self._duty = 0
+
+
+class I2C:
+    """I2C bus: each transfer advances the clock by its time on the wire"""
+
+    def __init__(self, id=0, scl=None, sda=None, freq=400000):
+        self.frequency = freq
+
+    def transfer(self, data_bytes):
+        # Address byte + data, 9 clocks per byte (8 bits + ACK), plus start/stop
+        bits = (data_bytes + 1) * 9 + 2
+        duration_us = bits * 1000000 // self.frequency
+        i2c_stats["transactions"] += 1
+        i2c_stats["bytes"] += data_bytes
+        i2c_stats["us"] += duration_us
+        simtime.advance(duration_us)
+
+    def writeto(self, addr, buf, stop=True):
+        self.transfer(len(buf))
+        return len(buf)
+
+    def writevto(self, addr, vector, stop=True):
+        self.transfer(sum(len(buf) for buf in vector))
+
+    def scan(self):
+        return [0x3C]
@@ -0,0 +1,41 @@
+"""
+Stand-in for the MicroPython network module (station interface only)
+"""
+
+STA_IF = 0
+AP_IF = 1
+
+wifi_available = True  # False: connect() never succeeds
+station_ip = "10.0.0.2"
+station_connected = False
+
+
+def reset_state():
+    global wifi_available, station_connected
+    wifi_available = True
+    station_connected = False
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+
+    def active(self, state=None):
+        if state is None:
+            return self._active
+        self._active = bool(state)
+
+    def connect(self, ssid=None, password=None):
+        global station_connected
+        station_connected = wifi_available
+
+    def disconnect(self):
+        global station_connected
+        station_connected = False
+
+    def isconnected(self):
+        return station_connected
+
+    def ifconfig(self):
+        return (station_ip, "255.255.255.0", "10.0.0.1", "10.0.0.1")
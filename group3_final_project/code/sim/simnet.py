@@ -0,0 +1,271 @@
+"""
+Scripted door server and socket stand-in
+
+SimServer implements the endpoints the ESP32 client calls (same JSON and binary formats as
+server_image_email.py, without cameras or email) and counts every call. Frames, command
+coalescing and temporary password hashes come from door_protocol, the module the server uses. This module also
+replaces the client's socket module: SimSocket speaks HTTP/1.1 to the SimServer, so the
+keep-alive client, urequests and the binary protocol all run unchanged.
+"""
+
+import json
+from urllib.parse import urlsplit, parse_qs
+
+from door_protocol import (BINARY_MIMETYPE, OP_NONE, OP_TRIGGER_ACCEPTED, OP_COMMAND_ID, COMMAND_ID,
+                           encode_frame, encode_command_frame, superseded_commands, temp_password_hash,
+                           device_token)
+from sim import simtime
+
+ETIMEDOUT = 116  # MicroPython errno on the ESP32 port
+DEVICE_SECRET = "change-this-door-secret"  # Client default
+# Server settings the model mirrors (reloadable on the server, so not part of door_protocol)
+COMMAND_LEASE_US = 15000000  # Unacked command is delivered again after this (COMMAND_LEASE_SECONDS)
+TRIGGER_LIVE_WINDOW = 30  # Seconds: only a queued trigger this recent starts detection (TRIGGER_LIVE_WINDOW)
+
+server = None  # Current SimServer (set by the harness)
+
+
+class SimServer:
+    """Door server model: request handling plus call counting and network cost"""
+
+    def __init__(self, latency_ms=15, keep_alive=True):
+        self.latency_us = int(latency_ms * 1000)  # Round trip per request (and per TCP connect)
+        self.keep_alive = keep_alive
+        self.up = True
+        self.commands = []  # {"id", "queued_us", "command", "lease_until_us"}, removed when acked
+        self.next_command_id = 1
+        self.temp_passwords = {}  # Code -> created time_us
+        self.temp_version = 0
+        self.calls = {}  # "METHOD /path" -> count
+        self.connections = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.triggers = []  # time_us of each live trigger received
+        self.queued_triggers = 0  # Triggers delivered through the batched /trigger variant
+        self.command_latency_us = []  # Queued -> first fetched by the ESP32
+        self.command_ack_latency_us = []  # Queued -> acked
+        self.redeliveries = 0
+
+    # ---------- scripting ----------
+
+    def queue_command(self, command):
+        # Same coalescing as the server: a newer lock state / password / text replaces queued ones
+        for queued in superseded_commands(self.commands, command):
+            self.commands.remove(queued)
+        self.commands.append({"id": self.next_command_id, "queued_us": simtime.now_us,
+                              "command": command, "lease_until_us": 0})
+        self.next_command_id += 1
+
+    def add_temp_password(self, code):
+        self.temp_passwords[code] = simtime.now_us
+        self.temp_version += 1
+
+    # ---------- network cost ----------
+
+    def connect(self, timeout_s):
+        """Open a TCP connection (one round trip), or time out if the server is down"""
+        if not self.up:
+            simtime.advance(int((timeout_s or 30) * 1000000))
+            raise OSError(ETIMEDOUT, "ETIMEDOUT")
+        self.connections += 1
+        simtime.advance(self.latency_us)
+
+    def exchange(self, method, target, body, content_type):
+        """Handle one request after its round trip, return (status, content type, body bytes)"""
+        simtime.advance(self.latency_us)
+        path = urlsplit(target).path
+        key = "{} {}".format(method, path)
+        self.calls[key] = self.calls.get(key, 0) + 1
+        self.bytes_in += len(body)
+        status, response_type, content = self.handle(method, target, bytes(body), content_type)
+        self.bytes_out += len(content)
+        return status, response_type, content
+
+    # ---------- endpoints ----------
+
+    def handle(self, method, target, body, content_type):
+        parts = urlsplit(target)
+        query = parse_qs(parts.query)
+        path = parts.path
+        binary = content_type.startswith(BINARY_MIMETYPE) or query.get("format") == ["bin"]
+
+        if path == "/get_mobile_command" and method == "GET":
+            # Strictly in order, like the server: later commands wait while the earliest one is leased
+            entry = self.commands[0] if self.commands else None
+            if entry is not None and entry["lease_until_us"] > simtime.now_us:
+                entry = None
+            if entry is None:
+                if binary:
+                    return 200, BINARY_MIMETYPE, encode_frame(OP_NONE)
+                return self.json_response({"status": "success", "has_command": False, "command": None})
+            if entry["lease_until_us"]:
+                self.redeliveries += 1
+            else:
+                self.command_latency_us.append(simtime.now_us - entry["queued_us"])
+            entry["lease_until_us"] = simtime.now_us + COMMAND_LEASE_US
+            if binary:
+                return 200, BINARY_MIMETYPE, (encode_command_frame(entry["command"])
+                                              + encode_frame(OP_COMMAND_ID, COMMAND_ID.pack(entry["id"])))
+            return self.json_response({"status": "success", "has_command": True, "command": entry["command"],
+                                       "id": entry["id"]})
+
+        if path == "/ack_command" and method == "POST":
+            command_id = json.loads(body or b"{}").get("id")
+            for entry in self.commands:
+                if entry["id"] == command_id:
+                    self.commands.remove(entry)
+                    self.command_ack_latency_us.append(simtime.now_us - entry["queued_us"])
+                    return self.json_response({"status": "success", "acked": True})
+            return self.json_response({"status": "success", "acked": False})
+
+        if path == "/trigger" and method == "POST":
+            if binary:
+                self.triggers.append(simtime.now_us)
+                return 200, BINARY_MIMETYPE, encode_frame(OP_TRIGGER_ACCEPTED)
+            data = json.loads(body or b"{}")
+            if "events" in data:
+                self.queued_triggers += len(data["events"])
+                fresh = [e for e in data["events"] if e.get("age") is not None and e["age"] <= TRIGGER_LIVE_WINDOW]
+                if fresh:
+                    self.triggers.append(simtime.now_us)
+                return self.json_response({"status": "success", "accepted": len(data["events"]),
+                                           "detection": "started" if fresh else "skipped"})
+            self.triggers.append(simtime.now_us)
+            return self.json_response({"status": "success", "message": "PIR trigger received"})
+
+        if path == "/generate_temp_password" and method == "POST":
+            code = "{:06d}".format((len(self.temp_passwords) * 7919 + self.temp_version * 104729) % 1000000)
+            self.add_temp_password(code)
+            return self.json_response({"status": "success", "temp_password": code, "expires_in": 86400})
+
+        if path == "/verify_temp_password" and method == "POST":
+            code = json.loads(body or b"{}").get("password", "")
+            valid = self.temp_passwords.pop(code, None) is not None
+            if valid:
+                self.temp_version += 1
+            return self.json_response({"status": "success", "valid": valid})
+
+        if path == "/temp_password_sync" and method == "GET":
+            if query.get("token") != [device_token(DEVICE_SECRET)]:
+                return self.json_response({"status": "error", "message": "Device token required"}, 401)
+            salt = "sim{}".format(self.temp_version)
+            if query.get("version") == [str(self.temp_version)]:
+                return self.json_response({"status": "success", "changed": False, "version": self.temp_version})
+            codes = [[self.hash_code(code, salt), 86400] for code in self.temp_passwords]
+            return self.json_response({"status": "success", "changed": True, "version": self.temp_version,
+                                       "salt": salt, "codes": codes})
+
+        if path == "/consume_temp_password" and method == "POST":
+            data = json.loads(body or b"{}")
+            for code in list(self.temp_passwords):
+                if self.hash_code(code, data.get("salt", "")) == data.get("hash"):
+                    del self.temp_passwords[code]
+                    self.temp_version += 1
+                    return self.json_response({"status": "success", "consumed": True})
+            return self.json_response({"status": "success", "consumed": False})
+
+        return self.json_response({"status": "error", "message": "Not found"}, 404)
+
+    @staticmethod
+    def hash_code(code, salt):
+        return temp_password_hash(DEVICE_SECRET, code, salt)
+
+    @staticmethod
+    def json_response(data, status=200):
+        return status, "application/json", json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+    def http_response(self, status, content_type, content):
+        """Serialize a response like waitress does (HTTP/1.1, Content-Length)"""
+        head = "HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n".format(
+            status, "OK" if status == 200 else "ERROR", content_type, len(content))
+        if not self.keep_alive:
+            head += "Connection: close\r\n"
+        return head.encode() + b"\r\n" + content
+
+
+# ---------- socket module stand-in ----------
+
+def getaddrinfo(host, port, *args):
+    return [(2, 1, 0, "", (host, port))]
+
+
+def socket(*args):
+    return SimSocket()
+
+
+class SimSocket:
+    """TCP socket to the SimServer: requests are answered as soon as they are complete"""
+
+    def __init__(self):
+        self.timeout = None
+        self.connected = False
+        self.closed_by_server = False
+        self.request = bytearray()
+        self.response = bytearray()
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def connect(self, address):
+        server.connect(self.timeout)
+        self.connected = True
+
+    def sendall(self, data):
+        if not self.connected or self.closed_by_server:
+            raise OSError(104, "ECONNRESET")
+        self.request.extend(data)
+        self.process_requests()
+
+    write = sendall
+
+    def send(self, data):
+        self.sendall(data)
+        return len(data)
+
+    def process_requests(self):
+        while True:
+            header_end = self.request.find(b"\r\n\r\n")
+            if header_end < 0:
+                return
+            head = bytes(self.request[:header_end]).decode("latin-1").split("\r\n")
+            length = 0
+            content_type = ""
+            for line in head[1:]:
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+                elif name.strip().lower() == "content-type":
+                    content_type = value.strip()
+            if len(self.request) < header_end + 4 + length:
+                return
+            body = bytes(self.request[header_end + 4:header_end + 4 + length])
+            del self.request[:header_end + 4 + length]
+            if not server.up:
+                # Request is lost, the client times out waiting for the response
+                continue
+            method, target = head[0].split(" ")[:2]
+            status, response_type, content = server.exchange(method, target, body, content_type)
+            self.response.extend(server.http_response(status, response_type, content))
+            if not server.keep_alive:
+                self.closed_by_server = True
+
+    def readinto(self, buf, nbytes=None):
+        if not self.response:
+            if self.closed_by_server:
+                return 0
+            simtime.advance(int((self.timeout or 30) * 1000000))
+            raise OSError(ETIMEDOUT, "ETIMEDOUT")
+        n = min(len(buf) if nbytes is None else nbytes, len(self.response))
+        buf[:n] = self.response[:n]
+        del self.response[:n]
+        return n
+
+    recv_into = readinto
+
+    def recv(self, size):
+        buf = bytearray(size)
+        n = self.readinto(buf)
+        return bytes(buf[:n])
+
+    def close(self):
+        self.connected = False
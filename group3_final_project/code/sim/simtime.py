@@ -0,0 +1,118 @@
+"""
+Simulated clock: stand-in for the MicroPython time module (time, ticks_ms/us, sleep_ms/us)
+
+Time only moves when the client sleeps or a stub models a cost (I2C transfer, network round trip,
+GC pause), so every run is deterministic. Timeline events fire when the clock passes them.
+"""
+
+import heapq
+import time as host_time
+
+TICKS_PERIOD = 1 << 30  # MicroPython ticks wrap at 2**30
+TICKS_HALF = TICKS_PERIOD // 2
+
+
+class SimulationEnd(KeyboardInterrupt):
+    """Raised when the clock reaches the end of the run (the client stops as on Ctrl+C)"""
+
+
+now_us = 0
+end_us = None
+epoch = 0  # time.time() at boot (ESP32 RTC starts at 2000-01-01 without NTP)
+events = []  # Heap of (time_us, sequence, callback)
+event_sequence = 0
+use_cpu_time = False  # Also add host CPU time spent in the client (not deterministic)
+host_last_us = 0
+
+
+def reset(duration_s=None, cpu_time=False):
+    """Start a new run at t=0, ending after duration_s seconds (None = no end)"""
+    global now_us, end_us, events, event_sequence, use_cpu_time, host_last_us
+    now_us = 0
+    end_us = None if duration_s is None else int(duration_s * 1000000)
+    events = []
+    event_sequence = 0
+    use_cpu_time = cpu_time
+    host_last_us = host_time.perf_counter_ns() // 1000
+
+
+def schedule(at_s, callback):
+    """Run callback() when the clock reaches at_s seconds"""
+    schedule_us(int(at_s * 1000000), callback)
+
+
+def schedule_us(at_us, callback):
+    """Run callback() when the clock reaches at_us microseconds"""
+    global event_sequence
+    event_sequence += 1
+    heapq.heappush(events, (at_us, event_sequence, callback))
+
+
+def next_event_us():
+    """Time of the next scheduled event, or None"""
+    return events[0][0] if events else None
+
+
+def charge_cpu():
+    """Add host CPU time since the last call (only with cpu_time=True)"""
+    global host_last_us
+    if not use_cpu_time:
+        return
+    host_now = host_time.perf_counter_ns() // 1000
+    elapsed = host_now - host_last_us
+    host_last_us = host_now
+    advance(elapsed, charge=False)
+
+
+def advance(delta_us, charge=True):
+    """Move the clock forward, firing due events in order (raises SimulationEnd at the end)"""
+    global now_us
+    if charge:
+        charge_cpu()
+    target = now_us + max(0, int(delta_us))
+    if end_us is not None and target > end_us:
+        target = end_us
+    while events and events[0][0] <= target:
+        at_us, _, callback = heapq.heappop(events)
+        now_us = max(now_us, at_us)
+        callback()
+    now_us = max(now_us, target)
+    if end_us is not None and now_us >= end_us:
+        raise SimulationEnd()
+
+
+# ---------- MicroPython time API ----------
+
+def time():
+    charge_cpu()
+    return epoch + now_us // 1000000
+
+
+def ticks_ms():
+    charge_cpu()
+    return (now_us // 1000) % TICKS_PERIOD
+
+
+def ticks_us():
+    charge_cpu()
+    return now_us % TICKS_PERIOD
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) % TICKS_PERIOD
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALF) % TICKS_PERIOD) - TICKS_HALF
+
+
+def sleep(seconds):
+    advance(seconds * 1000000)
+
+
+def sleep_ms(ms):
+    advance(ms * 1000)
+
+
+def sleep_us(us):
+    advance(us)
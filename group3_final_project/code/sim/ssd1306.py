@@ -0,0 +1,89 @@
+"""
+Stand-in for the MicroPython ssd1306 driver (SSD1306_I2C)
+
+Same buffer layout (MONO_VLSB) and I2C transfers as the real driver, so transfer time is
+modelled by the I2C stub. text() draws a simple 8x8 pattern per character instead of the
+framebuf font: different text gives different pixels, which is all the display manager needs.
+"""
+
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+SET_DISP = 0xAE
+
+
+class SSD1306_I2C:
+    def __init__(self, width, height, i2c, addr=0x3C, external_vcc=False):
+        self.width = width
+        self.height = height
+        self.pages = height // 8
+        self.buffer = bytearray(self.pages * width)
+        self.i2c = i2c
+        self.addr = addr
+        self.temp = bytearray(2)
+        self.write_list = [b"\x40", None]
+        self.shows = 0
+        self.init_display()
+
+    def init_display(self):
+        # Same number of init commands as the real driver
+        for cmd in range(25):
+            self.write_cmd(cmd)
+        self.fill(0)
+        self.show()
+
+    def write_cmd(self, cmd):
+        self.temp[0] = 0x80
+        self.temp[1] = cmd
+        self.i2c.writeto(self.addr, self.temp)
+
+    def write_data(self, buf):
+        self.write_list[1] = buf
+        self.i2c.writevto(self.addr, self.write_list)
+
+    def show(self):
+        self.shows += 1
+        self.write_cmd(SET_COL_ADDR)
+        self.write_cmd(0)
+        self.write_cmd(self.width - 1)
+        self.write_cmd(SET_PAGE_ADDR)
+        self.write_cmd(0)
+        self.write_cmd(self.pages - 1)
+        self.write_data(self.buffer)
+
+    def poweroff(self):
+        self.write_cmd(SET_DISP)
+
+    def poweron(self):
+        self.write_cmd(SET_DISP | 0x01)
+
+    def contrast(self, contrast):
+        self.write_cmd(0x81)
+        self.write_cmd(contrast)
+
+    def fill(self, color):
+        value = 0xFF if color else 0x00
+        for i in range(len(self.buffer)):
+            self.buffer[i] = value
+
+    def pixel(self, x, y, color=None):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return 0
+        index = (y >> 3) * self.width + x
+        bit = 1 << (y & 7)
+        if color is None:
+            return 1 if self.buffer[index] & bit else 0
+        if color:
+            self.buffer[index] |= bit
+        else:
+            self.buffer[index] &= ~bit
+
+    def text(self, string, x, y, color=1):
+        for i, char in enumerate(string):
+            code = ord(char)
+            if code == 32:
+                continue
+            for column in range(7):
+                bits = (code * 37 + column * 11) & 0x7E
+                for row in range(8):
+                    if bits & (1 << row):
+                        self.pixel(x + i * 8 + column, y + row, color)
@@ -0,0 +1,49 @@
+"""
+Stand-in for MicroPython urequests: every call opens a new connection to the SimServer
+"""
+
+import json as json_module
+from urllib.parse import urlsplit
+
+from sim import simnet
+
+
+class Response:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return str(self.content, "utf-8")
+
+    def json(self):
+        return json_module.loads(self.content)
+
+    def close(self):
+        pass
+
+
+def request(method, url, data=None, json=None, headers=None, timeout=None):
+    if json is not None:
+        data = json_module.dumps(json).encode("utf-8")
+        content_type = "application/json"
+    else:
+        data = data or b""
+        content_type = (headers or {}).get("Content-Type", "")
+    server = simnet.server
+    server.connect(timeout)
+    if not server.up:
+        raise OSError(simnet.ETIMEDOUT, "ETIMEDOUT")
+    parts = urlsplit(url)
+    target = parts.path + ("?" + parts.query if parts.query else "")
+    status, _, content = server.exchange(method, target, data, content_type)
+    return Response(status, content)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
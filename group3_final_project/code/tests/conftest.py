@@ -0,0 +1,47 @@
+"""Fixtures: server_image_email with fresh command queue and rate limit state for every test"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server_image_email  # noqa: E402
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """The server module with an empty command queue, no rate limit buckets, no shared state and default settings"""
+    monkeypatch.setattr(server_image_email, "SHARED_STATE_DB", None)
+    # Fresh settings snapshot, taken from the module globals on first use
+    monkeypatch.setattr(server_image_email, "config_settings", None)
+    monkeypatch.setitem(server_image_email.command_queue_state, "commands", [])
+    monkeypatch.setitem(server_image_email.command_queue_state, "counters",
+                        dict.fromkeys(server_image_email.command_queue_state["counters"], 0))
+    monkeypatch.setitem(server_image_email.command_queue_state, "latency", {})
+    monkeypatch.setattr(server_image_email, "rate_limit_buckets", type(server_image_email.rate_limit_buckets)())
+    return server_image_email
+
+
+@pytest.fixture(params=["local", "shared"])
+def store_server(request, server, monkeypatch, tmp_path):
+    """server, once with state in this process and once with SHARED_STATE_DB"""
+    if request.param == "shared":
+        monkeypatch.setattr(server, "SHARED_STATE_DB", str(tmp_path / "shared_state.db"))
+        monkeypatch.setattr(server, "rate_limit_last_prune", 0.0)
+        monkeypatch.setattr(server, "shared_state_local", type(server.shared_state_local)())
+        server.init_shared_state()
+    yield server
+    conn = getattr(server.shared_state_local, "conn", None)
+    if conn is not None:
+        conn.close()
+
+
+@pytest.fixture
+def client():
+    """A fresh copy of esp32_keypad_client on the simulator's clock and stand-in modules"""
+    from sim import harness, simtime
+    simtime.reset(None, False)
+    yield harness.load_client({})
+    sys.modules.pop(harness.CLIENT_MODULE, None)
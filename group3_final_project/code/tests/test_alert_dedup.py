@@ -0,0 +1,53 @@
+"""Near-duplicate alerts: a frame hashing close to a recent alert of the same door is merged"""
+
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+
+def scene(flip, quality=90, brightness=0):
+    """JPEG of a gradient with a dark block (flip mirrors it: a different scene)"""
+    image = np.tile(np.linspace(0, 200, 320, dtype=np.uint8), (240, 1))
+    image[60:180, 40:120] = 20
+    image = cv2.add(image, brightness)
+    if flip:
+        image = image[:, ::-1]
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+@pytest.fixture
+def dedup_server(server, monkeypatch):
+    """server with no alerts remembered"""
+    monkeypatch.setattr(server, "alert_hash_index", {})
+    return server
+
+
+def test_same_scene_is_merged(dedup_server):
+    dedup_server.register_alert("front_door", dedup_server.compute_dhash(scene(False)), now=100.0)
+    # Re-encoded and a little brighter: still the same scene
+    frame_hash = dedup_server.compute_dhash(scene(False, quality=40, brightness=10))
+    assert dedup_server.find_duplicate_alert("front_door", frame_hash, now=110.0)[2] == 1
+    assert dedup_server.find_duplicate_alert("front_door", frame_hash, now=111.0)[2] == 2
+
+
+def test_different_scene_door_or_old_alert_is_not_merged(dedup_server):
+    window = dedup_server.get_settings()["ALERT_DEDUP_WINDOW"]
+    frame_hash = dedup_server.compute_dhash(scene(False))
+    dedup_server.register_alert("front_door", frame_hash, now=100.0)
+    assert dedup_server.find_duplicate_alert("front_door", dedup_server.compute_dhash(scene(True)), now=110.0) is None
+    assert dedup_server.find_duplicate_alert("back_door", frame_hash, now=110.0) is None
+    assert dedup_server.find_duplicate_alert("front_door", frame_hash, now=100.0 + window + 1) is None
+
+
+def test_ring_buffer_forgets_oldest_alert(dedup_server, monkeypatch):
+    monkeypatch.setattr(dedup_server, "ALERT_DEDUP_CAPACITY", 2)
+    first, second = dedup_server.compute_dhash(scene(False)), dedup_server.compute_dhash(scene(True))
+    dedup_server.register_alert("front_door", first, now=100.0)
+    dedup_server.register_alert("front_door", second, now=101.0)
+    dedup_server.register_alert("front_door", second, now=102.0)
+    assert dedup_server.find_duplicate_alert("front_door", first, now=103.0) is None
+
+
+def test_undecodable_frame_has_no_hash(dedup_server):
+    assert dedup_server.compute_dhash(b"not a jpeg") is None
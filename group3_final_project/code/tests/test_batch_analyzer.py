@@ -0,0 +1,55 @@
+"""Batch face analysis: frames are analyzed in parallel, one result per frame in input order"""
+
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+
+def jpeg(value):
+    return cv2.imencode(".jpg", np.full((120, 160), value, np.uint8))[1].tobytes()
+
+
+class FakeCascade:
+    """Finds one face in frames brighter than 128, records the minNeighbors it was called with"""
+
+    def __init__(self):
+        self.min_neighbors = []
+
+    def detectMultiScale3(self, gray, scaleFactor, minNeighbors, minSize, outputRejectLevels):
+        self.min_neighbors.append(minNeighbors)
+        if gray.mean() > 128:
+            return np.array([[10, 20, 40, 40]]), np.array([5]), np.array([[2.5]])
+        return (), (), ()
+
+
+@pytest.fixture
+def cascade(server, monkeypatch):
+    fake = FakeCascade()
+    monkeypatch.setattr(server, "get_face_cascade", lambda: fake)
+    return fake
+
+
+def test_results_follow_input_order(server, cascade):
+    results = server.detect_faces_in_images([jpeg(200), None, jpeg(10), b"garbage", jpeg(220)])
+    assert [result["index"] for result in results] == [0, 1, 2, 3, 4]
+    assert [result["has_face"] for result in results] == [True, False, False, False, True]
+    assert [result["error"] for result in results] == [None, "no image", None, "cannot decode image", None]
+    assert results[0]["boxes"] == [[10, 20, 40, 40]]
+    assert results[0]["max_confidence"] == 2.5
+
+
+def test_empty_batch(server):
+    assert server.detect_faces_in_images([]) == []
+
+
+def test_settings_snapshot_picks_min_neighbors(server, cascade):
+    settings = dict(server.get_settings(), FACE_TRACKING_ENABLED=True)
+    server.detect_faces_in_images([jpeg(200)], settings)
+    server.detect_faces_in_images([jpeg(200)], dict(settings, FACE_TRACKING_ENABLED=False))
+    assert cascade.min_neighbors == [settings["FACE_MIN_NEIGHBORS_TRACKED"], settings["FACE_MIN_NEIGHBORS"]]
+
+
+def test_real_cascade_finds_no_face_in_blank_frame(server):
+    [result] = server.detect_faces_in_images([jpeg(128)])
+    assert result["error"] is None and not result["has_face"]
@@ -0,0 +1,50 @@
+"""Capture profiles: detection switches the camera down, it goes back to its idle profile afterwards"""
+
+import pytest
+
+
+class ControlResponse:
+    status_code = 200
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def applied_controls(server, monkeypatch):
+    """(variable, value) of each camera /control call (frames are fake, nothing is fetched)"""
+    applied = []
+    monkeypatch.setattr(server, "camera_profiles", {})
+    monkeypatch.setattr(server.requests, "get",
+                        lambda url, params, timeout: applied.append((params["var"], params["val"])) or ControlResponse())
+    monkeypatch.setattr(server, "get_image_from_esp32", lambda url, max_retries=3, quiet=False, **kwargs: (b"jpeg", url))
+    return applied
+
+
+@pytest.fixture
+def profile_server(server, applied_controls):
+    return server
+
+
+def current_profile(server, url):
+    return server.camera_profiles[url][0]
+
+
+def test_high_res_capture_leaves_camera_idle(profile_server, applied_controls):
+    profile_server.fetch_low_res_frame("http://cam")
+    assert current_profile(profile_server, "http://cam") == "low"
+    profile_server.capture_high_res_frame("http://cam")
+    assert current_profile(profile_server, "http://cam") == "idle"
+    assert applied_controls[-2:] == sorted(profile_server.CAPTURE_PROFILES["idle"].items())
+
+
+def test_restore_after_detection(profile_server):
+    profile_server.fetch_low_res_frame("http://cam")
+    profile_server.restore_idle_profiles(["http://cam"])
+    assert current_profile(profile_server, "http://cam") == "idle"
+
+
+def test_sampler_keeps_camera_on_low(profile_server, monkeypatch):
+    monkeypatch.setitem(profile_server.get_settings(), "BACKGROUND_SAMPLER_ENABLED", True)
+    profile_server.capture_high_res_frame("http://cam")
+    assert current_profile(profile_server, "http://cam") == "low"
@@ -0,0 +1,48 @@
+"""Adaptive capture: when to stop capturing and how long to wait for the next frame"""
+
+import pytest
+
+
+@pytest.fixture
+def settings(server):
+    """Settings with adaptive capture on and the default thresholds pinned"""
+    return dict(server.get_settings(), ADAPTIVE_CAPTURE_ENABLED=True, FACE_FRAMES_REQUIRED=2,
+                NO_FACE_FRAMES_REQUIRED=3, NO_FACE_SPAN=1.5, CAPTURE_MIN_INTERVAL=0.15, CAPTURE_MAX_INTERVAL=1.0)
+
+
+@pytest.mark.parametrize("face_flags, frame_times, decision", [
+    ([True, True], [0.0, 0.2], "face"),
+    ([False, True, False, True], [0.0, 0.2, 0.4, 0.6], "face"),
+    ([True], [0.0], None),
+    ([False, False, False], [0.0, 0.5, 1.0], None),    # Too quick to rule out a face
+    ([False, False, False], [0.0, 0.8, 1.6], "no_face"),
+    ([True, False, False, False], [0.0, 0.8, 1.6, 2.4], None),  # One face seen: keep looking
+])
+def test_capture_decision(server, settings, face_flags, frame_times, decision):
+    assert server.capture_decision(face_flags, frame_times, settings) == decision
+
+
+def test_ambiguous_only_between_one_and_required_faces(server, settings):
+    assert not server.is_ambiguous([False, False], settings)
+    assert server.is_ambiguous([False, True], settings)
+    assert not server.is_ambiguous([True, True], settings)
+
+
+@pytest.fixture
+def measured_camera(server, monkeypatch):
+    """server whose camera http://cam answers in 0.3 s with 0.05 s jitter"""
+    monkeypatch.setattr(server, "camera_stats", {"http://cam": {"latency": 0.3, "jitter": 0.05, "samples": 10,
+                                                                "failures": 0}})
+    return server
+
+
+def test_interval_follows_measured_camera(measured_camera, settings):
+    # Ambiguous: as fast as the camera delivers (latency + 2 x jitter)
+    assert measured_camera.next_capture_interval(["http://cam"], True, settings) == pytest.approx(0.4)
+    # Otherwise half the slowest interval
+    assert measured_camera.next_capture_interval(["http://cam"], False, settings) == 0.5
+
+
+def test_fixed_interval_when_off_or_unmeasured(measured_camera, settings):
+    assert measured_camera.next_capture_interval(["http://cam"], True, dict(settings, ADAPTIVE_CAPTURE_ENABLED=False)) == 1.0
+    assert measured_camera.next_capture_interval(["http://other"], True, settings) == 1.0
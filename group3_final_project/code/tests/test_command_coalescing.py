@@ -0,0 +1,53 @@
+"""Coalescing of superseded door commands (COMMAND_COALESCE_GROUPS)"""
+
+import time
+
+from door_protocol import superseded_commands
+
+
+def pending(server):
+    return [command["command"] for command in server.get_command_stats()["pending"]]
+
+
+def test_superseded_commands_match_group():
+    queued = [{"command": "unlock"}, {"command": "take_photo"}, {"command": "display_text:hi"}]
+    assert superseded_commands(queued, "lock") == [{"command": "unlock"}]
+    assert superseded_commands(queued, "display_text:bye") == [{"command": "display_text:hi"}]
+    assert superseded_commands(queued, "take_photo") == []
+    assert superseded_commands(queued, "reboot") == []
+
+
+def test_only_latest_lock_state_is_kept(store_server):
+    for command in ("unlock", "lock", "unlock"):
+        store_server.add_command_to_queue(command)
+    assert pending(store_server) == ["unlock"]
+    assert store_server.get_command_stats()["counters"]["coalesced"] == 2
+
+
+def test_latest_password_and_text_replace_older_ones(store_server):
+    for command in ("change_password:1111", "display_text:a", "change_password:2222", "display_text:b"):
+        store_server.add_command_to_queue(command)
+    assert pending(store_server) == ["change_password:2222", "display_text:b"]
+
+
+def test_other_commands_are_never_merged(store_server):
+    for command in ("take_photo", "unlock", "take_photo"):
+        store_server.add_command_to_queue(command)
+    assert pending(store_server) == ["take_photo", "unlock", "take_photo"]
+
+
+def test_coalescing_can_be_disabled(store_server, monkeypatch):
+    monkeypatch.setattr(store_server, "COMMAND_COALESCE_ENABLED", False)
+    for command in ("unlock", "lock"):
+        store_server.add_command_to_queue(command)
+    assert pending(store_server) == ["unlock", "lock"]
+
+
+def test_superseded_leased_command_is_not_redelivered(store_server):
+    store_server.add_command_to_queue("unlock")
+    now = time.time()
+    leased = store_server.lease_next_command(now)
+    store_server.add_command_to_queue("lock")
+    redelivered = store_server.lease_next_command(now + store_server.COMMAND_LEASE_SECONDS)
+    assert redelivered["command"] == "lock"
+    assert not store_server.ack_command(leased["id"], now + 1)
@@ -0,0 +1,89 @@
+"""Command delivery leases: unacked commands are delivered again, acked ones are removed"""
+
+import time
+
+
+def queue(server, *commands):
+    for command in commands:
+        server.add_command_to_queue(command)
+    return time.time()
+
+
+def test_leased_command_is_not_delivered_twice(store_server):
+    now = queue(store_server, "unlock")
+    command = store_server.lease_next_command(now)
+    assert command["command"] == "unlock"
+    assert store_server.lease_next_command(now + 1) is None
+
+
+def test_unacked_command_is_redelivered_after_lease(store_server):
+    now = queue(store_server, "unlock")
+    first = store_server.lease_next_command(now)
+    again = store_server.lease_next_command(now + store_server.COMMAND_LEASE_SECONDS)
+    assert again["id"] == first["id"]
+    assert again["deliveries"] == 2
+    counters = store_server.get_command_stats()["counters"]
+    assert (counters["delivered"], counters["redelivered"]) == (1, 1)
+
+
+def test_acked_command_is_removed(store_server):
+    now = queue(store_server, "unlock")
+    command = store_server.lease_next_command(now)
+    assert store_server.ack_command(command["id"], now + 1)
+    assert store_server.lease_next_command(now + store_server.COMMAND_LEASE_SECONDS + 1) is None
+    assert not store_server.ack_command(command["id"], now + 2)
+    assert store_server.get_command_stats()["counters"]["unknown_acks"] == 1
+
+
+def test_next_command_waits_while_earlier_one_is_leased(store_server):
+    now = queue(store_server, "take_photo", "unlock")
+    photo = store_server.lease_next_command(now)
+    assert photo["command"] == "take_photo"
+    assert store_server.lease_next_command(now + 1) is None
+    store_server.ack_command(photo["id"], now + 1)
+    assert store_server.lease_next_command(now + 1)["command"] == "unlock"
+
+
+def test_lost_ack_is_redelivered_before_later_command(store_server, monkeypatch):
+    monkeypatch.setattr(store_server, "COMMAND_COALESCE_ENABLED", False)
+    now = queue(store_server, "unlock", "lock")
+    lease = store_server.COMMAND_LEASE_SECONDS
+    unlock = store_server.lease_next_command(now)
+    # Ack lost: the lock must not be executed before the unlock is delivered again
+    assert store_server.lease_next_command(now + 1) is None
+    assert store_server.lease_next_command(now + lease)["id"] == unlock["id"]
+    store_server.ack_command(unlock["id"], now + lease + 1)
+    assert store_server.lease_next_command(now + lease + 1)["command"] == "lock"
+
+
+def test_later_command_is_delivered_once_earlier_one_is_dropped(store_server, monkeypatch):
+    monkeypatch.setattr(store_server, "COMMAND_MAX_DELIVERIES", 1)
+    now = queue(store_server, "take_photo", "unlock")
+    store_server.lease_next_command(now)
+    assert store_server.lease_next_command(now + store_server.COMMAND_LEASE_SECONDS)["command"] == "unlock"
+    assert store_server.get_command_stats()["counters"]["dropped"] == 1
+
+
+def test_command_is_dropped_after_max_deliveries(store_server, monkeypatch):
+    monkeypatch.setattr(store_server, "COMMAND_MAX_DELIVERIES", 2)
+    now = queue(store_server, "unlock")
+    lease = store_server.COMMAND_LEASE_SECONDS
+    assert store_server.lease_next_command(now) is not None
+    assert store_server.lease_next_command(now + lease) is not None
+    assert store_server.lease_next_command(now + 2 * lease) is None
+    assert store_server.get_command_stats()["counters"]["dropped"] == 1
+
+
+def test_without_acks_command_is_removed_on_delivery(store_server, monkeypatch):
+    monkeypatch.setattr(store_server, "COMMAND_ACK_ENABLED", False)
+    now = queue(store_server, "unlock")
+    assert store_server.lease_next_command(now)["command"] == "unlock"
+    assert store_server.lease_next_command(now + store_server.COMMAND_LEASE_SECONDS) is None
+
+
+def test_poll_returns_id_and_ack_route_removes_command(server):
+    server.add_command_to_queue("unlock")
+    client = server.app.test_client()
+    command_id = client.get("/get_mobile_command").get_json()["id"]
+    assert client.post("/ack_command", json={"id": command_id}).get_json()["acked"] is True
+    assert server.get_command_stats()["pending"] == []
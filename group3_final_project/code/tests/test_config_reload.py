@@ -0,0 +1,85 @@
+"""Runtime config: validation of CONFIG_FILE values and what a reload changes"""
+
+import json
+
+import pytest
+
+
+@pytest.fixture
+def reload_server(server, monkeypatch):
+    """server whose reloadable settings and config state are restored after the test"""
+    for name in server.RELOADABLE_SETTINGS:
+        monkeypatch.setattr(server, name, getattr(server, name))
+    monkeypatch.setattr(server, "config_defaults", {})
+    monkeypatch.setattr(server, "config_status", dict(server.config_status))
+    return server
+
+
+@pytest.fixture
+def sampler_starts(server, monkeypatch):
+    """Calls to start_frame_sampler (no thread is started), with the config watcher marked as running"""
+    starts = []
+    monkeypatch.setattr(server, "config_watcher_thread", object())
+    monkeypatch.setattr(server, "start_frame_sampler", lambda: starts.append(True))
+    monkeypatch.setattr(server, "stop_frame_sampler", lambda: None)
+    return starts
+
+
+def write_config(tmp_path, **settings):
+    path = tmp_path / "server_config.json"
+    path.write_text(json.dumps(settings))
+    return str(path)
+
+
+@pytest.mark.parametrize("name, value, expected", [
+    ("SAMPLER_INTERVAL", 1, 1.0),
+    ("FACE_MIN_SIZE", [30, 30], (30, 30)),
+    ("RATE_LIMITS", {"verify_temp_password": [10, 0.5], "consume_temp_password": [10, 0.5],
+                     "temp_password_sync": [20, 1], "generate_temp_password": [5, 0.1],
+                     "list_temp_passwords": [10, 0.5]}, None),
+])
+def test_json_values_are_converted(server, name, value, expected):
+    converted = server.validate_setting(name, value)
+    if expected is None:
+        expected = server.RATE_LIMITS
+    assert converted == expected and type(converted) is type(expected)
+
+
+@pytest.mark.parametrize("name, value", [
+    ("SMTP_PORT", True),
+    ("SMTP_PORT", 70000),
+    ("SAMPLER_INTERVAL", "1"),
+    ("RATE_LIMITS", {"verify_temp_password": [10, 0.5]}),
+    ("CAPTURE_PROFILES", {"low": {"framesize": 5}}),
+])
+def test_invalid_values_are_rejected(server, name, value):
+    with pytest.raises(ValueError):
+        server.validate_setting(name, value)
+
+
+def test_unchanged_rate_limits_are_not_reported(reload_server, tmp_path):
+    limits = {endpoint: list(limit) for endpoint, limit in reload_server.RATE_LIMITS.items()}
+    assert reload_server.load_config(write_config(tmp_path, RATE_LIMITS=limits)) == []
+
+
+def test_reload_swaps_settings_and_restores_defaults(reload_server, tmp_path):
+    default = reload_server.SAMPLER_INTERVAL
+    assert reload_server.load_config(write_config(tmp_path, SAMPLER_INTERVAL=default + 1)) == ["SAMPLER_INTERVAL"]
+    assert reload_server.get_settings()["SAMPLER_INTERVAL"] == default + 1
+    assert reload_server.load_config(write_config(tmp_path)) == ["SAMPLER_INTERVAL"]
+    assert reload_server.SAMPLER_INTERVAL == default
+
+
+def test_unknown_setting_keeps_running_config(reload_server, tmp_path):
+    with pytest.raises(ValueError):
+        reload_server.load_config(write_config(tmp_path, SERVER_WORKERS=4))
+    assert reload_server.config_status["changed"] == []
+
+
+@pytest.mark.parametrize("worker, started", [(0, [True]), (1, [])])
+def test_reload_starts_sampler_in_first_worker_only(reload_server, sampler_starts, monkeypatch, tmp_path,
+                                                    worker, started):
+    monkeypatch.setattr(reload_server, "BACKGROUND_SAMPLER_ENABLED", False)
+    monkeypatch.setattr(reload_server, "worker_index", worker)
+    reload_server.load_config(write_config(tmp_path, BACKGROUND_SAMPLER_ENABLED=True))
+    assert sampler_starts == started
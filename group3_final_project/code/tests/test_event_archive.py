@@ -0,0 +1,68 @@
+"""Event archive: batched writer, door names in file names and cursor pagination of /events"""
+
+import os
+
+import pytest
+
+
+@pytest.fixture
+def archive(server, monkeypatch, tmp_path):
+    """server with an empty archive in tmp_path, returns (server, writer connection)"""
+    monkeypatch.setattr(server, "EVENT_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "event_db_local", type(server.event_db_local)())
+    conn = server.open_event_db()
+    yield server, conn
+    conn.close()
+    reader = getattr(server.event_db_local, "conn", None)
+    if reader is not None:
+        reader.close()
+
+
+def event(door, timestamp, frames=(b"jpeg",), face_count=0):
+    return {"door": door, "timestamp": timestamp, "face_count": face_count, "outcome": "no_face",
+            "source": "pir_trigger", "frames": list(frames), "selected_index": len(frames) - 1}
+
+
+def archived_files(root):
+    return sorted(name for _, _, names in os.walk(root) for name in names if name.endswith(".jpg"))
+
+
+def test_bad_event_does_not_roll_back_batch(archive, tmp_path):
+    server, conn = archive
+    # A str frame fails to write after the first JPEG of that event is on disk
+    server.write_event_batch(conn, [event("front_door", 1000.0),
+                                    event("back_door", 1001.0, frames=(b"jpeg", "not bytes")),
+                                    event("garage", 1002.0)])
+    events, _ = server.query_events()
+    assert [e["door"] for e in events] == ["front_door", "garage"]
+    assert archived_files(tmp_path) == ["1000000_front_door_0.jpg", "1002000_garage_0.jpg"]
+
+
+def test_file_name_never_leaves_the_archive(archive, tmp_path):
+    server, conn = archive
+    server.write_event_batch(conn, [event("../../etc/x", 1000.0)])
+    assert archived_files(tmp_path) == ["1000000_______etc_x_0.jpg"]
+
+
+def test_record_event_drops_unsafe_door(server, monkeypatch):
+    monkeypatch.setattr(server, "start_event_writer", lambda: None)
+    monkeypatch.setattr(server, "event_write_queue", type(server.event_write_queue)())
+    for door in ("../x", "a/b", "x\0", "", 7, None):
+        server.record_event(door, 0, "no_face", [b"jpeg"])
+    server.record_event("side-door_2", 0, "no_face", [b"jpeg"])
+    assert server.event_write_queue.qsize() == 1
+
+
+def test_cursor_pages_cover_every_event_once(archive):
+    server, conn = archive
+    # Two events share a timestamp, the cursor breaks the tie on id
+    server.write_event_batch(conn, [event("front_door", t, face_count=t % 2) for t in (1.0, 2.0, 2.0, 3.0, 4.0)])
+    seen, cursor = [], None
+    while True:
+        events, cursor = server.query_events(cursor=cursor, limit=2)
+        seen.extend(e["id"] for e in events)
+        if cursor is None:
+            break
+    assert seen == sorted(seen) and len(seen) == len(set(seen)) == 5
+    assert [e["timestamp"] for e in server.query_events(has_face=True)[0]] == [1.0, 3.0]
+    assert [e["timestamp"] for e in server.query_events(since=2.5)[0]] == [3.0, 4.0]
@@ -0,0 +1,66 @@
+"""Face tracking: boxes linked across frames by IoU or centroid distance, the vote counts one track"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def settings(server):
+    """Tracking on with the default matching thresholds pinned"""
+    return dict(server.get_settings(), FACE_TRACKING_ENABLED=True, TRACK_MIN_IOU=0.3,
+                TRACK_MAX_CENTROID_DISTANCE=0.6, TRACK_MIN_SCALE_RATIO=0.5, TRACK_MAX_GAP=1)
+
+
+def test_box_iou(server):
+    iou = server.box_iou([[0, 0, 10, 10]], [[0, 0, 10, 10], [5, 0, 10, 10], [20, 20, 10, 10]])
+    assert iou.shape == (1, 3)
+    assert iou[0].tolist() == pytest.approx([1.0, 50 / 150.0, 0.0])
+
+
+def test_walking_face_is_one_track_and_false_positive_another(server, settings):
+    frames = [
+        [[100, 100, 50, 50]],
+        [[112, 102, 50, 50], [300, 20, 30, 30]],  # One-off detection in the background
+        [[124, 104, 52, 52]],
+    ]
+    tracks = sorted(server.track_faces(frames, settings), key=lambda track: -track["hits"])
+    assert [track["frames"] for track in tracks] == [[0, 1, 2], [1]]
+    assert tracks[0]["stability"] == 1.0
+    assert tracks[0]["mean_iou"] > 0.5
+
+
+def test_faces_keep_their_tracks_when_boxes_come_in_another_order(server, settings):
+    frames = [[[0, 0, 40, 40], [200, 0, 40, 40]], [[204, 2, 40, 40], [4, 2, 40, 40]]]
+    tracks = server.track_faces(frames, settings)
+    assert [[box[0] for box in track["boxes"]] for track in tracks] == [[0, 4], [200, 204]]
+
+
+@pytest.mark.parametrize("frames, hits", [
+    ([[[0, 0, 40, 40]], [], [[2, 0, 40, 40]]], [2]),               # Missed one frame: same track
+    ([[[0, 0, 40, 40]], [], [], [[2, 0, 40, 40]]], [1, 1]),        # Gap too long: new track
+    ([[[0, 0, 40, 40]], [[10, 10, 12, 12]]], [1, 1]),              # Much smaller box: not the same face
+])
+def test_gap_and_scale_limits(server, settings, frames, hits):
+    assert [track["hits"] for track in server.track_faces(frames, settings)] == hits
+
+
+def detection(*boxes):
+    return {"has_face": bool(boxes), "boxes": [list(box) for box in boxes]}
+
+
+def test_vote_counts_frames_of_best_track(server, settings):
+    results = [detection((0, 0, 40, 40)), detection((300, 0, 40, 40)), detection((2, 0, 40, 40)),
+               detection((500, 0, 40, 40))]
+    flags, best = server.face_vote_frames(results, ["front"] * 4, settings)
+    assert flags == [True, False, True, False]
+    assert best["camera"] == "front" and best["hits"] == 2
+    # Without tracking every frame with a face counts
+    flags, best = server.face_vote_frames(results, ["front"] * 4, dict(settings, FACE_TRACKING_ENABLED=False))
+    assert flags == [True] * 4 and best is None
+
+
+def test_boxes_of_different_cameras_are_not_linked(server, settings):
+    results = [detection((0, 0, 40, 40)), detection((0, 0, 40, 40))]
+    flags, best = server.face_vote_frames(results, ["front", "porch"], settings)
+    assert best["hits"] == 1 and sum(flags) == 1
@@ -0,0 +1,49 @@
+"""Known-face index: enrolled embeddings in a memory-mapped file, matched with one matrix product"""
+
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+def embedding(seed):
+    vector = np.random.default_rng(seed).normal(size=128).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def index_server(server, monkeypatch, tmp_path):
+    """server with an empty known-face index in tmp_path"""
+    monkeypatch.setattr(server, "KNOWN_FACES_FILE", str(tmp_path / "known_faces.npy"))
+    monkeypatch.setattr(server, "KNOWN_FACES_NAMES_FILE", str(tmp_path / "known_faces.json"))
+    monkeypatch.setattr(server, "known_face_embeddings", None)
+    monkeypatch.setattr(server, "known_face_names", [])
+    return server
+
+
+def test_nothing_enrolled(index_server):
+    assert index_server.load_known_faces() == 0
+    assert index_server.match_known_faces(np.stack([embedding(1)])) == [(None, 0.0)]
+    assert index_server.match_known_faces(None) == []
+
+
+def test_enrolled_faces_are_matched_after_reload(index_server):
+    assert index_server.enroll_known_face("Alice", embedding(1)) == 1
+    assert index_server.enroll_known_face("Bob", embedding(2)) == 2
+    index_server.known_face_embeddings = None
+    assert index_server.load_known_faces() == 2
+    assert isinstance(index_server.known_face_embeddings, np.memmap)
+    # A slightly different view of Bob, and a stranger
+    bob = embedding(2) + 0.1 * embedding(3)
+    matches = index_server.match_known_faces(np.stack([bob / np.linalg.norm(bob), embedding(4)]))
+    assert matches[0][0] == "Bob" and matches[0][1] > 0.9
+    assert matches[1][0] is None
+
+
+def test_mismatched_names_file_is_rejected(index_server):
+    index_server.enroll_known_face("Alice", embedding(1))
+    with open(index_server.KNOWN_FACES_NAMES_FILE, "w") as f:
+        json.dump(["Alice", "Bob"], f)
+    with pytest.raises(ValueError):
+        index_server.load_known_faces()
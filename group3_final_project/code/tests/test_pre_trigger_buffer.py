@@ -0,0 +1,66 @@
+"""Background sampler ring buffer: frames from before a trigger are used first"""
+
+import threading
+
+import pytest
+
+
+class AliveThread:
+    def is_alive(self):
+        return True
+
+
+@pytest.fixture
+def sampler_server(server, monkeypatch):
+    """server with an empty frame buffer and a sampler that counts as running"""
+    monkeypatch.setattr(server, "frame_buffer", type(server.frame_buffer)())
+    monkeypatch.setattr(server, "sampler_thread", AliveThread())
+    monkeypatch.setattr(server, "sampler_stop_event", threading.Event())
+    return server
+
+
+def buffer_frames(server, camera_id, *times):
+    server.frame_buffer.extend((t, b"jpeg", "http://cam", camera_id) for t in times)
+
+
+def test_frames_outside_lookback_are_skipped(sampler_server):
+    lookback = sampler_server.get_settings()["PRE_TRIGGER_LOOKBACK"]
+    buffer_frames(sampler_server, "front", 100 - lookback - 0.5, 100 - lookback, 99.5, 100.5)
+    frames = sampler_server.get_pre_trigger_frames(100.0)
+    assert [frame[0] for frame in frames] == [100 - lookback, 99.5]
+
+
+def test_frames_are_spread_over_the_window(sampler_server, monkeypatch):
+    monkeypatch.setitem(sampler_server.get_settings(), "PRE_TRIGGER_LOOKBACK", 2.0)
+    buffer_frames(sampler_server, "front", 98.0, 98.4, 98.8, 99.2, 99.6, 100.0)
+    frames = sampler_server.get_pre_trigger_frames(100.0, count=3)
+    assert [frame[0] for frame in frames] == [98.0, 98.8, 100.0]
+    assert [frame[0] for frame in sampler_server.get_pre_trigger_frames(100.0, count=1)] == [100.0]
+
+
+def test_only_the_door_cameras_are_used(sampler_server):
+    buffer_frames(sampler_server, "front", 99.0)
+    buffer_frames(sampler_server, "garage", 99.5)
+    frames = sampler_server.get_pre_trigger_frames(100.0, camera_ids=["front"])
+    assert [frame[3] for frame in frames] == ["front"]
+
+
+def test_no_frames_without_sampler(sampler_server, monkeypatch):
+    buffer_frames(sampler_server, "front", 99.0)
+    monkeypatch.setattr(sampler_server, "sampler_thread", None)
+    assert sampler_server.get_pre_trigger_frames(100.0) == []
+
+
+def test_sampler_fetches_every_registered_camera(sampler_server, monkeypatch):
+    monkeypatch.setattr(sampler_server, "camera_registry", {"front": "http://front", "garage": "http://garage"})
+    fetched = []
+
+    def fetch(cameras, max_retries=3, quiet=False, settings=None):
+        fetched.append(sorted(cameras))
+        sampler_server.sampler_stop_event.set()
+        return [(camera_id, b"jpeg" if camera_id == "front" else None, url) for camera_id, url in cameras]
+
+    monkeypatch.setattr(sampler_server, "fetch_camera_frames", fetch)
+    sampler_server.frame_sampler_loop()
+    assert fetched == [[("front", "http://front"), ("garage", "http://garage")]]
+    assert [frame[3] for frame in sampler_server.frame_buffer] == ["front"]
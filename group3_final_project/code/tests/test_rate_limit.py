@@ -0,0 +1,65 @@
+"""Token bucket refill and per-client rate limits (RATE_LIMITS)"""
+
+import pytest
+
+
+def test_bucket_allows_burst_then_reports_wait(server):
+    bucket = [5.0, 0.0]
+    assert [server.take_bucket_token(bucket, 5, 0.5, 0.0) for _ in range(5)] == [0] * 5
+    assert server.take_bucket_token(bucket, 5, 0.5, 0.0) == pytest.approx(2.0)
+
+
+def test_bucket_refills_at_rate(server):
+    bucket = [0.0, 0.0]
+    assert server.take_bucket_token(bucket, 5, 0.5, 1.0) == pytest.approx(1.0)
+    assert server.take_bucket_token(bucket, 5, 0.5, 2.0) == 0
+    assert server.take_bucket_token(bucket, 5, 0.5, 2.0) == pytest.approx(2.0)
+
+
+def test_bucket_refill_is_capped_at_capacity(server):
+    bucket = [0.0, 0.0]
+    allowed = [server.take_bucket_token(bucket, 5, 0.5, 1000.0) == 0 for _ in range(6)]
+    assert allowed == [True] * 5 + [False]
+
+
+def test_client_limit_refills(store_server):
+    now = 1000.0
+    capacity, refill_rate = store_server.RATE_LIMITS["verify_temp_password"]
+    for _ in range(capacity):
+        assert store_server.take_rate_limit_token("verify_temp_password", "10.0.0.1", now) == 0
+    assert store_server.take_rate_limit_token("verify_temp_password", "10.0.0.1", now) > 0
+    assert store_server.take_rate_limit_token("verify_temp_password", "10.0.0.1", now + 1 / refill_rate) == 0
+
+
+def test_clients_and_endpoints_have_separate_buckets(store_server):
+    now = 1000.0
+    capacity, _ = store_server.RATE_LIMITS["verify_temp_password"]
+    for _ in range(capacity + 1):
+        store_server.take_rate_limit_token("verify_temp_password", "10.0.0.1", now)
+    assert store_server.take_rate_limit_token("verify_temp_password", "10.0.0.2", now) == 0
+    assert store_server.take_rate_limit_token("consume_temp_password", "10.0.0.1", now) == 0
+
+
+def test_shared_prune_keeps_only_partly_used_buckets(store_server):
+    if not store_server.SHARED_STATE_DB:
+        pytest.skip("pruning only applies to SHARED_STATE_DB")
+    capacity, refill_rate = store_server.RATE_LIMITS["verify_temp_password"]
+    store_server.take_rate_limit_token("verify_temp_password", "idle", 1000.0)
+    later = 1000.0 + max(capacity / refill_rate, store_server.RATE_LIMIT_PRUNE_INTERVAL) + 1
+    store_server.take_rate_limit_token("verify_temp_password", "active", later)
+    names = [row[0] for row in store_server.get_shared_state_db().execute(
+        "SELECT name FROM state WHERE name LIKE 'rate_limit:%'")]
+    assert names == ["rate_limit:verify_temp_password:active"]
+
+
+@pytest.mark.parametrize("path", ["/list_temp_passwords", "/temp_password_sync"])
+def test_endpoint_returns_429_with_retry_after(server, monkeypatch, path):
+    monkeypatch.setattr(server, "RATE_LIMIT_ENABLED", True)
+    endpoint = path.lstrip("/")
+    monkeypatch.setitem(server.RATE_LIMITS, endpoint, (2, 0.5))
+    client = server.app.test_client()
+    statuses = [client.get(path).status_code for _ in range(2)]
+    response = client.get(path)
+    assert 429 not in statuses
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
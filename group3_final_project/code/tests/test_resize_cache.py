@@ -0,0 +1,54 @@
+"""Resized image variants: encoded once per frame and size, kept in a byte-bounded LRU cache"""
+
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+
+def jpeg(width, height, seed=0):
+    image = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+
+
+@pytest.fixture
+def resize_server(server, monkeypatch):
+    """server with an empty resize cache"""
+    monkeypatch.setattr(server, "resize_cache", type(server.resize_cache)())
+    monkeypatch.setattr(server, "resize_cache_bytes", 0)
+    return server
+
+
+def width_of(image_data):
+    return cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR).shape[1]
+
+
+def test_full_size_is_the_original(resize_server):
+    frame = jpeg(800, 600)
+    assert resize_server.get_resized_image(frame, "full") is frame
+    assert resize_server.get_resized_image(frame, None) is frame
+    with pytest.raises(ValueError):
+        resize_server.get_resized_image(frame, "huge")
+
+
+def test_variant_is_scaled_and_cached(resize_server, monkeypatch):
+    frame = jpeg(800, 600)
+    small = resize_server.get_resized_image(frame, "small")
+    assert width_of(small) == resize_server.IMAGE_SIZES["small"][0]
+    assert len(small) < len(frame)
+    # A cache hit never decodes the frame again
+    monkeypatch.setattr(resize_server.cv2, "imdecode", None)
+    assert resize_server.get_resized_image(frame, "small", resize_server.get_frame_id(frame)) is small
+    assert resize_server.resize_cache_bytes == len(small)
+
+
+def test_least_recently_used_variant_is_evicted(resize_server, monkeypatch):
+    frames = [jpeg(800, 600, seed) for seed in range(3)]
+    first = resize_server.get_resized_image(frames[0], "thumb")
+    monkeypatch.setattr(resize_server, "RESIZE_CACHE_MAX_BYTES", len(first) * 2 + len(first) // 2)
+    resize_server.get_resized_image(frames[1], "thumb")
+    resize_server.get_resized_image(frames[0], "thumb")  # Now the most recently used
+    resize_server.get_resized_image(frames[2], "thumb")
+    cached = {frame_id for frame_id, _ in resize_server.resize_cache}
+    assert cached == {resize_server.get_frame_id(frames[0]), resize_server.get_frame_id(frames[2])}
+    assert resize_server.resize_cache_bytes == sum(len(data) for data in resize_server.resize_cache.values())
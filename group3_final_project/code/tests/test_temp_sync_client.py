@@ -0,0 +1,31 @@
+"""Offline temporary password uses on the door: a used code stays refused until the server destroys it"""
+
+from door_protocol import temp_password_hash
+
+
+def sync(client, salt, version, *codes):
+    client.apply_temp_sync({
+        "changed": True,
+        "version": version,
+        "salt": salt,
+        "codes": [[temp_password_hash(client.DEVICE_SECRET, code, salt), 3600] for code in codes],
+    })
+
+
+def test_code_is_accepted_once(client):
+    sync(client, "salt1", 1, "123456")
+    assert client.verify_temp_password_local("123456") is True
+    assert client.verify_temp_password_local("123456") is None
+
+
+def test_unreported_use_survives_salt_rotation(client):
+    sync(client, "salt1", 1, "123456", "654321")
+    assert client.verify_temp_password_local("123456") is True
+    # Report failed (server unreachable), the next sync still lists the code under a rotated salt
+    sync(client, "salt2", 2, "123456", "654321")
+    assert client.verify_temp_password_local("123456") is None
+    assert client.verify_temp_password_local("654321") is True
+    # The pending report keeps the hash and salt the code was accepted with
+    code, code_hash, salt = client.pending_temp_uses[0]
+    assert (code, salt) == ("123456", "salt1")
+    assert code_hash == temp_password_hash(client.DEVICE_SECRET, "123456", "salt1")
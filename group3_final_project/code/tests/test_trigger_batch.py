@@ -0,0 +1,109 @@
+"""Validation and handling of batched PIR triggers (POST /trigger with "events")"""
+
+import time
+
+import pytest
+
+
+@pytest.fixture
+def started_detections(server, monkeypatch):
+    """(door, trigger time) of each face detection started (detection itself is not run)"""
+    started = []
+    monkeypatch.setattr(server, "start_face_detection",
+                        lambda door, trigger_time: started.append((door, trigger_time)) or True)
+    return started
+
+
+@pytest.fixture
+def recorded_events(server, monkeypatch):
+    """Outcomes passed to record_event (nothing is written to the event store)"""
+    outcomes = []
+    monkeypatch.setattr(server, "record_event",
+                        lambda door, face_count, outcome, frames, **kwargs: outcomes.append(outcome))
+    return outcomes
+
+
+@pytest.fixture
+def trigger_server(server, started_detections, recorded_events):
+    return server
+
+
+def post_events(server, events):
+    return server.app.test_client().post("/trigger", json={"events": events})
+
+
+@pytest.mark.parametrize("events", [
+    [{"age": 3}],
+    [{"age": 2.5, "door": "front_door"}],
+    [{"age": None}],
+    [{}],
+    [],
+])
+def test_valid_events_are_accepted(trigger_server, events):
+    response = post_events(trigger_server, events)
+    assert response.status_code == 200
+    assert response.get_json()["accepted"] == len(events)
+
+
+@pytest.mark.parametrize("events", [
+    [5],
+    [None],
+    ["age"],
+    [{"age": "3"}],
+    [{"age": True}],
+    [{"age": [1]}],
+    [{"age": 3, "door": 7}],
+    [{"age": 3}, {"age": "late"}],
+    {"age": 3},
+])
+def test_malformed_events_are_rejected(trigger_server, started_detections, recorded_events, events):
+    response = post_events(trigger_server, events)
+    assert response.status_code == 400
+    assert started_detections == []
+    assert recorded_events == []
+
+
+def test_too_many_events_are_rejected(trigger_server):
+    response = post_events(trigger_server, [{"age": 1}] * (trigger_server.TRIGGER_BATCH_MAX + 1))
+    assert response.status_code == 400
+
+
+def test_only_freshest_live_event_starts_detection(trigger_server, started_detections, recorded_events):
+    window = trigger_server.TRIGGER_LIVE_WINDOW
+    before = time.time()
+    response = post_events(trigger_server, [{"age": window + 60}, {"age": 5}, {"age": 1}, {"age": None}])
+    assert response.get_json()["detection"] == "started"
+    [(door, trigger_time)] = started_detections
+    assert door == trigger_server.DEFAULT_DOOR_ID
+    assert before - 1 <= trigger_time <= time.time() - 1
+    assert recorded_events == ["delayed_trigger"] * 3
+
+
+def test_late_events_are_only_archived(trigger_server, started_detections, recorded_events):
+    response = post_events(trigger_server, [{"age": trigger_server.TRIGGER_LIVE_WINDOW + 1}, {"age": None}])
+    assert response.get_json()["detection"] == "skipped"
+    assert started_detections == []
+    assert recorded_events == ["delayed_trigger"] * 2
+
+
+@pytest.mark.parametrize("door", ["../../tmp/x", "front_door/..", "x\0", "", "back_door"])
+def test_bad_door_rejects_only_its_event(trigger_server, started_detections, recorded_events, door):
+    window = trigger_server.TRIGGER_LIVE_WINDOW
+    response = post_events(trigger_server, [{"age": window + 60}, {"age": 1, "door": door}, {"age": None}])
+    assert response.status_code == 200
+    assert (response.get_json()["accepted"], response.get_json()["rejected"]) == (2, 1)
+    assert started_detections == []
+    assert recorded_events == ["delayed_trigger"] * 2
+
+
+def test_configured_door_is_accepted(trigger_server, started_detections, monkeypatch):
+    monkeypatch.setattr(trigger_server, "door_cameras", {"front_door": ["cam0"], "back_door": ["cam0"]})
+    response = post_events(trigger_server, [{"age": 1, "door": "back_door"}])
+    assert response.get_json()["rejected"] == 0
+    assert [door for door, _ in started_detections] == ["back_door"]
+
+
+def test_single_trigger_for_unknown_door_is_rejected(trigger_server, started_detections):
+    response = trigger_server.app.test_client().post("/trigger", json={"door": "../x"})
+    assert response.status_code == 400
+    assert started_detections == []
@@ -0,0 +1,56 @@
+"""Trigger store-and-forward on the door: a delivered batch removes exactly the triggers it carried"""
+
+import pytest
+
+from sim import simtime
+
+
+@pytest.fixture
+def queue_client(client, monkeypatch, tmp_path):
+    """client with a 4 trigger RAM queue and a spill file in tmp_path"""
+    monkeypatch.setattr(client, "TRIGGER_QUEUE_SIZE", 4)
+    monkeypatch.setattr(client, "trigger_queue_times", client.array.array('i', [0] * 4))
+    monkeypatch.setattr(client, "TRIGGER_SPILL_FILE", str(tmp_path / "trigger_queue.txt"))
+    simtime.advance(1000 * 1000000)
+    return client
+
+
+def batch_times(client):
+    """(trigger times in the next batch, spill lines it includes)"""
+    body, spill_count = client.get_trigger_batch()
+    now = int(client.time.time())
+    return [now - event["age"] for event in body["events"]], spill_count
+
+
+def test_triggers_queued_during_request_stay(queue_client):
+    for t in (1, 2, 3):
+        queue_client.enqueue_trigger(t)
+    times, spill_count = batch_times(queue_client)
+    assert times == [1, 2, 3]
+    queue_client.enqueue_trigger(4)  # While the POST is awaited
+    queue_client.clear_trigger_batch(spill_count)
+    assert batch_times(queue_client)[0] == [4]
+
+
+def test_triggers_spilled_during_request_stay(queue_client):
+    for t in range(1, 7):
+        queue_client.enqueue_trigger(t)  # 1 and 2 spill to flash
+    times, spill_count = batch_times(queue_client)
+    assert (times, spill_count) == ([1, 2, 3, 4, 5, 6], 2)
+    for t in (7, 8, 9):
+        queue_client.enqueue_trigger(t)  # 3, 4 and 5 (already sent) spill behind 1 and 2
+    queue_client.clear_trigger_batch(spill_count)
+    assert batch_times(queue_client)[0] == [7, 8, 9]
+    assert queue_client.pending_trigger_count() == 3
+
+
+def test_failed_request_keeps_everything(queue_client):
+    for t in range(1, 7):
+        queue_client.enqueue_trigger(t)
+    batch_times(queue_client)
+    queue_client.trigger_flush_failed()
+    queue_client.enqueue_trigger(7)  # Spills 3, which is no longer in flight
+    times, spill_count = batch_times(queue_client)
+    assert (times, spill_count) == ([1, 2, 3, 4, 5, 6, 7], 3)
+    queue_client.clear_trigger_batch(spill_count)
+    assert queue_client.pending_trigger_count() == 0